@@ -0,0 +1,243 @@
+"""
+The benchmark cases. Every case seeds python, numpy and torch with the
+given seed, does its untimed setup, then times its workload and returns
+(count, seconds, unit), count being the number of units done. scale
+multiplies the size of the workloads.
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+from torch import multiprocessing as mp
+
+from hanamikoji.env.env import get_obs, NUM_MOVES, PAD_MOVE_ID
+from hanamikoji.env.deals import save_deals
+from hanamikoji.env.game import GameEnv, deck, DEALS_PER_GAME
+from hanamikoji.env.move_generator import MovesGener
+
+
+def _seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+class _RecordingAgent:
+    """
+    Random agent keeping the infosets it is asked to act on.
+    """
+
+    def __init__(self, rng, infosets=None):
+        self.rng = rng
+        self.infosets = infosets
+
+    def act(self, infoset):
+        if self.infosets is not None:
+            self.infosets.append(infoset)
+        moves = infoset[1].moves
+        return moves[self.rng.randrange(len(moves))]
+
+
+def _play_random_games(num_games, seed, infosets=None):
+    """
+    Plays num_games random games, returns the number of steps.
+    """
+    agent = _RecordingAgent(random.Random(seed), infosets)
+    env = GameEnv({'first': agent, 'second': agent})
+    num_steps = 0
+    for _ in range(num_games):
+        env.card_play_init(env.get_new_round_play_data())
+        while not env.winner:
+            env.step()
+            num_steps += 1
+        env.reset()
+    return num_steps
+
+
+def _record_infosets(num_games, seed):
+    infosets = []
+    _play_random_games(num_games, seed, infosets)
+    return infosets
+
+
+def _scaled(n, scale):
+    return max(1, int(n * scale))
+
+
+def bench_gen_moves(seed, scale):
+    _seed(seed)
+    inputs = []
+    for state, info in _record_infosets(_scaled(100, scale), seed):
+        curr = state.acting_player_id
+        decision_cards_2_2 = state.decision_cards_2_2
+        inputs.append((list(info.hand_cards),
+                       list(state.action_cards[curr]),
+                       list(state.decision_cards_1_2) if state.decision_cards_1_2 else None,
+                       [list(decision_cards_2_2[0]), list(decision_cards_2_2[1])] if decision_cards_2_2 else None))
+    start = time.perf_counter()
+    for cards_list, action_cards, choose_1_2, choose_2_2 in inputs:
+        MovesGener(cards_list, action_cards, choose_1_2, choose_2_2).gen_moves()
+    return len(inputs), time.perf_counter() - start, 'calls/s'
+
+
+def bench_game_step(seed, scale):
+    _seed(seed)
+    start = time.perf_counter()
+    num_steps = _play_random_games(_scaled(200, scale), seed)
+    return num_steps, time.perf_counter() - start, 'steps/s'
+
+
+def bench_random_games(seed, scale):
+    _seed(seed)
+    num_games = _scaled(200, scale)
+    start = time.perf_counter()
+    _play_random_games(num_games, seed)
+    return num_games, time.perf_counter() - start, 'games/s'
+
+
+def bench_get_obs(seed, scale):
+    _seed(seed)
+    infosets = _record_infosets(_scaled(100, scale), seed)
+    start = time.perf_counter()
+    for infoset in infosets:
+        get_obs(infoset)
+    return len(infosets), time.perf_counter() - start, 'obs/s'
+
+
+def bench_lstm_forward(seed, scale):
+    """
+    One forward pass per decision of random games, so the candidate move
+    counts follow the real distribution.
+    """
+    from hanamikoji.dmc.models import LstmModel
+    _seed(seed)
+    model = LstmModel()
+    model.eval()
+    inputs = []
+    for infoset in _record_infosets(_scaled(20, scale), seed):
+        obs = get_obs(infoset)
+        inputs.append((torch.from_numpy(obs['z'][None]).float(), torch.from_numpy(obs['x_batch'])))
+    with torch.no_grad():
+        start = time.perf_counter()
+        for z, x in inputs:
+            model.forward(z, x)
+    return len(inputs), time.perf_counter() - start, 'decisions/s'
+
+
+def _seeded_act(seed, *args):
+    from hanamikoji.dmc.utils import act
+    _seed(seed)
+    act(*args)
+
+
+def bench_act(seed, scale):
+    """
+    Frames/s of one actor process with a CPU model, the startup of the
+    process and its first buffer are not timed.
+    """
+    from hanamikoji.dmc import parser
+    from hanamikoji.dmc.models import Model
+    from hanamikoji.dmc.utils import create_buffers
+    _seed(seed)
+    flags = parser.parse_args(['--actor_device_cpu', '--training_device', 'cpu', '--num_actors', '1',
+                               '--unroll_length', '20', '--num_buffers', '4'])
+    num_buffers = _scaled(40, scale)
+    ctx = mp.get_context('spawn')
+    model = Model(device='cpu')
+    model.share_memory()
+    model.eval()
+    buffers = create_buffers(flags, ['cpu'])['cpu']
+    free_queue = {p: ctx.SimpleQueue() for p in ['first', 'second']}
+    full_queue = {p: ctx.SimpleQueue() for p in ['first', 'second']}
+    for p in ['first', 'second']:
+        for m in range(flags.num_buffers):
+            free_queue[p].put(m)
+    actor = ctx.Process(target=_seeded_act, args=(seed, 0, 'cpu', free_queue, full_queue, model, buffers, flags),
+                        daemon=True)
+    actor.start()
+    try:
+        count = -1
+        while count < num_buffers:
+            for p in ['first', 'second']:
+                while not full_queue[p].empty():
+                    free_queue[p].put(full_queue[p].get())
+                    count += 1
+                    if count == 0:
+                        start = time.perf_counter()
+            time.sleep(0.001)
+        seconds = time.perf_counter() - start
+    finally:
+        actor.kill()
+        actor.join()
+    return count * flags.unroll_length, seconds, 'frames/s'
+
+
+def bench_learn(seed, scale):
+    """
+    Learner steps/s with the default batch size and unroll length on
+    random rollouts, the weights are published to one actor model.
+    """
+    from hanamikoji.dmc import parser
+    from hanamikoji.dmc.dmc import WeightPublisher, learn
+    from hanamikoji.dmc.models import Model
+    from hanamikoji.dmc.utils import create_optimizers, get_buffer_specs
+    _seed(seed)
+    flags = parser.parse_args(['--actor_device_cpu', '--training_device', 'cpu'])
+    batch = {}
+    for key, spec in get_buffer_specs(flags).items():
+        size = (flags.batch_size,) + spec['size']
+        if key == 'obs_move_id':
+            batch[key] = torch.randint(NUM_MOVES, size, dtype=spec['dtype'])
+        elif key == 'obs_z_ids':
+            batch[key] = torch.randint(PAD_MOVE_ID + 1, size, dtype=spec['dtype'])
+        elif key == 'target':
+            batch[key] = torch.rand(size) * 2 - 1
+        elif key == 'obs_x_no_move':
+            batch[key] = torch.randint(3, size, dtype=spec['dtype'])
+        else:
+            batch[key] = torch.zeros(size, dtype=spec['dtype'])
+    learner_model = Model(device='cpu')
+    model = learner_model.get_model('first')
+    optimizer = create_optimizers(flags, learner_model)['first']
+    publisher = WeightPublisher('first', {'cpu': Model(device='cpu')}, flags)
+    lock = threading.Lock()
+    num_steps = _scaled(10, scale)
+    # Warm up step
+    learn('first', publisher, model, batch, optimizer, flags, lock)
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        learn('first', publisher, model, batch, optimizer, flags, lock)
+    return num_steps, time.perf_counter() - start, 'steps/s'
+
+
+def bench_evaluate(seed, scale):
+    """
+    Random vs random games/s of simulation.evaluate with two workers, both
+    seatings of a deal count as games.
+    """
+    from hanamikoji.evaluation.simulation import evaluate
+    _seed(seed)
+    num_games = _scaled(200, scale)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        eval_data = os.path.join(tmpdir, 'eval_data.npy')
+        save_deals(eval_data, np.stack([np.random.permutation(deck) for _ in range(num_games * DEALS_PER_GAME)]))
+        start = time.perf_counter()
+        evaluate('random', 'random', eval_data, 2)
+        seconds = time.perf_counter() - start
+    return 2 * num_games, seconds, 'games/s'
+
+
+BENCHMARKS = {
+    'gen_moves': bench_gen_moves,
+    'game_step': bench_game_step,
+    'random_games': bench_random_games,
+    'get_obs': bench_get_obs,
+    'lstm_forward': bench_lstm_forward,
+    'act': bench_act,
+    'learn': bench_learn,
+    'evaluate': bench_evaluate,
+}
@@ -0,0 +1,144 @@
+"""
+Runs the benchmarks, writes the results as JSON and compares them with a
+baseline file written by an earlier run. Every result is a throughput, a
+case regresses if it is slower than the baseline by more than the
+threshold. Run it from the repository root:
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --baseline bench.json --threshold 0.1
+
+The stored baseline is benchmarks/baseline.json, it is used by default
+when it exists (--baseline '' skips the comparison). The throughputs
+depend on the machine, so regenerate it on the machine that gates the
+changes, from the commit the changes are compared against:
+
+    python -m benchmarks.run --output benchmarks/baseline.json
+
+The comparison warns if the baseline was recorded on another machine or
+with another workload (seed, scale).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import traceback
+
+import torch
+
+from .cases import BENCHMARKS
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='HanamikojiZero: benchmarks')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), type=str,
+                        help='Comma separated benchmarks to run (default: all of them)')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--scale', default=1.0, type=float,
+                        help='Multiplies the size of the workloads')
+    parser.add_argument('--repeats', default=3, type=int,
+                        help='Every benchmark is run this many times, the best run is reported')
+    parser.add_argument('--output', default='', type=str,
+                        help='Where the results are written as JSON')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, type=str,
+                        help='Results of an earlier run to compare with (default: benchmarks/baseline.json if it '
+                             'exists, \'\' skips the comparison)')
+    parser.add_argument('--threshold', default=0.1, type=float,
+                        help='Max allowed relative slowdown against the baseline')
+    return parser
+
+
+def get_meta(flags):
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': flags.seed,
+        'scale': flags.scale,
+        'repeats': flags.repeats,
+    }
+
+
+def check_baseline_meta(meta, baseline_meta):
+    """
+    Warns about the differences between the setup of this run and the one of the baseline.
+    """
+    for key in ['platform', 'cpu_count', 'python', 'torch', 'seed', 'scale']:
+        if baseline_meta.get(key) != meta[key]:
+            print('Warning: the baseline was recorded with {}={}, this run has {}'.format(
+                key, baseline_meta.get(key), meta[key]))
+
+
+def run_benchmark(name, seed, scale, repeats):
+    best = None
+    for _ in range(repeats):
+        count, seconds, unit = BENCHMARKS[name](seed, scale)
+        value = count / seconds
+        if best is None or value > best['value']:
+            best = {'value': value, 'unit': unit, 'count': count, 'seconds': seconds}
+    return best
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the names of the benchmarks slower than the baseline by more than threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or 'value' not in result or 'value' not in baseline[name]:
+            continue
+        ratio = result['value'] / baseline[name]['value']
+        result['baseline'] = baseline[name]['value']
+        result['ratio'] = ratio
+        if ratio < 1 - threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(flags):
+    results = {}
+    for name in flags.only.split(','):
+        if name not in BENCHMARKS:
+            raise ValueError('Unknown benchmark: ' + name)
+        print('Running', name, flush=True)
+        try:
+            results[name] = run_benchmark(name, flags.seed, flags.scale, flags.repeats)
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = {'error': repr(e)}
+
+    meta = get_meta(flags)
+    regressions = []
+    if flags.baseline == DEFAULT_BASELINE and not os.path.exists(DEFAULT_BASELINE):
+        print('No baseline at {}, see benchmarks/run.py to create one'.format(DEFAULT_BASELINE))
+    elif flags.baseline:
+        with open(flags.baseline) as f:
+            baseline = json.load(f)
+        check_baseline_meta(meta, baseline.get('meta', {}))
+        regressions = compare(results, baseline['results'], flags.threshold)
+
+    print()
+    print('{:<14} {:>14} {:<12} {:>10}'.format('benchmark', 'value', 'unit', 'baseline'))
+    for name, result in results.items():
+        if 'error' in result:
+            print('{:<14} {}'.format(name, result['error']))
+            continue
+        ratio = '{:.1%}'.format(result['ratio']) if 'ratio' in result else '-'
+        print('{:<14} {:>14.1f} {:<12} {:>10}{}'.format(name, result['value'], result['unit'], ratio,
+                                                       '  REGRESSION' if name in regressions else ''))
+
+    if flags.output:
+        with open(flags.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    failed = regressions or any('error' in result for result in results.values())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(get_parser().parse_args()))
@@ -1,6 +1,7 @@
 import os 
 import argparse
 
+from hanamikoji.evaluation.sequential import SPRT, ConfidenceStop
 from hanamikoji.evaluation.simulation import evaluate
 
 if __name__ == '__main__':
@@ -10,15 +11,58 @@ if __name__ == '__main__':
     parser.add_argument('--second', type=str,
             default='baselines/hanamikojizero/second.ckpt')
     parser.add_argument('--eval_data', type=str,
-            default='eval_data.pkl')
+            default='eval_data.npy')
+    parser.add_argument('--pickle_deals_per_game', type=int, default=30,
+            help='Number of deals per game of a legacy pickle --eval_data, the first 20 of every game are played')
     parser.add_argument('--num_workers', type=int, default=5)
+    parser.add_argument('--chunk_size', type=int, default=50,
+            help='Number of games the workers take from the queue at a time')
     parser.add_argument('--gpu_device', type=str, default='')
+    parser.add_argument('--factorized', action='store_true',
+            help='Use the factorized first layer export of the models')
+    parser.add_argument('--early_stop', default='none', type=str, choices=['none', 'sprt', 'ci'],
+            help='Stop once a sequential probability ratio test or the confidence interval of the win rate '
+                 'of first decides the result')
+    parser.add_argument('--sprt_p0', type=float, default=0.5,
+            help='Win rate of first under H0 of the SPRT')
+    parser.add_argument('--sprt_p1', type=float, default=0.55,
+            help='Win rate of first under H1 of the SPRT')
+    parser.add_argument('--sprt_alpha', type=float, default=0.05)
+    parser.add_argument('--sprt_beta', type=float, default=0.05)
+    parser.add_argument('--confidence', type=float, default=0.95,
+            help='Confidence level of the reported interval of the win rate')
+    parser.add_argument('--ci_width', type=float, default=0.02,
+            help='With --early_stop ci stop once the interval is narrower than this')
+    parser.add_argument('--min_games', type=int, default=1000,
+            help='Number of games played before stopping early')
+    parser.add_argument('--profile', default=None, type=str, choices=['cprofile', 'torch', 'both'],
+            help='Profile a window of the selected workers')
+    parser.add_argument('--profile_targets', type=str, default='worker_0',
+            help='Comma separated profiled workers: worker_<index>')
+    parser.add_argument('--profile_steps', type=int, default=1000,
+            help='Number of profiled iterations, each plays a deal with both seatings')
+    parser.add_argument('--profile_skip', type=int, default=100,
+            help='Number of iterations before the profiled window')
+    parser.add_argument('--profile_dir', type=str, default='profile',
+            help='Where the traces are saved')
     args = parser.parse_args()
 
     os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
     os.environ["CUDA_VISIBLE_DEVICES"] = args.gpu_device
 
+    stopping = None
+    if args.early_stop == 'sprt':
+        stopping = SPRT(args.sprt_p0, args.sprt_p1, args.sprt_alpha, args.sprt_beta, args.confidence,
+                        args.min_games)
+    elif args.early_stop == 'ci':
+        stopping = ConfidenceStop(args.ci_width, args.confidence, args.min_games)
+
     evaluate(args.first,
              args.second,
              args.eval_data,
-             args.num_workers)
+             args.num_workers,
+             args.factorized,
+             args,
+             args.chunk_size,
+             stopping,
+             args.pickle_deals_per_game)
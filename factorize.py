@@ -0,0 +1,57 @@
+import argparse
+import torch
+from hanamikoji.dmc.models import FactorizedLstmModel, check_factorized
+from hanamikoji.env.env import get_obs
+from hanamikoji.env.game import GameEnv
+from hanamikoji.evaluation.deep_agent import checkpoint_digest, load_model
+from hanamikoji.evaluation.random_agent import RandomAgent
+
+
+class RecordingAgent(RandomAgent):
+    """
+    Plays randomly and records the observations of its decisions.
+    """
+    def __init__(self, obs_list):
+        super().__init__()
+        self.obs_list = obs_list
+
+    def act(self, infoset):
+        self.obs_list.append(get_obs(infoset))
+        return super().act(infoset)
+
+
+def collect_obs(num_games):
+    obs_list = []
+    agent = RecordingAgent(obs_list)
+    env = GameEnv({'first': agent, 'second': agent})
+    for _ in range(num_games):
+        env.card_play_init(env.get_new_round_play_data())
+        while not env.winner:
+            env.step()
+        env.reset()
+    return obs_list
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='HanamikojiZero: export models with a factorized first layer')
+    parser.add_argument('--ckpt_dir', default='baselines', type=str,
+                        help='Folder with first.ckpt and second.ckpt')
+    parser.add_argument('--num_games', default=100, type=int,
+                        help='Number of random games used to validate the export')
+    parser.add_argument('--tolerance', default=1e-4, type=float)
+    return parser
+
+
+if __name__ == '__main__':
+    flags = get_parser().parse_args()
+    obs_list = collect_obs(flags.num_games)
+    for p in ['first', 'second']:
+        model = load_model(p, flags.ckpt_dir)
+        factorized = FactorizedLstmModel.from_model(model)
+        max_diff = check_factorized(model, factorized, obs_list)
+        print(f'{p}: {len(obs_list)} observations, max abs difference {max_diff:.3g}')
+        assert max_diff < flags.tolerance, 'The factorized model does not match the original one'
+        # The digest of the source checkpoint tells the loader whether the export is stale
+        torch.save({'source_digest': checkpoint_digest(f'{flags.ckpt_dir}/{p}.ckpt'),
+                    'state_dict': factorized.state_dict()},
+                   f'{flags.ckpt_dir}/{p}_factorized.ckpt')
@@ -1,27 +1,40 @@
 import argparse
+import os
 import pickle
-import numpy as np
-from hanamikoji.env.game import get_card_play_data
+import tempfile
+from hanamikoji.env.deals import LEGACY_DEALS_PER_GAME, generate_deals, load_deals
+from hanamikoji.env.game import DEALS_PER_GAME
 
 
 def get_parser():
     parser = argparse.ArgumentParser(description='HanamikojiZero: random data generator')
     parser.add_argument('--output', default='eval_data', type=str)
     parser.add_argument('--num_games', default=10000, type=int)
+    parser.add_argument('--seed', default=None, type=int,
+                        help='Seed of the deals (default: random)')
+    parser.add_argument('--num_workers', default=1, type=int,
+                        help='Number of processes generating the deals, the deals do not depend on it')
+    parser.add_argument('--pickle', action='store_true',
+                        help='Save the legacy pickle of card_play_data dicts (30 deals per game) instead of a .npy '
+                             'deal file')
     return parser
 
 
 if __name__ == '__main__':
     flags = get_parser().parse_args()
-    output_pickle = flags.output + '.pkl'
 
-    print("output_pickle:", output_pickle)
     print("generating data...")
 
-    data = []
-    for _ in range(flags.num_games * 30):
-        data.append(get_card_play_data())
-
-    print("saving pickle file...")
-    with open(output_pickle, 'wb') as g:
-        pickle.dump(data, g, pickle.HIGHEST_PROTOCOL)
+    if flags.pickle:
+        output_pickle = flags.output + '.pkl'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            deal_file = os.path.join(tmpdir, 'deals.npy')
+            generate_deals(deal_file, flags.num_games * LEGACY_DEALS_PER_GAME, flags.seed, flags.num_workers)
+            deals = load_deals(deal_file)
+            print("saving pickle file:", output_pickle)
+            with open(output_pickle, 'wb') as g:
+                pickle.dump([deals[i] for i in range(len(deals))], g, pickle.HIGHEST_PROTOCOL)
+    else:
+        output_npy = flags.output + '.npy'
+        print("saving deal file:", output_npy)
+        generate_deals(output_npy, flags.num_games * DEALS_PER_GAME, flags.seed, flags.num_workers)
@@ -1,7 +1,14 @@
 checkpoint_dir=$1
+manifest="$checkpoint_dir"checkpoints.json
 
-first_path=$first_dir`ls -v "$checkpoint_dir"first_weights* | tail -1`
-second_path=$second_dir`ls -v "$checkpoint_dir"second_weights* | tail -1`
+if [ -f "$manifest" ]; then
+    # The manifest written by the training lists the latest weights
+    first_path=$checkpoint_dir`python -c "import json, sys; print(json.load(open(sys.argv[1]))['latest']['first'])" "$manifest"`
+    second_path=$checkpoint_dir`python -c "import json, sys; print(json.load(open(sys.argv[1]))['latest']['second'])" "$manifest"`
+else
+    first_path=$first_dir`ls -v "$checkpoint_dir"first_weights* | tail -1`
+    second_path=$second_dir`ls -v "$checkpoint_dir"second_weights* | tail -1`
+fi
 
 echo $first_path
 echo $second_path
@@ -19,14 +19,41 @@ parser.add_argument('--num_actor_devices', default=1, type=int,
                     help='The number of devices used for simulation')
 parser.add_argument('--num_actors', default=5, type=int,
                     help='The number of actors for each simulation device')
+parser.add_argument('--envs_per_actor', default=1, type=int,
+                    help='The number of games each actor plays in lockstep with batched forward passes')
+parser.add_argument('--num_inference_workers', default=0, type=int,
+                    help='The number of inference workers batching the forward passes of the actors for each '
+                         'simulation device. With 0 every actor runs the model itself')
+parser.add_argument('--inference_batch_size', default=32, type=int,
+                    help='The max number of actor requests batched by an inference worker')
+parser.add_argument('--inference_timeout', default=1.0, type=float,
+                    help='The max time (in milliseconds) an inference worker waits to fill a batch')
 parser.add_argument('--training_device', default='0', type=str,
                     help='The index of the GPU used for training models. `cpu` means using cpu')
 parser.add_argument('--load_model', action='store_true',
                     help='Load an existing model')
 parser.add_argument('--disable_checkpoint', action='store_true',
                     help='Disable saving checkpoint')
+parser.add_argument('--keep_checkpoints', default=0, type=int,
+                    help='The number of most recent weight checkpoints to keep (0 keeps all)')
+parser.add_argument('--keep_every_checkpoint', default=0, type=int,
+                    help='Also keep every k-th weight checkpoint (0 disables)')
+parser.add_argument('--log_flush_interval', default=1.0, type=float,
+                    help='Time interval (in seconds) at which the buffered logs are written')
+parser.add_argument('--columnar_logs', action='store_true',
+                    help='Also save the logs as numpy column chunks in logs_columns')
 parser.add_argument('--savedir', default='checkpoints',
                     help='Root dir where experiment data will be saved')
+parser.add_argument('--profile', default=None, type=str, choices=['cprofile', 'torch', 'both'],
+                    help='Profile a window of the selected actors and learner threads, the traces are saved '
+                         'in the profile folder of the experiment')
+parser.add_argument('--profile_targets', default='actor_0,learner_first', type=str,
+                    help='Comma separated profiled processes: actor_<index> (on every actor device), '
+                         'learner_<round_id> or learner_fused')
+parser.add_argument('--profile_steps', default=1000, type=int,
+                    help='Number of profiled actor iterations or learner steps')
+parser.add_argument('--profile_skip', default=100, type=int,
+                    help='Number of actor iterations or learner steps before the profiled window')
 
 # Hyperparameters
 parser.add_argument('--total_frames', default=100000000000, type=int,
@@ -39,8 +66,21 @@ parser.add_argument('--unroll_length', default=100, type=int,
                     help='The unroll length (time dimension)')
 parser.add_argument('--num_buffers', default=50, type=int,
                     help='Number of shared-memory buffers')
+parser.add_argument('--learner_featurization', action='store_true',
+                    help='Store the raw state fields in the buffers and derive the features on the learner')
+parser.add_argument('--pin_memory', action='store_true',
+                    help='Gather the learner batches into pinned memory (CPU actors with a GPU training device)')
 parser.add_argument('--num_threads', default=4, type=int,
                     help='Number learner threads')
+parser.add_argument('--publish_interval_steps', default=4, type=int,
+                    help='Copy the learner weights to the actor models every this many learner steps of a round id. '
+                         'Above 1 a snapshot is taken under the learner lock and copied into the actor models '
+                         'outside of it, with 1 the weights are copied into every actor model while the learner '
+                         'model is locked')
+parser.add_argument('--publish_interval_seconds', default=0, type=float,
+                    help='Also copy the weights once this many seconds passed since the last copy (0 disables)')
+parser.add_argument('--fused_learner', action='store_true',
+                    help='Train the first and second round models in one forward/backward pass per step')
 parser.add_argument('--max_grad_norm', default=40., type=float,
                     help='Max norm of gradients')
 
@@ -0,0 +1,121 @@
+"""
+Asynchronous checkpointing. The training loop only snapshots the state in
+memory, a background thread writes the files. Every file is written to a
+temporary path and renamed, so a crash never leaves a partial checkpoint.
+The per round weight files are pruned by a retention policy and listed in
+the manifest checkpoints.json, the latest entry is the most recent one.
+"""
+import copy
+import json
+import os
+import queue
+import threading
+
+import torch
+
+from .utils import log
+
+MANIFEST = 'checkpoints.json'
+
+
+def _to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_to_cpu(v) for v in obj]
+    return copy.deepcopy(obj)
+
+
+def _atomic_save(obj, path):
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _atomic_write_json(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(xpdir):
+    """
+    Returns the manifest of the experiment folder, or an empty one.
+    """
+    path = os.path.join(xpdir, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'model': None, 'latest': None, 'checkpoints': []}
+
+
+class CheckpointWriter:
+    """
+    Writes the checkpoints of an experiment folder in a background thread.
+    keep_last is the number of most recent weight checkpoints kept (0 keeps
+    all of them), additionally every keep_every-th checkpoint is kept.
+    """
+
+    def __init__(self, xpdir, keep_last=0, keep_every=0):
+        self.xpdir = xpdir
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.manifest = load_manifest(xpdir)
+        self.num_saved = max([entry['index'] + 1 for entry in self.manifest['checkpoints']], default=0)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+
+    def save(self, checkpoint_states, model_state_dicts, frames):
+        """
+        Snapshots the checkpoint in memory and queues it for writing.
+        checkpoint_states is the content of model.tar, model_state_dicts
+        holds the weights of each round id.
+        """
+        self.queue.put((_to_cpu(checkpoint_states), _to_cpu(model_state_dicts), frames))
+
+    def close(self):
+        """
+        Waits until the queued checkpoints are written.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception:
+                log.exception('Failed to write the checkpoint')
+
+    def _write(self, checkpoint_states, model_state_dicts, frames):
+        model_path = os.path.join(self.xpdir, 'model.tar')
+        log.info('Saving checkpoint to %s', model_path)
+        _atomic_save(checkpoint_states, model_path)
+
+        # Save the weights for evaluation purpose
+        entry = {'index': self.num_saved, 'frames': frames}
+        for round_id, state_dict in model_state_dicts.items():
+            entry[round_id] = round_id + '_weights_' + str(frames) + '.ckpt'
+            _atomic_save(state_dict, os.path.join(self.xpdir, entry[round_id]))
+        self.num_saved += 1
+
+        checkpoints = [e for e in self.manifest['checkpoints'] if e['frames'] != frames] + [entry]
+        kept = []
+        for i, e in enumerate(checkpoints):
+            if self.keep_last <= 0 or i >= len(checkpoints) - self.keep_last or \
+                    (self.keep_every > 0 and e['index'] % self.keep_every == 0):
+                kept.append(e)
+            else:
+                for round_id in model_state_dicts:
+                    path = os.path.join(self.xpdir, e[round_id])
+                    if os.path.exists(path):
+                        os.remove(path)
+        self.manifest = {'model': 'model.tar', 'latest': entry, 'checkpoints': kept}
+        _atomic_write_json(self.manifest, os.path.join(self.xpdir, MANIFEST))
@@ -10,48 +10,192 @@ import torch
 from torch import multiprocessing as mp
 from torch import nn
 
+from .checkpoint import CheckpointWriter
 from .file_writer import FileWriter
-from .models import Model
-from .utils import get_batch, log, create_env, create_buffers, create_optimizers, act
+from .models import Model, fused_forward
+from .utils import get_batch, log, create_env, create_buffers, create_batch_buffers, create_optimizers, act, \
+    expand_move_ids, expand_round_move_ids, get_timing_stats, write_timing_stats, profile_dir
+from .features import featurize
+from hanamikoji.timing import ACTOR_STAGES, LEARNER_STAGES, timer
+from .inference import InferenceClient, create_inference_slots, serve
+from hanamikoji.profiling import create_profiler
 
 def compute_loss(logits, targets):
     loss = ((logits.squeeze(-1) - targets)**2).mean()
     return loss
 
+class WeightPublisher:
+    """
+    Copies the learner weights of a round id into the actor models. Publishing
+    is throttled by flags.publish_interval_steps and flags.publish_interval_seconds,
+    and every publish increases the shared weight version of the round id,
+    which the actors record with their rollouts. Throttled publishing (the
+    default) clones a snapshot under the learner lock and copies it into the
+    actor models outside of it. When every step is published the weights are
+    copied straight into the actor models while the learner model is locked.
+    """
+
+    def __init__(self, round_id, actor_models, flags):
+        self.round_id = round_id
+        self.actor_models = actor_models
+        self.flags = flags
+        self.version = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self.steps = 0
+        self.last_publish_time = timeit.default_timer()
+        self.num_snapshots = 0
+        self.published_snapshot = 0
+        self.lock = threading.Lock()
+
+    def snapshot(self, model):
+        """
+        Called after every optimizer step while the learner model is locked.
+        Returns a copy of the weights if they are due to be published, else None.
+        When every step is published the weights are published here without a copy.
+        """
+        if self.flags.publish_interval_steps <= 1:
+            self.num_snapshots += 1
+            self._publish(self.num_snapshots, model.state_dict())
+            return None
+        self.steps += 1
+        elapsed = timeit.default_timer() - self.last_publish_time
+        if self.steps < self.flags.publish_interval_steps and \
+                not (self.flags.publish_interval_seconds > 0 and elapsed >= self.flags.publish_interval_seconds):
+            return None
+        self.steps = 0
+        self.last_publish_time = timeit.default_timer()
+        self.num_snapshots += 1
+        state_dict = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        return self.num_snapshots, state_dict
+
+    def publish(self, snapshot):
+        """
+        Copies the snapshot in place into the shared actor models, outside of the
+        learner lock. A snapshot older than the published one is dropped.
+        """
+        self._publish(*snapshot)
+
+    def _publish(self, snapshot_id, state_dict):
+        with self.lock:
+            if snapshot_id <= self.published_snapshot:
+                return
+            with torch.no_grad():
+                for actor_model in self.actor_models.values():
+                    for k, v in actor_model.get_model(self.round_id).state_dict().items():
+                        v.copy_(state_dict[k])
+            self.published_snapshot = snapshot_id
+            self.version += 1
+
+
+def _prepare_batch(batch, flags, device):
+    """Expands a batch of the buffers into the model inputs on the training device."""
+    if flags.learner_featurization:
+        obs_x_no_move = featurize(batch['obs_x_raw'].to(device, non_blocking=True))
+    else:
+        obs_x_no_move = batch['obs_x_no_move'].to(device, non_blocking=True)
+    obs_move = expand_move_ids(batch['obs_move_id'].to(device, non_blocking=True))
+    obs_x = torch.cat((obs_x_no_move, obs_move), dim=2).float()
+    obs_x = torch.flatten(obs_x, 0, 1)
+    obs_z = expand_round_move_ids(torch.flatten(batch['obs_z_ids'].to(device, non_blocking=True), 0, 1)).float()
+    target = torch.flatten(batch['target'].to(device, non_blocking=True), 0, 1)
+    return obs_z, obs_x, target
+
+
+def _get_training_device(flags):
+    if flags.training_device != "cpu":
+        return torch.device('cuda:'+str(flags.training_device))
+    return torch.device('cpu')
+
+
 def learn(round_id,
-          actor_models,
+          publisher,
           model,
           batch,
           optimizer,
           flags,
           lock):
     """Performs a learning (optimization) step."""
-    if flags.training_device != "cpu":
-        device = torch.device('cuda:'+str(flags.training_device))
-    else:
-        device = torch.device('cpu')
-    obs_x_no_move = batch['obs_x_no_move'].to(device)
-    obs_move = batch['obs_move'].to(device)
-    obs_x = torch.cat((obs_x_no_move, obs_move), dim=2).float()
-    obs_x = torch.flatten(obs_x, 0, 1)
-    obs_z = torch.flatten(batch['obs_z'].to(device), 0, 1).float()
-    target = torch.flatten(batch['target'].to(device), 0, 1)
+    obs_z, obs_x, target = _prepare_batch(batch, flags, _get_training_device(flags))
+
+    # The number of weight versions published since the actors generated the batch
+    policy_lag = int(publisher.version) - batch['weight_version'].float().mean()
 
     with lock:
+        start = time.perf_counter()
         learner_outputs = model(obs_z, obs_x, return_value=True)
         loss = compute_loss(learner_outputs['values'], target)
         stats = {
-            'loss_'+round_id: loss.item()
+            'loss_'+round_id: loss.item(),
+            'policy_lag_'+round_id: policy_lag.item(),
         }
+        timer.add('forward', start)
         
+        start = time.perf_counter()
         optimizer.zero_grad()
         loss.backward()
         nn.utils.clip_grad_norm_(model.parameters(), flags.max_grad_norm)
         optimizer.step()
+        timer.add('backward', start)
+
+        start = time.perf_counter()
+        snapshot = publisher.snapshot(model)
+        timer.add('weight_snapshot', start)
+
+    if snapshot is not None:
+        start = time.perf_counter()
+        publisher.publish(snapshot)
+        timer.add('weight_publish', start)
+    return stats
+
+
+def learn_fused(publishers,
+                learner_model,
+                batches,
+                optimizers,
+                flags,
+                locks):
+    """
+    Performs a learning step of both round ids with one forward and backward
+    pass (see fused_forward). The gradients of the two models are disjoint,
+    so clipping and the optimizer steps stay per round id.
+    """
+    round_ids = ['first', 'second']
+    device = _get_training_device(flags)
+    inputs = [_prepare_batch(batches[round_id], flags, device) for round_id in round_ids]
+    obs_z, obs_x, target = [torch.stack(tensors) for tensors in zip(*inputs)]
+    models = [learner_model.get_model(round_id) for round_id in round_ids]
 
-        for actor_model in actor_models.values():
-            actor_model.get_model(round_id).load_state_dict(model.state_dict())
-        return stats
+    stats = {}
+    for round_id in round_ids:
+        policy_lag = int(publishers[round_id].version) - batches[round_id]['weight_version'].float().mean()
+        stats['policy_lag_'+round_id] = policy_lag.item()
+
+    with locks['first'], locks['second']:
+        start = time.perf_counter()
+        values = fused_forward(models, obs_z, obs_x)
+        losses = [compute_loss(values[m], target[m]) for m in range(len(round_ids))]
+        for round_id, loss in zip(round_ids, losses):
+            stats['loss_'+round_id] = loss.item()
+        timer.add('forward', start)
+
+        start = time.perf_counter()
+        for round_id in round_ids:
+            optimizers[round_id].zero_grad()
+        sum(losses).backward()
+        for round_id, model in zip(round_ids, models):
+            nn.utils.clip_grad_norm_(model.parameters(), flags.max_grad_norm)
+            optimizers[round_id].step()
+        timer.add('backward', start)
+
+        start = time.perf_counter()
+        snapshots = {round_id: publishers[round_id].snapshot(model) for round_id, model in zip(round_ids, models)}
+        timer.add('weight_snapshot', start)
+
+    for round_id in round_ids:
+        if snapshots[round_id] is not None:
+            start = time.perf_counter()
+            publishers[round_id].publish(snapshots[round_id])
+            timer.add('weight_publish', start)
+    return stats
 
 def train(flags):  
     """
@@ -67,6 +211,8 @@ def train(flags):
         xpid=flags.xpid,
         xp_args=flags.__dict__,
         rootdir=flags.savedir,
+        flush_interval=flags.log_flush_interval,
+        columnar=flags.columnar_logs,
     )
     checkpointpath = os.path.expandvars(
         os.path.expanduser('%s/%s/%s' % (flags.savedir, flags.xpid, 'model.tar')))
@@ -112,7 +258,9 @@ def train(flags):
     # Stat Keys
     stat_keys = [
         'loss_first',
-        'loss_second'
+        'loss_second',
+        'policy_lag_first',
+        'policy_lag_second',
     ]
     frames, stats = 0, {k: 0 for k in stat_keys}
     round_id_frames = {'first':0, 'second':0}
@@ -128,26 +276,63 @@ def train(flags):
             for device in device_iterator:
                 models[device].get_model(k).load_state_dict(learner_model.get_model(k).state_dict())
         stats = checkpoint_states["stats"]
+        for k in stat_keys:
+            stats.setdefault(k, 0)
         frames = checkpoint_states["frames"]
         round_id_frames = checkpoint_states["round_id_frames"]
         log.info(f"Resuming preempted job, current stats:\n{stats}")
 
-    # Starting actor processes
+    # Publishing the learner weights to the actor models
+    publishers = {round_id: WeightPublisher(round_id, models, flags) for round_id in ['first', 'second']}
+    weight_versions = {round_id: publishers[round_id].version for round_id in publishers}
+
+    # Starting inference workers, they serve the actors of their device
+    inference_clients = {}
     for device in device_iterator:
+        inference_clients[device] = [None] * flags.num_actors
+        if flags.num_inference_workers <= 0:
+            continue
+        slots = create_inference_slots(flags.num_actors * flags.envs_per_actor)
+        request_queue = ctx.Queue()
+        response_queues = [ctx.SimpleQueue() for _ in range(flags.num_actors)]
+        for i in range(flags.num_inference_workers):
+            worker = ctx.Process(
+                target=serve,
+                args=(i, device, models[device], slots, request_queue, response_queues, flags))
+            worker.start()
+            actor_processes.append(worker)
+        inference_clients[device] = [InferenceClient(i * flags.envs_per_actor, slots, request_queue, response_queues[i])
+                                     for i in range(flags.num_actors)]
+
+    # Stage timings (count, total seconds) of every actor
+    actor_timings = torch.zeros(len(device_iterator), flags.num_actors, len(ACTOR_STAGES), 2,
+                                dtype=torch.float64).share_memory_()
+
+    # Starting actor processes
+    for device_idx, device in enumerate(device_iterator):
         num_actors = flags.num_actors
         for i in range(flags.num_actors):
             actor = ctx.Process(
                 target=act,
-                args=(i, device, free_queue[device], full_queue[device], models[device], buffers[device], flags))
+                args=(i, device, free_queue[device], full_queue[device], models[device], buffers[device], flags,
+                      inference_clients[device][i], weight_versions, actor_timings[device_idx, i]))
             actor.start()
             actor_processes.append(actor)
 
     def batch_and_learn(i, device, round_id, local_lock, round_id_lock, lock=threading.Lock()):
         """Thread target for the learning process."""
         nonlocal frames, round_id_frames, stats
+        batch = create_batch_buffers(flags, buffers[device][round_id])
+        # Only the first thread of a round id is profiled
+        profiler = create_profiler(flags, profile_dir(flags), 'learner_' + round_id) if i == 0 else None
         while frames < flags.total_frames:
-            batch = get_batch(free_queue[device][round_id], full_queue[device][round_id], buffers[device][round_id], flags, local_lock)
-            _stats = learn(round_id, models, learner_model.get_model(round_id), batch, optimizers[round_id], flags, round_id_lock)
+            if profiler is not None:
+                profiler.step()
+            with timer.stage('batch_gather'):
+                get_batch(free_queue[device][round_id], full_queue[device][round_id], buffers[device][round_id],
+                          flags, local_lock, batch)
+            _stats = learn(round_id, publishers[round_id], learner_model.get_model(round_id), batch, optimizers[round_id],
+                           flags, round_id_lock)
 
             with lock:
                 for k in _stats:
@@ -157,6 +342,42 @@ def train(flags):
                 plogger.log(to_log)
                 frames += T * B
                 round_id_frames[round_id] += T * B
+        if profiler is not None:
+            profiler.close()
+
+    def batch_and_learn_fused(i, device, local_locks, lock=threading.Lock()):
+        """
+        Thread target for the fused learning process, it trains both round ids at once.
+        The two batches are gathered one after the other, not prefetched concurrently: a step needs
+        both of them, and the actors keep filling the buffers of the second round id while the thread
+        waits for the first, so the waits overlap and only the copies add up. The copies take a small
+        part of the step (see the batch_gather stage timings), which a prefetch thread per round id
+        would not make up for with the extra locking. Add learner threads (--num_threads) to overlap
+        the gathering with the learning steps.
+        """
+        nonlocal frames, round_id_frames, stats
+        batches = {round_id: create_batch_buffers(flags, buffers[device][round_id]) for round_id in ['first', 'second']}
+        profiler = create_profiler(flags, profile_dir(flags), 'learner_fused') if i == 0 else None
+        while frames < flags.total_frames:
+            if profiler is not None:
+                profiler.step()
+            for round_id in ['first', 'second']:
+                with timer.stage('batch_gather'):
+                    get_batch(free_queue[device][round_id], full_queue[device][round_id], buffers[device][round_id],
+                              flags, local_locks[round_id], batches[round_id])
+            _stats = learn_fused(publishers, learner_model, batches, optimizers, flags, round_id_locks)
+
+            with lock:
+                for k in _stats:
+                    stats[k] = _stats[k]
+                to_log = dict(frames=frames)
+                to_log.update({k: stats[k] for k in stat_keys})
+                plogger.log(to_log)
+                frames += 2 * T * B
+                for round_id in ['first', 'second']:
+                    round_id_frames[round_id] += T * B
+        if profiler is not None:
+            profiler.close()
 
     for device in device_iterator:
         for m in range(flags.num_buffers):
@@ -171,46 +392,51 @@ def train(flags):
 
     for device in device_iterator:
         for i in range(flags.num_threads):
+            if flags.fused_learner:
+                thread = threading.Thread(
+                    target=batch_and_learn_fused, name='batch-and-learn-fused-%d' % i, args=(i,device,locks[device]))
+                thread.start()
+                threads.append(thread)
+                continue
             for round_id in ['first', 'second']:
                 thread = threading.Thread(
                     target=batch_and_learn, name='batch-and-learn-%d' % i, args=(i,device,round_id,locks[device][round_id],round_id_locks[round_id]))
                 thread.start()
                 threads.append(thread)
     
+    checkpoint_writer = CheckpointWriter(os.path.dirname(checkpointpath), flags.keep_checkpoints,
+                                         flags.keep_every_checkpoint)
+
     def checkpoint(frames):
         if flags.disable_checkpoint:
             return
-        log.info('Saving checkpoint to %s', checkpointpath)
         _models = learner_model.get_models()
-        torch.save({
+        checkpoint_writer.save({
             'model_state_dict': {k: _models[k].state_dict() for k in _models},
             'optimizer_state_dict': {k: optimizers[k].state_dict() for k in optimizers},
             "stats": stats,
             'flags': vars(flags),
             'frames': frames,
             'round_id_frames': round_id_frames
-        }, checkpointpath)
-
-        # Save the weights for evaluation purpose
-        for round_id in ['first', 'second']:
-            model_weights_dir = os.path.expandvars(os.path.expanduser(
-                '%s/%s/%s' % (flags.savedir, flags.xpid, round_id + '_weights_'+str(frames)+'.ckpt')))
-            torch.save(learner_model.get_model(round_id).state_dict(), model_weights_dir)
+        }, {round_id: learner_model.get_model(round_id).state_dict() for round_id in ['first', 'second']}, frames)
 
     fps_log = []
-    timer = timeit.default_timer
+    wall_timer = timeit.default_timer
+    learner_timings = torch.zeros(len(LEARNER_STAGES), 2, dtype=torch.float64)
+    timings_path = os.path.join(plogger.basepath, 'timings.csv')
+    last_timings = {'actor': actor_timings.sum(dim=(0, 1)), 'learner': learner_timings.clone()}
     try:
-        last_checkpoint_time = timer() - flags.save_interval * 60
+        last_checkpoint_time = wall_timer() - flags.save_interval * 60
         while frames < flags.total_frames:
             start_frames = frames
             round_id_start_frames = {k: round_id_frames[k] for k in round_id_frames}
-            start_time = timer()
+            start_time = wall_timer()
             time.sleep(5)
 
-            if timer() - last_checkpoint_time > flags.save_interval * 60:  
+            if wall_timer() - last_checkpoint_time > flags.save_interval * 60:  
                 checkpoint(frames)
-                last_checkpoint_time = timer()
-            end_time = timer()
+                last_checkpoint_time = wall_timer()
+            end_time = wall_timer()
 
             fps = (frames - start_frames) / (end_time - start_time)
             fps_log.append(fps)
@@ -229,12 +455,28 @@ def train(flags):
                      round_id_fps['second'],
                      pprint.pformat(stats))
 
+            timer.write_to(LEARNER_STAGES, learner_timings)
+            timings = {'actor': actor_timings.sum(dim=(0, 1)), 'learner': learner_timings.clone()}
+            timing_stats = {}
+            for kind, stages in [('actor', ACTOR_STAGES), ('learner', LEARNER_STAGES)]:
+                timing_stats.update(get_timing_stats(kind, stages, timings[kind] - last_timings[kind],
+                                                     end_time - start_time))
+            last_timings = timings
+            log.info('Stage timings (mean us per call, share of the wall time summed over processes):\n%s',
+                     pprint.pformat(timing_stats))
+            write_timing_stats(timings_path, frames, timing_stats)
+
     except KeyboardInterrupt:
+        # Write the buffered logs
+        plogger.close(successful=False)
         return 
     else:
         for thread in threads:
             thread.join()
         log.info('Learning finished after %d frames.', frames)
+        checkpoint(frames)
+    finally:
+        # Wait for the queued checkpoints, also when interrupted
+        checkpoint_writer.close()
 
-    checkpoint(frames)
     plogger.close()
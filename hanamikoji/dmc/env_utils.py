@@ -3,27 +3,31 @@ Here, we wrap the original environment to make it easier
 to use. When a game is finished, instead of mannualy reseting
 the environment, we do it automatically.
 """
+import time
+
 import torch 
 
+from hanamikoji.timing import timer
+
+# The array fields of an observation, the raw observations (Env with raw_obs) only have x_raw and z_ids
+_ARRAY_KEYS = ['x_no_move', 'x_raw', 'z', 'z_ids']
+
 def _format_observation(obs, device):
     """
     A utility function to process observations and
-    move them to CUDA.
+    move them to CUDA. The arrays of the observation
+    are returned as tensors keyed obs_<key>.
     """
+    start = time.perf_counter()
     acting_player_id = obs['id']
     round_id = obs['round_id']
-    if not device == "cpu":
-        device = 'cuda:' + str(device)
-    device = torch.device(device)
-    x_batch = torch.from_numpy(obs['x_batch']).to(device)
-    x_no_move = torch.from_numpy(obs['x_no_move'])
-    z_batch = torch.from_numpy(obs['z_batch']).to(device)
-    z = torch.from_numpy(obs['z'])
-    obs = {'x_batch': x_batch,
-           'z_batch': z_batch,
-           'moves': obs['moves'],
+    tensors = {'obs_' + key: torch.from_numpy(obs[key]) for key in _ARRAY_KEYS if key in obs}
+    # The candidate moves are encoded from their ids when the moves are chosen
+    obs = {'moves': obs['moves'],
+           'move_ids': obs['move_ids'],
            }
-    return acting_player_id, round_id, obs, x_no_move, z
+    timer.add('format_obs', start)
+    return acting_player_id, round_id, obs, tensors
 
 class Environment:
     def __init__(self, env, device):
@@ -35,15 +39,14 @@ class Environment:
         self.episode_result = None
 
     def initial(self):
-        acting_player_id, round_id, initial_obs, x_no_move, z = _format_observation(self.env.reset(), self.device)
+        acting_player_id, round_id, initial_obs, tensors = _format_observation(self.env.reset(), self.device)
         self.episode_result = torch.zeros(1, 1)
         initial_done = torch.ones(1, 1, dtype=torch.bool)
 
         return acting_player_id, round_id, initial_obs, dict(
             done=initial_done,
             episode_result=self.episode_result,
-            obs_x_no_move=x_no_move,
-            obs_z=z
+            **tensors
             )
         
     def step(self, move):
@@ -55,12 +58,11 @@ class Environment:
             obs = self.env.reset()
             self.episode_result = torch.zeros(1, 1)
 
-        acting_player_id, round_id, obs, x_no_move, z = _format_observation(obs, self.device)
+        acting_player_id, round_id, obs, tensors = _format_observation(obs, self.device)
         done = torch.tensor(done).view(1, 1)
         
         return acting_player_id, round_id, obs, dict(
             done=done,
             episode_result=episode_result,
-            obs_x_no_move=x_no_move,
-            obs_z=z
+            **tensors
             )
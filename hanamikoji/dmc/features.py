@@ -0,0 +1,39 @@
+"""
+Learner side featurization. With --learner_featurization the actors ship
+the raw state fields of a decision (x_raw of get_obs) instead of the
+x_no_move features, and the learner derives the features of a whole batch
+with a few torch ops.
+"""
+import torch
+
+from hanamikoji.env.env import RAW_GEISHA_PREFERENCES, RAW_GEISHA_PREFERENCES_OPP, RAW_HAND_CARDS, \
+    RAW_STASHED_CARD, RAW_TRASHED_CARDS, RAW_DECISION_CARDS_1_2, RAW_DECISION_CARDS_2_2, RAW_GIFT_CARDS, \
+    RAW_GIFT_CARDS_OPP, RAW_NUM_CARDS, RAW_NUM_CARDS_OPP
+
+GEISHA_POINTS = torch.tensor([2, 2, 2, 3, 3, 4, 5], dtype=torch.int8)
+
+
+def featurize(x_raw):
+    """
+    Derives x_no_move from x_raw, shape = (..., RAW_STATE_SIZE) -> (..., X_NO_MOVE_FEATURE_SIZE).
+    The result is the same as the x_no_move of get_obs.
+    """
+    x_raw = x_raw.to(torch.int8)
+    points = GEISHA_POINTS.to(x_raw.device).expand(*x_raw.shape[:-1], -1)
+    all_gift_cards = x_raw[..., RAW_GIFT_CARDS] + x_raw[..., RAW_STASHED_CARD]
+    # num_cards as one-hot, no card gives all zeros
+    card_counts = torch.arange(1, 8, dtype=torch.int8, device=x_raw.device)
+    num_cards = (x_raw[..., RAW_NUM_CARDS, None] == card_counts).to(torch.int8)
+    num_cards_opp = (x_raw[..., RAW_NUM_CARDS_OPP, None] == card_counts).to(torch.int8)
+    decision_cards_2_2 = x_raw[..., RAW_DECISION_CARDS_2_2]
+    unknown_cards = (points - x_raw[..., RAW_HAND_CARDS] - all_gift_cards - x_raw[..., RAW_TRASHED_CARDS]
+                     - x_raw[..., RAW_GIFT_CARDS_OPP] - x_raw[..., RAW_DECISION_CARDS_1_2]
+                     - decision_cards_2_2[..., :7] - decision_cards_2_2[..., 7:])
+    return torch.cat([points,
+                      x_raw[..., RAW_GEISHA_PREFERENCES] - x_raw[..., RAW_GEISHA_PREFERENCES_OPP],
+                      # hand, stashed, trashed, decision, action and gift cards are copied
+                      x_raw[..., RAW_HAND_CARDS.start:RAW_GIFT_CARDS_OPP.stop],
+                      all_gift_cards,
+                      num_cards,
+                      num_cards_opp,
+                      unknown_cards], dim=-1)
@@ -19,10 +19,12 @@ import csv
 import json
 import logging
 import os
+import threading
 import time
 from typing import Dict
 
 import git
+import numpy as np
 
 
 def gather_metadata() -> Dict:
@@ -58,11 +60,44 @@ def gather_metadata() -> Dict:
     )
 
 
+def read_columnar_logs(path: str) -> Dict[str, np.ndarray]:
+    """
+    Reads the columnar logs (the logs_columns folder of an experiment).
+    Columns missing from a chunk are filled with NaN.
+    """
+    chunks = [np.load(os.path.join(path, name)) for name in sorted(os.listdir(path)) if name.endswith('.npz')]
+    keys = []
+    for chunk in chunks:
+        keys.extend(k for k in chunk.files if k not in keys)
+    columns = {}
+    for k in keys:
+        columns[k] = np.concatenate([
+            chunk[k] if k in chunk.files else np.full(len(chunk['_tick']), np.nan) for chunk in chunks])
+    return columns
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
 class FileWriter:
+    """
+    Logs rows of metrics to logs.csv. The rows are buffered and written by a
+    background thread every flush_interval seconds or once flush_size rows
+    are pending. With columnar=True every flush is also saved as a chunk of
+    float64 columns in logs_columns/ (see read_columnar_logs).
+    """
+
     def __init__(self,
                  xpid: str = None,
                  xp_args: dict = None,
-                 rootdir: str = '~/palaas'):
+                 rootdir: str = '~/palaas',
+                 flush_interval: float = 1.0,
+                 flush_size: int = 1000,
+                 columnar: bool = False):
         if not xpid:
             # make unique id
             xpid = '{proc}_{unixtime}'.format(
@@ -114,6 +149,7 @@ class FileWriter:
             logs='{base}/logs.csv'.format(base=self.basepath),
             fields='{base}/fields.csv'.format(base=self.basepath),
             meta='{base}/meta.json'.format(base=self.basepath),
+            columns='{base}/logs_columns'.format(base=self.basepath),
         )
 
         self._logger.info('Saving arguments to %s', self.paths['meta'])
@@ -143,40 +179,75 @@ class FileWriter:
         else:
             self.fieldnames = ['_tick', '_time']
 
+        self.columnar = columnar
+        if columnar:
+            os.makedirs(self.paths['columns'], exist_ok=True)
+            self._num_chunks = len(os.listdir(self.paths['columns']))
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._rows = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='file-writer', daemon=True)
+        self._thread.start()
+
     def log(self, to_log: Dict, tick: int = None,
             verbose: bool = False) -> None:
         if tick is not None:
             raise NotImplementedError
-        else:
+        with self._cond:
             to_log['_tick'] = self._tick
             self._tick += 1
-        to_log['_time'] = time.time()
+            to_log['_time'] = time.time()
+            self._rows.append(to_log)
+            if len(self._rows) >= self.flush_size:
+                self._cond.notify()
 
+        if verbose:
+            self._logger.info('LOG | %s', ', '.join(
+                ['{}: {}'.format(k, to_log[k]) for k in sorted(to_log)]))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and len(self._rows) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                rows, self._rows = self._rows, []
+                closed = self._closed
+            if rows:
+                self._write(rows)
+            if closed:
+                return
+
+    def _write(self, rows) -> None:
         old_len = len(self.fieldnames)
-        for k in to_log:
-            if k not in self.fieldnames:
-                self.fieldnames.append(k)
+        for to_log in rows:
+            for k in to_log:
+                if k not in self.fieldnames:
+                    self.fieldnames.append(k)
         if old_len != len(self.fieldnames):
             with open(self.paths['fields'], 'w') as csvfile:
                 writer = csv.writer(csvfile)
                 writer.writerow(self.fieldnames)
             self._logger.info('Updated log fields: %s', self.fieldnames)
 
-        if to_log['_tick'] == 0:
-            # print("\ncreating logs file ")
-            with open(self.paths['logs'], 'a') as f:
-                f.write('# %s\n' % ','.join(self.fieldnames))
-
-        if verbose:
-            self._logger.info('LOG | %s', ', '.join(
-                ['{}: {}'.format(k, to_log[k]) for k in sorted(to_log)]))
-
         with open(self.paths['logs'], 'a') as f:
+            if rows[0]['_tick'] == 0:
+                f.write('# %s\n' % ','.join(self.fieldnames))
             writer = csv.DictWriter(f, fieldnames=self.fieldnames)
-            writer.writerow(to_log)
-            # print("\nadded to log file")
+            writer.writerows(rows)
+
+        if self.columnar:
+            columns = {k: np.array([_to_float(to_log.get(k)) for to_log in rows]) for k in self.fieldnames}
+            path = os.path.join(self.paths['columns'], 'chunk_%08d.npz' % self._num_chunks)
+            np.savez(path, **columns)
+            self._num_chunks += 1
 
     def close(self, successful: bool = True) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
         self.metadata['date_end'] = datetime.datetime.now().strftime(
             '%Y-%m-%d %H:%M:%S.%f')
         self.metadata['successful'] = successful
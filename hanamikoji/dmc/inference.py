@@ -0,0 +1,174 @@
+"""
+Centralized inference for the actors. Instead of running a forward pass per
+decision, an actor writes its observation into a shared memory slot and sends
+the slot index to an inference worker. The worker batches the requests of
+many actors, runs one forward pass per round id and sends back the indices of
+the chosen moves.
+"""
+import logging
+import queue
+import time
+import traceback
+
+import numpy as np
+import torch
+
+from hanamikoji.env.env import MY_MOVE_ARRAYS, ROUND_MOVES, MOVE_VECTOR_SIZE, X_NO_MOVE_FEATURE_SIZE
+from hanamikoji.env.move_generator import MAX_LEGAL_MOVES
+
+log = logging.getLogger('hanamikojizero')
+
+# Move encodings indexed by global move id
+my_move_tensors = torch.tensor(MY_MOVE_ARRAYS)
+
+
+def create_inference_slots(num_slots):
+    """
+    One observation slot per environment in shared memory. The move ids are
+    stored with a fixed width, num_moves tells how many of them are used.
+    """
+    specs = dict(
+        x_no_move=dict(size=(num_slots, X_NO_MOVE_FEATURE_SIZE), dtype=torch.int8),
+        z=dict(size=(num_slots, ROUND_MOVES, MOVE_VECTOR_SIZE), dtype=torch.int8),
+        move_ids=dict(size=(num_slots, MAX_LEGAL_MOVES), dtype=torch.int64),
+        num_moves=dict(size=(num_slots,), dtype=torch.int64),
+    )
+    return {key: torch.zeros(**specs[key]).share_memory_() for key in specs}
+
+
+class InferenceClient:
+    """
+    The actor side of an inference worker. The actor owns the slots starting
+    at `first_slot`, one for each of its environments, and receives the
+    answers on its own response queue.
+    """
+
+    def __init__(self, first_slot, slots, request_queue, response_queue):
+        self.first_slot = first_slot
+        self.slots = slots
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+
+    def act(self, requests):
+        """
+        requests is a list of (round_id, x_no_move, z, move_ids) decisions.
+        Returns the index of the chosen move in move_ids for each of them.
+        """
+        for k, (_, x_no_move, z, move_ids) in enumerate(requests):
+            slot = self.first_slot + k
+            num_moves = len(move_ids)
+            self.slots['x_no_move'][slot] = x_no_move
+            self.slots['z'][slot] = z
+            self.slots['move_ids'][slot, :num_moves] = torch.tensor(move_ids)
+            self.slots['num_moves'][slot] = num_moves
+        self.request_queue.put((self.first_slot, [request[0] for request in requests]))
+        return self.response_queue.get()
+
+
+def select_moves(model, z, x_no_move, move_ids, num_moves, flags=None):
+    """
+    Chooses a move for each of the R decisions with a single forward pass.
+    z is (R, ROUND_MOVES, MOVE_VECTOR_SIZE), x_no_move is (R, X_NO_MOVE_FEATURE_SIZE),
+    move_ids holds the concatenated legal move ids of the decisions and
+    num_moves their counts. Returns the indices of the chosen moves, shape (R,).
+    """
+    num_decisions = num_moves.shape[0]
+    device = x_no_move.device
+    z_index = torch.repeat_interleave(torch.arange(num_decisions, device=device), num_moves)
+    x = torch.cat([x_no_move[z_index], my_move_tensors.to(device)[move_ids]], dim=-1).float()
+    values = model.forward(z.float(), x, return_value=True, z_index=z_index)['values'].squeeze(-1)
+
+    # Scatter the values into a (R, max num_moves) table to take the argmax of every decision at once
+    offsets = torch.cumsum(num_moves, dim=0) - num_moves
+    positions = torch.arange(values.shape[0], device=device) - offsets[z_index]
+    table = torch.full((num_decisions, int(num_moves.max())), float('-inf'), device=device)
+    table[z_index, positions] = values
+    move_idx = torch.argmax(table, dim=1)
+    if flags is not None and flags.exp_epsilon > 0:
+        explore = torch.rand(num_decisions, device=device) < flags.exp_epsilon
+        random_idx = (torch.rand(num_decisions, device=device) * num_moves).long()
+        move_idx = torch.where(explore, random_idx, move_idx)
+    return move_idx
+
+
+def choose_moves(model, requests, flags=None):
+    """
+    Local version of InferenceClient.act, the decisions of a round id share
+    one forward pass of the actor's own model.
+    """
+    move_idx = [None] * len(requests)
+    for round_id in ['first', 'second']:
+        ks = [k for k, request in enumerate(requests) if request[0] == round_id]
+        if not ks:
+            continue
+        _model = model.get_model(round_id)
+        device = _model.dense1.weight.device
+        with torch.no_grad():
+            _move_idx = select_moves(_model,
+                                     torch.stack([requests[k][2] for k in ks]).to(device),
+                                     torch.stack([requests[k][1] for k in ks]).to(device),
+                                     torch.from_numpy(np.concatenate([requests[k][3] for k in ks])).to(device),
+                                     torch.tensor([len(requests[k][3]) for k in ks], device=device),
+                                     flags)
+        for k, _idx in zip(ks, _move_idx.tolist()):
+            move_idx[k] = _idx
+    return move_idx
+
+
+def serve(i, device, model, slots, request_queue, response_queues, flags):
+    """
+    The inference worker loop. It waits for a request, then collects further
+    requests until the batch holds flags.inference_batch_size decisions or
+    flags.inference_timeout milliseconds passed. A request holds the
+    decisions of all the environments of an actor.
+    """
+    try:
+        log.info('Device %s Inference worker %i started.', str(device), i)
+        if not device == "cpu":
+            device = 'cuda:' + str(device)
+        device = torch.device(device)
+        timeout = flags.inference_timeout / 1000
+
+        while True:
+            requests = [request_queue.get()]
+            num_decisions = len(requests[0][1])
+            deadline = time.perf_counter() + timeout
+            while num_decisions < flags.inference_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    requests.append(request_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                num_decisions += len(requests[-1][1])
+
+            decisions = [(first_slot + k, round_id) for first_slot, round_ids in requests
+                         for k, round_id in enumerate(round_ids)]
+            results = {}
+            for round_id in ['first', 'second']:
+                slot_ids = [slot for slot, _round_id in decisions if _round_id == round_id]
+                if not slot_ids:
+                    continue
+                index = torch.tensor(slot_ids)
+                num_moves = slots['num_moves'][index]
+                move_ids = torch.cat([slots['move_ids'][slot, :n] for slot, n in zip(slot_ids, num_moves.tolist())])
+                with torch.no_grad():
+                    move_idx = select_moves(model.get_model(round_id),
+                                            slots['z'][index].to(device),
+                                            slots['x_no_move'][index].to(device),
+                                            move_ids.to(device),
+                                            num_moves.to(device),
+                                            flags)
+                results.update(zip(slot_ids, move_idx.tolist()))
+            for first_slot, round_ids in requests:
+                response_queues[first_slot // flags.envs_per_actor].put(
+                    [results[first_slot + k] for k in range(len(round_ids))])
+
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        log.error('Exception in inference worker process %i', i)
+        traceback.print_exc()
+        print()
+        raise e
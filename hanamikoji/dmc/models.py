@@ -7,7 +7,7 @@ import numpy as np
 
 import torch
 from torch import nn
-from hanamikoji.env.env import MOVE_VECTOR_SIZE, X_FEATURE_SIZE
+from hanamikoji.env.env import MOVE_VECTOR_SIZE, X_FEATURE_SIZE, X_NO_MOVE_FEATURE_SIZE, MY_MOVE_ARRAYS
 
 
 class LstmModel(nn.Module):
@@ -21,9 +21,18 @@ class LstmModel(nn.Module):
         self.dense5 = nn.Linear(512, 512)
         self.dense6 = nn.Linear(512, 1)
 
-    def forward(self, z, x, return_value=False, flags=None):
+    def forward(self, z, x, return_value=False, flags=None, z_index=None):
+        """
+        Row i of x is scored with the history z[z_index[i]], so several decisions can be batched while every history
+        is encoded once. Without z_index z holds either one history per row of x or a single shared history.
+        """
         lstm_out, (h_n, _) = self.lstm(z)
         lstm_out = lstm_out[:, -1, :]
+        if z_index is not None:
+            lstm_out = lstm_out[z_index]
+        else:
+            # A single history (z with batch size 1) is encoded once and shared by every candidate move of x
+            lstm_out = lstm_out.expand(x.shape[0], -1)
         x = torch.cat([lstm_out, x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
@@ -46,6 +55,98 @@ class LstmModel(nn.Module):
             return dict(move=move)
 
 
+class FactorizedLstmModel(nn.Module):
+    """
+    Inference only version of LstmModel. dense1 is split into a state part, which is computed once per decision from
+    the history and x_no_move, and a precomputed table holding the contribution of the move columns of dense1 for
+    every global move id. So for a candidate move the first layer costs a vector add.
+    """
+    def __init__(self):
+        super().__init__()
+        self.lstm = nn.LSTM(MOVE_VECTOR_SIZE, 128, batch_first=True)
+        self.dense1_state = nn.Linear(X_NO_MOVE_FEATURE_SIZE + 128, 512)
+        self.register_buffer('dense1_moves', torch.zeros(len(MY_MOVE_ARRAYS), 512))
+        self.dense2 = nn.Linear(512, 512)
+        self.dense3 = nn.Linear(512, 512)
+        self.dense4 = nn.Linear(512, 512)
+        self.dense5 = nn.Linear(512, 512)
+        self.dense6 = nn.Linear(512, 1)
+
+    @staticmethod
+    def from_model(model):
+        """
+        Exports a trained LstmModel.
+        """
+        factorized = FactorizedLstmModel().to(model.dense1.weight.device)
+        state_dict = {k: v for k, v in model.state_dict().items() if not k.startswith('dense1.')}
+        weight = model.dense1.weight.detach()
+        state_dict['dense1_state.weight'] = weight[:, :-MOVE_VECTOR_SIZE].clone()
+        state_dict['dense1_state.bias'] = model.dense1.bias.detach().clone()
+        move_arrays = torch.tensor(MY_MOVE_ARRAYS).to(weight)
+        state_dict['dense1_moves'] = move_arrays @ weight[:, -MOVE_VECTOR_SIZE:].t()
+        factorized.load_state_dict(state_dict)
+        factorized.eval()
+        return factorized
+
+    def forward(self, z, x_no_move, move_ids):
+        """
+        z is (1, ROUND_MOVES, MOVE_VECTOR_SIZE), x_no_move is (1, X_NO_MOVE_FEATURE_SIZE) and move_ids are the global
+        ids of the candidate moves. Returns the values of the moves, shape = (num_moves, 1).
+        """
+        lstm_out, (h_n, _) = self.lstm(z)
+        lstm_out = lstm_out[:, -1, :]
+        x = self.dense1_state(torch.cat([lstm_out, x_no_move], dim=-1))
+        x = x + self.dense1_moves[move_ids]
+        x = torch.relu(x)
+        x = self.dense2(x)
+        x = torch.relu(x)
+        x = self.dense3(x)
+        x = torch.relu(x)
+        x = self.dense4(x)
+        x = torch.relu(x)
+        x = self.dense5(x)
+        x = torch.relu(x)
+        x = self.dense6(x)
+        return x
+
+
+def check_factorized(model, factorized, obs_list):
+    """
+    Returns the largest absolute difference between the values of LstmModel and its FactorizedLstmModel on the given
+    observations (get_obs outputs).
+    """
+    device = model.dense1.weight.device
+    max_diff = 0.0
+    with torch.no_grad():
+        for obs in obs_list:
+            z = torch.from_numpy(obs['z']).float().unsqueeze(0).to(device)
+            x_batch = torch.from_numpy(obs['x_batch']).to(device)
+            x_no_move = torch.from_numpy(obs['x_no_move']).float().unsqueeze(0).to(device)
+            move_ids = torch.tensor(obs['move_ids']).to(device)
+            values = model.forward(z, x_batch, return_value=True)['values']
+            factorized_values = factorized.forward(z, x_no_move, move_ids)
+            max_diff = max(max_diff, (values - factorized_values).abs().max().item())
+    return max_diff
+
+
+def fused_forward(models, z, x):
+    """
+    Runs M LstmModels (the first and second round models) in one pass. The dense layers are batched matmuls over
+    the stacked parameters of the models, the LSTMs keep their native kernels. z is (M, N, ROUND_MOVES,
+    MOVE_VECTOR_SIZE) and x is (M, N, X_FEATURE_SIZE), returns the values of every model on its own inputs,
+    shape = (M, N, 1). The gradients flow back to the parameters of each model.
+    """
+    lstm_out = torch.stack([model.lstm(z[m])[0][:, -1, :] for m, model in enumerate(models)])
+    x = torch.cat([lstm_out, x], dim=-1)
+    for k in range(1, 7):
+        weight = torch.stack([getattr(model, f'dense{k}').weight for model in models])
+        bias = torch.stack([getattr(model, f'dense{k}').bias for model in models])
+        x = torch.baddbmm(bias.unsqueeze(1), x, weight.transpose(1, 2))
+        if k < 6:
+            x = torch.relu(x)
+    return x
+
+
 # Model dict is only used in evaluation but not training
 model_dict = {'first': LstmModel, 'second': LstmModel}
 
@@ -22,6 +22,8 @@ class LstmModel(nn.Module):
     def forward(self, z: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
         lstm_out, (h_n, _) = self.lstm(z)
         lstm_out = lstm_out[:, -1, :]
+        # A single history (z with batch size 1) is encoded once and shared by every candidate move of x
+        lstm_out = lstm_out.expand(x.shape[0], -1)
         x = torch.cat([lstm_out, x], dim=-1)
         x = self.dense1(x)
         x = torch.relu(x)
@@ -1,3 +1,4 @@
+import csv
 import os
 import typing
 import logging
@@ -10,7 +11,12 @@ import torch
 from torch import multiprocessing as mp
 
 from hanamikoji.dmc.env_utils import Environment
-from hanamikoji.env.env import my_move2array, Env, ROUND_MOVES, MOVE_VECTOR_SIZE, X_NO_MOVE_FEATURE_SIZE
+from hanamikoji.dmc.features import featurize
+from hanamikoji.dmc.inference import choose_moves
+from hanamikoji.profiling import create_profiler
+from hanamikoji.timing import ACTOR_STAGES, timer
+from hanamikoji.env.env import MY_MOVE_ARRAYS, OPP_MOVE_ARRAYS, Env, ROUND_MOVES, MOVE_VECTOR_SIZE, \
+    X_NO_MOVE_FEATURE_SIZE, RAW_STATE_SIZE
 
 shandle = logging.StreamHandler()
 shandle.setFormatter(
@@ -24,40 +30,107 @@ log.setLevel(logging.INFO)
 
 # Buffers are used to transfer data between actor processes
 # and learner processes. They are shared tensors in GPU
-Buffers = typing.Dict[str, typing.List[torch.Tensor]]
+Buffers = typing.Dict[str, torch.Tensor]
 
+# Lookup tables expanding the move ids of the rollouts, the last row encodes the padding (PAD_MOVE_ID)
+_MOVE_TABLES = {
+    'my': torch.cat([torch.tensor(MY_MOVE_ARRAYS), torch.zeros(1, MOVE_VECTOR_SIZE, dtype=torch.int8)]),
+    'opp': torch.cat([torch.tensor(OPP_MOVE_ARRAYS), torch.zeros(1, MOVE_VECTOR_SIZE, dtype=torch.int8)]),
+}
+_move_tables_by_device = {}
 
-def my_move2tensor(list_cards):
-    matrix = my_move2array(list_cards)
-    matrix = torch.from_numpy(matrix)
-    return matrix
 
+def _get_move_tables(device):
+    if device not in _move_tables_by_device:
+        _move_tables_by_device[device] = {key: table.to(device) for key, table in _MOVE_TABLES.items()}
+    return _move_tables_by_device[device]
+
+
+def expand_move_ids(move_ids):
+    """
+    The one-hot encodings of the chosen moves, shape = (..., MOVE_VECTOR_SIZE).
+    """
+    return _get_move_tables(move_ids.device)['my'][move_ids.long()]
+
+
+def expand_round_move_ids(z_ids):
+    """
+    The round histories z from their move ids (see z_ids of get_obs), shape = (..., ROUND_MOVES, MOVE_VECTOR_SIZE).
+    The first half of the slots holds the acting player's moves, the second half the opponent's.
+    """
+    tables = _get_move_tables(z_ids.device)
+    z_ids = z_ids.long()
+    half = ROUND_MOVES // 2
+    return torch.cat([tables['my'][z_ids[..., :half]], tables['opp'][z_ids[..., half:]]], dim=-2)
 
 def create_env(flags):
-    return Env(flags.objective)
+    # With learner featurization the actors only encode the raw state fields
+    return Env(flags.objective, raw_obs=flags.learner_featurization)
+
+
+def profile_dir(flags):
+    return os.path.expanduser('%s/%s/%s' % (flags.savedir, flags.xpid, 'profile'))
 
 
 def get_batch(free_queue,
               full_queue,
               buffers,
               flags,
-              lock):
+              lock,
+              batch=None):
     """
     This function will sample a batch from the buffers based
     on the indices received from the full queue. It will also
-    free the indices by sending it to full_queue.
+    free the indices by sending it to full_queue. The batch is
+    gathered into the preallocated tensors of `batch` if given
+    (see create_batch_buffers), its shape is (B, T, ...).
     """
     with lock:
         indices = [full_queue.get() for _ in range(flags.batch_size)]
-    batch = {
-        key: torch.stack([buffers[key][m] for m in indices], dim=1)
-        for key in buffers
-    }
+    index = torch.tensor(indices, device=next(iter(buffers.values())).device)
+    if batch is None:
+        batch = {key: torch.index_select(buffers[key], 0, index) for key in buffers}
+    else:
+        for key in buffers:
+            torch.index_select(buffers[key], 0, index, out=batch[key])
     for m in indices:
         free_queue.put(m)
     return batch
 
 
+def get_timing_stats(kind, stages, delta, interval):
+    """
+    Summarizes the change of stage timings (count, total seconds) over an
+    interval of wall time: maps '<kind>_<stage>' to the mean microseconds
+    per call and the share of the interval spent in the stage.
+    """
+    stats = {}
+    for i, stage in enumerate(stages):
+        count, total = delta[i].tolist()
+        stats[kind + '_' + stage] = (round(total / count * 1e6, 1) if count else 0.0,
+                                     round(total / interval, 3))
+    return stats
+
+
+def write_timing_stats(path, frames, timing_stats):
+    """
+    Appends the stage timings of a report to the csv file at path, one row
+    per report with the mean microseconds (<stage>_us) and the share of the
+    wall time (<stage>_share) of every stage. The stats rows of the learner
+    stay in logs.csv.
+    """
+    row = {'frames': frames, '_time': time.time()}
+    for k, (us, share) in timing_stats.items():
+        row[k + '_us'] = us
+        row[k + '_share'] = share
+    write_header = not os.path.exists(path)
+    with open(path, 'a') as f:
+        writer = csv.DictWriter(f, fieldnames=list(row))
+        if write_header:
+            writer.writeheader()
+        writer.writerow(row)
+
+
 def create_optimizers(flags, learner_model):
     """
     Create two optimizers for the two round ids.
@@ -75,113 +148,226 @@ def create_optimizers(flags, learner_model):
     return optimizers
 
 
+def get_buffer_specs(flags):
+    """
+    Sizes and dtypes of the rollout data of T steps. The chosen move and
+    the round history are stored as move ids, the learner expands them
+    with expand_move_ids and expand_round_move_ids. With learner
+    featurization the raw state fields are stored instead of x_no_move.
+    """
+    T = flags.unroll_length
+    specs = dict(
+        done=dict(size=(T,), dtype=torch.bool),
+        target=dict(size=(T,), dtype=torch.float32),
+        obs_move_id=dict(size=(T,), dtype=torch.int16),
+        obs_z_ids=dict(size=(T, ROUND_MOVES), dtype=torch.int16),
+        weight_version=dict(size=(T,), dtype=torch.int32),
+    )
+    if flags.learner_featurization:
+        specs['obs_x_raw'] = dict(size=(T, RAW_STATE_SIZE), dtype=torch.int8)
+    else:
+        specs['obs_x_no_move'] = dict(size=(T, X_NO_MOVE_FEATURE_SIZE), dtype=torch.int8)
+    return specs
+
+
+class RolloutRing:
+    """
+    Preallocated ring buffer holding the finished steps of an actor for one
+    round id until they are sent to the shared buffers. The capacity is a
+    multiple of T and the steps are taken out T at a time, so every chunk
+    of T steps is contiguous and is sent with one slice copy per key.
+    """
+
+    def __init__(self, flags):
+        self.specs = get_buffer_specs(flags)
+        self.T = flags.unroll_length
+        self.head = 0
+        self.size = 0
+        self._allocate(2 * self.T)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.data = {key: torch.empty((capacity,) + spec['size'][1:], dtype=spec['dtype'])
+                     for key, spec in self.specs.items()}
+
+    def _grow(self, min_capacity):
+        old_data, old_positions = self.data, (self.head + torch.arange(self.size)) % self.capacity
+        self._allocate(-(-min_capacity // self.T) * self.T)
+        for key in self.data:
+            self.data[key][:self.size] = old_data[key][old_positions]
+        self.head = 0
+
+    def append_episode(self, is_first, result, steps):
+        """
+        Adds the steps of a finished episode. is_first tells for each step
+        whether the acting player was first, result is the episode result
+        of the first player and steps holds the observations by key.
+        """
+        n = is_first.shape[0]
+        if self.size + n > self.capacity:
+            self._grow(self.size + n)
+        positions = (self.head + self.size + torch.arange(n)) % self.capacity
+        done = torch.zeros(n, dtype=torch.bool)
+        done[-1] = True
+        self.data['done'][positions] = done
+        self.data['target'][positions] = torch.where(is_first, result, -result)
+        for key, value in steps.items():
+            self.data[key][positions] = value
+        self.size += n
+
+    def pop_into(self, buffers, index):
+        """
+        Moves the oldest T steps to the shared buffers at index.
+        """
+        for key in self.data:
+            buffers[key][index][...] = self.data[key][self.head:self.head + self.T]
+        self.head = (self.head + self.T) % self.capacity
+        self.size -= self.T
+
+
 def create_buffers(flags, device_iterator):
     """
     We create buffers for different player ids as well as
     for different devices (i.e., GPU). That is, each device
-    will have two buffers for the two player ids.
+    will have two buffers for the two player ids. A buffer
+    holds one contiguous shared tensor per key with shape
+    (num_buffers, T, ...).
     """
     T = flags.unroll_length
     player_ids = ['first', 'second']
     buffers = {}
     for device in device_iterator:
         buffers[device] = {}
+        num_bytes = 0
         for player_id in player_ids:
-            specs = dict(
-                done=dict(size=(T,), dtype=torch.bool),
-                target=dict(size=(T,), dtype=torch.float32),
-                obs_x_no_move=dict(size=(T, X_NO_MOVE_FEATURE_SIZE), dtype=torch.int8),
-                obs_move=dict(size=(T, MOVE_VECTOR_SIZE), dtype=torch.int8),
-                obs_z=dict(size=(T, ROUND_MOVES, MOVE_VECTOR_SIZE), dtype=torch.int8),
-            )
-            _buffers: Buffers = {key: [] for key in specs}
-            for _ in range(flags.num_buffers):
-                for key in _buffers:
-                    if not device == "cpu":
-                        _buffer = torch.empty(**specs[key]).to(torch.device('cuda:' + str(device))).share_memory_()
-                    else:
-                        _buffer = torch.empty(**specs[key]).to(torch.device('cpu')).share_memory_()
-                    _buffers[key].append(_buffer)
+            specs = get_buffer_specs(flags)
+            _buffers: Buffers = {}
+            for key in specs:
+                size = (flags.num_buffers,) + specs[key]['size']
+                if not device == "cpu":
+                    _buffer = torch.empty(size, dtype=specs[key]['dtype'], device=torch.device('cuda:' + str(device)))
+                else:
+                    _buffer = torch.empty(size, dtype=specs[key]['dtype'])
+                _buffers[key] = _buffer.share_memory_()
+                num_bytes += _buffer.numel() * _buffer.element_size()
             buffers[device][player_id] = _buffers
+        log.info('Rollout buffers of device %s use %.1f MB', str(device), num_bytes / 2**20)
     return buffers
 
 
-def act(i, device, free_queue, full_queue, model, buffers, flags):
+def create_batch_buffers(flags, buffers):
+    """
+    Preallocated tensors a learner thread gathers its batches into.
+    They are pinned if the batches are copied from CPU buffers to a GPU.
+    """
+    batch = {}
+    for key, _buffer in buffers.items():
+        _batch = torch.empty((flags.batch_size,) + _buffer.shape[1:], dtype=_buffer.dtype, device=_buffer.device)
+        if flags.pin_memory and _buffer.device.type == 'cpu' and flags.training_device != 'cpu':
+            _batch = _batch.pin_memory()
+        batch[key] = _batch
+    return batch
+
+
+def act(i, device, free_queue, full_queue, model, buffers, flags, inference_client=None, weight_versions=None,
+        timings=None):
     """
     This function will run forever until we stop it. It will generate
     data from the environment and send the data to buffer. It uses
     a free queue and full queue to syncup with the main process.
+    The actor plays flags.envs_per_actor games in lockstep, the moves
+    of all the games are chosen with one batched forward pass, either
+    locally or by an inference worker if an inference client is given.
+    Every step records the version of the weights that chose the move
+    (the shared counters of weight_versions, 0 without them). The stage
+    timings of the actor are copied into the shared tensor timings.
+    With --profile a window of the iterations is profiled.
+    With --learner_featurization the environments only encode the raw
+    state fields, the features of the forward pass are derived from
+    them for all the games at once.
     """
     player_ids = ['first', 'second']
+    x_key = 'obs_x_raw' if flags.learner_featurization else 'obs_x_no_move'
+    episode_keys = ['acting_player_id', x_key, 'obs_move_id', 'obs_z_ids', 'weight_version']
+    profiler = create_profiler(flags, profile_dir(flags), 'actor_%i' % i, 'actor_%s_%i' % (device, i))
     try:
         T = flags.unroll_length
         log.info('Device %s Actor %i started.', str(device), i)
 
-        env = create_env(flags)
-        env = Environment(env, device)
+        envs = [Environment(create_env(flags), device) for _ in range(flags.envs_per_actor)]
 
-        done_buf = {p: [] for p in player_ids}
-        target_buf = {p: [] for p in player_ids}
-        obs_x_no_move_buf = {p: [] for p in player_ids}
-        obs_move_buf = {p: [] for p in player_ids}
-        obs_z_buf = {p: [] for p in player_ids}
-        size = {p: 0 for p in player_ids}
-        acting_player_ids_by_round_id = {p: [] for p in player_ids}
+        # Steps of finished episodes, ready to be sent to the buffers
+        rings = {p: RolloutRing(flags) for p in player_ids}
+        # Steps of the running episode of each environment
+        episode_bufs = [{p: {key: [] for key in episode_keys} for p in player_ids} for _ in envs]
 
-        acting_player_id, round_id, obs, env_output = env.initial()
+        env_states = [env.initial() for env in envs]
 
+        num_iterations = 0
         while True:
-            while True:
-                acting_player_ids_by_round_id[round_id].append(acting_player_id)
-                obs_x_no_move_buf[round_id].append(env_output['obs_x_no_move'])
-                obs_z_buf[round_id].append(env_output['obs_z'])
-                with torch.no_grad():
-                    agent_output = model.forward(round_id, obs['z_batch'], obs['x_batch'], flags=flags)
-                _move_idx = int(agent_output['move'].cpu().detach().numpy())
-                move = obs['moves'][_move_idx]
-                obs_move_buf[round_id].append(my_move2tensor(move))
-                size[round_id] += 1
-                acting_player_id, round_id, obs, env_output = env.step(move)
+            num_iterations += 1
+            if profiler is not None:
+                profiler.step()
+            if timings is not None and num_iterations % 100 == 0:
+                timer.write_to(ACTOR_STAGES, timings)
+            if flags.learner_featurization:
+                x_no_move = featurize(torch.stack([env_output['obs_x_raw'] for *_, env_output in env_states]))
+                z = expand_round_move_ids(torch.stack([env_output['obs_z_ids'] for *_, env_output in env_states]))
+                requests = [(round_id, x_no_move[k], z[k], obs['move_ids'])
+                            for k, (_, round_id, obs, _) in enumerate(env_states)]
+            else:
+                requests = [(round_id, env_output['obs_x_no_move'], env_output['obs_z'], obs['move_ids'])
+                            for _, round_id, obs, env_output in env_states]
+            versions = {p: int(weight_versions[p]) if weight_versions is not None else 0 for p in player_ids}
+            start = time.perf_counter()
+            if inference_client is not None:
+                move_idx = inference_client.act(requests)
+            else:
+                move_idx = choose_moves(model, requests, flags)
+            timer.add('forward', start)
+
+            for k, env in enumerate(envs):
+                acting_player_id, round_id, obs, env_output = env_states[k]
+                episode = episode_bufs[k][round_id]
+                episode['acting_player_id'].append(acting_player_id)
+                episode[x_key].append(env_output[x_key])
+                episode['obs_z_ids'].append(env_output['obs_z_ids'])
+                move_id = obs['move_ids'][move_idx[k]]
+                episode['obs_move_id'].append(move_id)
+                episode['weight_version'].append(versions[round_id])
+                env_states[k] = env.step(move_id)
+                env_output = env_states[k][3]
                 if env_output['done']:
-                    result_glob = env_output['episode_result']
+                    result_glob = env_output['episode_result'].item()
                     for p in player_ids:
-                        # diff is the number of new training data valuated by model p
-                        diff = size[p] - len(target_buf[p])
-                        if diff > 0:
-                            done_buf[p].extend([False for _ in range(diff - 1)])
-                            done_buf[p].append(True)
-                            for i, player_id in enumerate(acting_player_ids_by_round_id[p]):
-                                if player_id == 'first':
-                                    result_loc = result_glob
-                                else:
-                                    result_loc = -result_glob
-                                target_buf[p].append(result_loc)
-                            acting_player_ids_by_round_id[p] = []
-                        assert size[p] == len(target_buf[p])
-                        assert size[p] == len(done_buf[p])
-                    break
+                        episode = episode_bufs[k][p]
+                        if episode['acting_player_id']:
+                            is_first = torch.tensor([player_id == 'first' for player_id in episode['acting_player_id']])
+                            rings[p].append_episode(is_first, torch.tensor(result_glob), {
+                                x_key: torch.stack(episode[x_key]),
+                                'obs_move_id': torch.tensor(episode['obs_move_id'], dtype=torch.int16),
+                                'obs_z_ids': torch.stack(episode['obs_z_ids']),
+                                'weight_version': torch.tensor(episode['weight_version'], dtype=torch.int32),
+                            })
+                            episode_bufs[k][p] = {key: [] for key in episode_keys}
 
             for p in player_ids:
-                while size[p] > T:
+                while rings[p].size > T:
+                    start = time.perf_counter()
                     index = free_queue[p].get()
+                    timer.add('free_queue_wait', start)
                     if index is None:
                         break
-                    for t in range(T):
-                        buffers[p]['done'][index][t, ...] = done_buf[p][t]
-                        buffers[p]['target'][index][t, ...] = target_buf[p][t]
-                        buffers[p]['obs_x_no_move'][index][t, ...] = obs_x_no_move_buf[p][t]
-                        buffers[p]['obs_move'][index][t, ...] = obs_move_buf[p][t]
-                        buffers[p]['obs_z'][index][t, ...] = obs_z_buf[p][t]
+                    start = time.perf_counter()
+                    rings[p].pop_into(buffers[p], index)
+                    timer.add('buffer_flush', start)
+                    start = time.perf_counter()
                     full_queue[p].put(index)
-                    done_buf[p] = done_buf[p][T:]
-                    target_buf[p] = target_buf[p][T:]
-                    obs_x_no_move_buf[p] = obs_x_no_move_buf[p][T:]
-                    obs_move_buf[p] = obs_move_buf[p][T:]
-                    obs_z_buf[p] = obs_z_buf[p][T:]
-                    size[p] -= T
+                    timer.add('full_queue_put', start)
 
     except KeyboardInterrupt:
-        pass
+        if profiler is not None:
+            profiler.close()
     except Exception as e:
         log.error('Exception in worker process %i', i)
         traceback.print_exc()
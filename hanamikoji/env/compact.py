@@ -0,0 +1,318 @@
+"""
+Compact, array backed counterparts of GameState and PrivateInfoSet. Players are indexed by 0 (global first) and
+1 (global second), every field lives in one small numpy buffer and the moves are applied in place. A state is
+a few hundred bytes, which makes it cheap to copy and to keep many states in memory (e.g. for search).
+
+This is the storage backend of VecGameEnv (one buffer row per game), not a drop-in replacement of the GameEnv
+classes: agents, get_obs and ObsEncoder only work with GameState and PrivateInfoSet. The names and shapes differ
+from GameState:
+- acting_player / round_first are player indices instead of acting_player_id / id_to_round_id,
+- the per player fields (num_cards, gift_cards, action_cards, geisha_preferences) are arrays indexed by player
+  instead of dicts of tuples keyed by player id,
+- round_move_ids(player) is a method returning an array view, round_moves is not stored,
+- the card vectors are numpy arrays, absent decision, stashed and trashed cards are None as in GameState.
+Use to_game_state / from_game_state (to_private_info_set / from_private_info_set) to convert.
+"""
+import numpy as np
+
+from .game import GameState, PrivateInfoSet
+from .move_generator import *
+
+FIRST = 0
+SECOND = 1
+PLAYER_IDS = ('first', 'second')
+POINTS = np.array([2, 2, 2, 3, 3, 4, 5], dtype=np.int16)
+
+# Layout of the CompactGameState buffer
+ACTING_PLAYER = 0
+ROUND_FIRST = 1
+NUM_CARDS = slice(2, 4)
+GIFT_CARDS = slice(4, 18)
+ACTION_CARDS = slice(18, 26)
+GEISHA_PREFERENCES = slice(26, 40)
+DECISION_CARDS_1_2 = slice(40, 47)
+DECISION_CARDS_2_2 = slice(47, 61)
+NUM_ROUND_MOVES = slice(61, 63)
+ROUND_MOVE_IDS = slice(63, 75)
+STATE_SIZE = 75
+
+# Layout of the CompactPrivateInfoSet buffer
+HAND_CARDS = slice(0, 7)
+STASHED_CARD = slice(7, 14)
+TRASHED_CARDS = slice(14, 21)
+PRIVATE_SIZE = 21
+
+
+def _gen_move_tables():
+    types = np.empty(NUM_MOVES, dtype=np.int8)
+    cards = np.zeros((NUM_MOVES, 2, 7), dtype=np.int8)
+    for move_id, move in enumerate(ALL_MOVES):
+        types[move_id] = move[0]
+        if move[0] < TYPE_3_CHOOSE_2_2:
+            cards[move_id, 0] = move[1]
+        else:
+            cards[move_id] = move[1]
+    return types, cards
+
+
+# The type and the card vectors of every global move id. For stash, trash and choose 1-2 moves the second vector is
+# zero, for the other moves the vectors are the two piles of the move.
+MOVE_TYPES, MOVE_CARDS = _gen_move_tables()
+MOVE_TYPES.flags.writeable = False
+MOVE_CARDS.flags.writeable = False
+# Number of cards leaving the hand of the acting player for every move type
+MOVE_TYPE_NUM_CARDS = np.array([1, 2, 3, 4, 0, 0], dtype=np.int16)
+
+
+def _none_if_zero(cards):
+    return cards if cards.any() else None
+
+
+class CompactGameState(object):
+    """
+    CompactGameState contains the public data of the game in a single int16 buffer (see the layout above).
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data=None):
+        if data is None:
+            data = np.zeros(STATE_SIZE, dtype=np.int16)
+            data[NUM_CARDS] = [7, 6]
+            data[ACTION_CARDS] = 1
+        self.data = data
+
+    @property
+    def acting_player(self):
+        return int(self.data[ACTING_PLAYER])
+
+    @property
+    def round_first(self):
+        """
+        The global index of the player who acts first in the round (i.e. whose round id is 'first').
+        """
+        return int(self.data[ROUND_FIRST])
+
+    @property
+    def num_cards(self):
+        return self.data[NUM_CARDS]
+
+    @property
+    def gift_cards(self):
+        return self.data[GIFT_CARDS].reshape(2, 7)
+
+    @property
+    def action_cards(self):
+        return self.data[ACTION_CARDS].reshape(2, 4)
+
+    @property
+    def geisha_preferences(self):
+        return self.data[GEISHA_PREFERENCES].reshape(2, 7)
+
+    @property
+    def decision_cards_1_2(self):
+        return _none_if_zero(self.data[DECISION_CARDS_1_2])
+
+    @property
+    def decision_cards_2_2(self):
+        return _none_if_zero(self.data[DECISION_CARDS_2_2].reshape(2, 7))
+
+    def round_move_ids(self, player):
+        num_round_moves = self.data[NUM_ROUND_MOVES][player]
+        return self.data[ROUND_MOVE_IDS].reshape(2, 6)[player, :num_round_moves]
+
+    def num_round_moves(self):
+        return int(self.data[NUM_ROUND_MOVES].sum())
+
+    def copy(self):
+        return CompactGameState(self.data.copy())
+
+    def new_round(self):
+        """
+        Resets the round data in place, the geisha preferences are kept. The round first player alternates.
+        """
+        geisha_preferences = self.data[GEISHA_PREFERENCES].copy()
+        round_first = 1 - self.data[ROUND_FIRST]
+        self.data[:] = 0
+        self.data[ACTING_PLAYER] = self.data[ROUND_FIRST] = round_first
+        self.data[NUM_CARDS][round_first] = 7
+        self.data[NUM_CARDS][1 - round_first] = 6
+        self.data[ACTION_CARDS] = 1
+        self.data[GEISHA_PREFERENCES] = geisha_preferences
+
+    def apply_move(self, move_id):
+        """
+        Applies the public effects of the move of the acting player in place. Returns True if the next acting player
+        draws a card.
+        """
+        data = self.data
+        curr = data[ACTING_PLAYER]
+        move_type = MOVE_TYPES[move_id]
+        cards = MOVE_CARDS[move_id]
+        if move_type == TYPE_0_STASH:
+            move_id = HIDDEN_STASH_ID
+        elif move_type == TYPE_1_TRASH:
+            move_id = HIDDEN_TRASH_ID
+        num_round_moves = data[NUM_ROUND_MOVES]
+        data[ROUND_MOVE_IDS].reshape(2, 6)[curr, num_round_moves[curr]] = move_id
+        num_round_moves[curr] += 1
+        if move_type <= TYPE_3_CHOOSE_2_2:
+            data[ACTION_CARDS].reshape(2, 4)[curr, move_type] = 0
+            data[NUM_CARDS][curr] -= MOVE_TYPE_NUM_CARDS[move_type]
+            data[ACTING_PLAYER] = 1 - curr
+            if move_type == TYPE_2_CHOOSE_1_2:
+                data[DECISION_CARDS_1_2] = cards[0]
+            elif move_type == TYPE_3_CHOOSE_2_2:
+                data[DECISION_CARDS_2_2] = cards.ravel()
+            return move_type <= TYPE_1_TRASH
+        if move_type == TYPE_4_RESOLVE_1_2:
+            data[DECISION_CARDS_1_2] = 0
+        else:
+            data[DECISION_CARDS_2_2] = 0
+        gift_cards = data[GIFT_CARDS].reshape(2, 7)
+        gift_cards[curr] += cards[0]
+        gift_cards[1 - curr] += cards[1]
+        return True
+
+    def draw(self, player):
+        self.data[NUM_CARDS][player] += 1
+
+    def update_geisha_preferences(self, stashed_cards):
+        """
+        stashed_cards is a (2, 7) array with the stashed card of both players.
+        """
+        gifts = self.gift_cards + stashed_cards
+        preferences = self.geisha_preferences
+        preferences[0] = (gifts[0] > gifts[1]) | ((gifts[0] == gifts[1]) & (preferences[0] == 1))
+        preferences[1] = (gifts[0] < gifts[1]) | ((gifts[0] == gifts[1]) & (preferences[1] == 1))
+
+    def is_game_ended(self):
+        """
+        Returns the index of the winner or None.
+        """
+        preferences = self.geisha_preferences
+        geisha_points = preferences @ POINTS
+        for player in (FIRST, SECOND):
+            if 11 <= geisha_points[player]:
+                return player
+        geisha_wins = preferences.sum(axis=1)
+        for player in (FIRST, SECOND):
+            if 4 <= geisha_wins[player]:
+                return player
+        return None
+
+    def to_game_state(self):
+        state = GameState()
+        state.acting_player_id = PLAYER_IDS[self.acting_player]
+        round_first = self.round_first
+        state.id_to_round_id = {PLAYER_IDS[round_first]: 'first', PLAYER_IDS[1 - round_first]: 'second'}
+        decision_cards_1_2 = self.decision_cards_1_2
+        decision_cards_2_2 = self.decision_cards_2_2
+        state.decision_cards_1_2 = tuple(decision_cards_1_2.tolist()) if decision_cards_1_2 is not None else None
+        state.decision_cards_2_2 = tuple(map(tuple, decision_cards_2_2.tolist())) if (
+                decision_cards_2_2 is not None) else None
+        for player, player_id in enumerate(PLAYER_IDS):
+            state.gift_cards[player_id] = tuple(self.gift_cards[player].tolist())
+            state.action_cards[player_id] = tuple(self.action_cards[player].tolist())
+            state.geisha_preferences[player_id] = tuple(self.geisha_preferences[player].tolist())
+            state.num_cards[player_id] = int(self.num_cards[player])
+            state.round_move_ids[player_id] = tuple(self.round_move_ids(player).tolist())
+            state.round_moves[player_id] = tuple(ALL_MOVES[move_id] for move_id in state.round_move_ids[player_id])
+        return state
+
+    @staticmethod
+    def from_game_state(state):
+        compact = CompactGameState()
+        data = compact.data
+        data[ACTING_PLAYER] = PLAYER_IDS.index(state.acting_player_id)
+        data[ROUND_FIRST] = FIRST if state.id_to_round_id['first'] == 'first' else SECOND
+        if state.decision_cards_1_2:
+            data[DECISION_CARDS_1_2] = state.decision_cards_1_2
+        if state.decision_cards_2_2:
+            data[DECISION_CARDS_2_2] = np.ravel(state.decision_cards_2_2)
+        for player, player_id in enumerate(PLAYER_IDS):
+            compact.gift_cards[player] = state.gift_cards[player_id]
+            compact.action_cards[player] = state.action_cards[player_id]
+            compact.geisha_preferences[player] = state.geisha_preferences[player_id]
+            data[NUM_CARDS][player] = state.num_cards[player_id]
+            round_move_ids = state.round_move_ids[player_id]
+            data[NUM_ROUND_MOVES][player] = len(round_move_ids)
+            data[ROUND_MOVE_IDS].reshape(2, 6)[player, :len(round_move_ids)] = round_move_ids
+        return compact
+
+
+class CompactPrivateInfoSet(object):
+    """
+    CompactPrivateInfoSet contains the private data of a player in a single int8 buffer (see the layout above).
+    A zero stashed or trashed card vector means the action is not yet played.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data=None):
+        self.data = np.zeros(PRIVATE_SIZE, dtype=np.int8) if data is None else data
+
+    @property
+    def hand_cards(self):
+        return self.data[HAND_CARDS]
+
+    @property
+    def stashed_card(self):
+        return _none_if_zero(self.data[STASHED_CARD])
+
+    @property
+    def trashed_cards(self):
+        return _none_if_zero(self.data[TRASHED_CARDS])
+
+    def copy(self):
+        return CompactPrivateInfoSet(self.data.copy())
+
+    def apply_move(self, move_id):
+        """
+        Applies the private effects of a move of the owner in place.
+        """
+        move_type = MOVE_TYPES[move_id]
+        if move_type > TYPE_3_CHOOSE_2_2:
+            return
+        cards = MOVE_CARDS[move_id]
+        self.data[HAND_CARDS] -= cards[0] + cards[1]
+        if move_type == TYPE_0_STASH:
+            self.data[STASHED_CARD] = cards[0]
+        elif move_type == TYPE_1_TRASH:
+            self.data[TRASHED_CARDS] = cards[0]
+
+    def draw(self, card):
+        self.data[HAND_CARDS.start + card] += 1
+
+    def get_moves_and_ids(self, state):
+        """
+        Legal moves of the owner in the given CompactGameState, see get_legal_moves_and_ids.
+        """
+        decision_cards_1_2 = state.decision_cards_1_2
+        decision_cards_2_2 = state.decision_cards_2_2
+        return get_legal_moves_and_ids(self.hand_cards.tolist(),
+                                       state.action_cards[state.acting_player].tolist(),
+                                       decision_cards_1_2.tolist() if decision_cards_1_2 is not None else None,
+                                       decision_cards_2_2.tolist() if decision_cards_2_2 is not None else None)
+
+    def to_private_info_set(self, state=None):
+        """
+        If the owner is the acting player of the given CompactGameState, the legal moves are filled as well.
+        """
+        info = PrivateInfoSet()
+        info.hand_cards = tuple(self.hand_cards.tolist())
+        stashed_card = self.stashed_card
+        trashed_cards = self.trashed_cards
+        info.stashed_card = tuple(stashed_card.tolist()) if stashed_card is not None else None
+        info.trashed_cards = tuple(trashed_cards.tolist()) if trashed_cards is not None else None
+        if state is not None:
+            info.moves, info.move_ids, info.legal_move_ids = self.get_moves_and_ids(state)
+        return info
+
+    @staticmethod
+    def from_private_info_set(info):
+        compact = CompactPrivateInfoSet()
+        compact.data[HAND_CARDS] = info.hand_cards
+        if info.stashed_card:
+            compact.data[STASHED_CARD] = info.stashed_card
+        if info.trashed_cards:
+            compact.data[TRASHED_CARDS] = info.trashed_cards
+        return compact
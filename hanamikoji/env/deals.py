@@ -0,0 +1,165 @@
+"""
+Fixed-width deal files. A round deal is stored as the 21 cards of the
+shuffled deck (uint8): the hand of the round first player (7 cards), the
+hand of the round second player (6 cards), then the draw pile in drawing
+order (8 cards). A deal file is an (N, DECK_SIZE) .npy array which is
+opened as a memory map, so it loads instantly and the processes reading it
+share its pages. The card_play_data dicts are built when a round is dealt.
+The random deals are generated in batches with np.random.Generator.
+"""
+import logging
+import multiprocessing as mp
+import pickle
+
+import numpy as np
+
+from .game import deck as DECK, DEALS_PER_GAME
+
+log = logging.getLogger('hanamikojizero')
+
+DECK_SIZE = len(DECK)
+# The legacy pickles of generate_eval_data.py hold this many deals per game, the engine reads DEALS_PER_GAME of them
+LEGACY_DEALS_PER_GAME = 30
+_DECK = np.array(DECK, dtype=np.uint8)
+
+# Number of rows of a deal file dealt from the same random stream
+_BLOCK_SIZE = 1 << 20
+
+
+def deal_cards(num_deals, rng):
+    """
+    Deals num_deals rounds at once, returns the shuffled decks, shape = (num_deals, DECK_SIZE).
+    """
+    return rng.permuted(np.tile(_DECK, (num_deals, 1)), axis=1)
+
+
+def hand_counts(cards):
+    """
+    The count vectors of the cards of every row, shape = (N, k) -> (N, 7).
+    """
+    num_rows = cards.shape[0]
+    offsets = 7 * np.arange(num_rows)[:, None]
+    return np.bincount((cards + offsets).ravel(), minlength=7 * num_rows).reshape(num_rows, 7)
+
+
+def _fill_deals(path, seed_seq, start, stop):
+    cards = np.load(path, mmap_mode='r+')
+    cards[start:stop] = deal_cards(stop - start, np.random.default_rng(seed_seq))
+    cards.flush()
+
+
+def generate_deals(path, num_deals, seed=None, num_workers=1):
+    """
+    Writes a deal file of num_deals random rounds. The blocks of _BLOCK_SIZE
+    rows are dealt from independent streams spawned from seed, and the
+    workers fill the blocks of the file in place, so the content only
+    depends on the seed, not on num_workers.
+    """
+    cards = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(num_deals, DECK_SIZE))
+    del cards
+    starts = list(range(0, num_deals, _BLOCK_SIZE))
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(path, seed_seq, start, min(start + _BLOCK_SIZE, num_deals)) for seed_seq, start in zip(seed_seqs, starts)]
+    if num_workers > 1:
+        with mp.get_context('spawn').Pool(num_workers) as pool:
+            pool.starmap(_fill_deals, tasks)
+    else:
+        for task in tasks:
+            _fill_deals(*task)
+
+
+def deals_to_array(card_play_data_list):
+    """
+    Converts card_play_data dicts (the legacy pickle format) to the array format.
+    """
+    cards = np.empty((len(card_play_data_list), DECK_SIZE), dtype=np.uint8)
+    card_ids = np.arange(7)
+    for i, card_play_data in enumerate(card_play_data_list):
+        cards[i, :7] = np.repeat(card_ids, card_play_data['first'])
+        cards[i, 7:13] = np.repeat(card_ids, card_play_data['second'])
+        cards[i, 13:] = card_play_data['deck']
+    return cards
+
+
+def save_deals(path, cards):
+    np.save(path, np.asarray(cards, dtype=np.uint8))
+
+
+def legacy_to_game_layout(cards, pickle_deals_per_game=LEGACY_DEALS_PER_GAME):
+    """
+    Keeps the first DEALS_PER_GAME deals of every game of a legacy deal list
+    with pickle_deals_per_game deals per game, so game i uses the deals
+    i * DEALS_PER_GAME + r as the engine expects.
+    """
+    if pickle_deals_per_game < DEALS_PER_GAME:
+        raise ValueError('A game needs {} deals, the pickle has {} per game'.format(DEALS_PER_GAME,
+                                                                                  pickle_deals_per_game))
+    if len(cards) % pickle_deals_per_game:
+        raise ValueError('{} deals are not a whole number of games of {} deals'.format(len(cards),
+                                                                                      pickle_deals_per_game))
+    if pickle_deals_per_game == DEALS_PER_GAME:
+        return cards
+    log.warning('Converting %i legacy games of %i deals to %i deals per game', len(cards) // pickle_deals_per_game,
+                pickle_deals_per_game, DEALS_PER_GAME)
+    return cards.reshape(-1, pickle_deals_per_game, DECK_SIZE)[:, :DEALS_PER_GAME].reshape(-1, DECK_SIZE)
+
+
+def load_deals(path, pickle_deals_per_game=LEGACY_DEALS_PER_GAME):
+    """
+    Opens a deal file. .npy files are memory mapped, other files are read as
+    the legacy pickle of card_play_data dicts with pickle_deals_per_game
+    deals per game and converted (see legacy_to_game_layout).
+    """
+    if path.endswith('.npy'):
+        cards = np.load(path, mmap_mode='r')
+        assert cards.ndim == 2 and cards.shape[1] == DECK_SIZE, 'Not a deal file: ' + path
+        return DealArray(cards)
+    with open(path, 'rb') as f:
+        return DealArray(legacy_to_game_layout(deals_to_array(pickle.load(f)), pickle_deals_per_game))
+
+
+class DealArray:
+    """
+    Read-only sequence of round deals over an (N, DECK_SIZE) array. An item
+    is the card_play_data dict of a round, a slice is a DealArray viewing
+    the same array, so it can be used as GameEnv.card_play_data.
+    """
+
+    def __init__(self, cards):
+        self.cards = cards
+
+    def __len__(self):
+        return self.cards.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return DealArray(self.cards[index])
+        cards = self.cards[index]
+        return {'first': np.bincount(cards[:7], minlength=7).tolist(),
+                'second': np.bincount(cards[7:13], minlength=7).tolist(),
+                'deck': cards[13:].tolist()}
+
+
+class DealStream:
+    """
+    Endless source of random round deals for self-play (GameEnv.deal_stream).
+    Calling it returns the card_play_data dict of a new round, the rounds
+    are dealt batch_size at a time from rng.
+    """
+
+    def __init__(self, rng, batch_size=1024):
+        self.rng = rng
+        self.batch_size = batch_size
+        self.deals = []
+        self.pos = 0
+
+    def __call__(self):
+        if self.pos == len(self.deals):
+            cards = deal_cards(self.batch_size, self.rng)
+            self.deals = [{'first': first, 'second': second, 'deck': deck}
+                          for first, second, deck in zip(hand_counts(cards[:, :7]).tolist(),
+                                                         hand_counts(cards[:, 7:13]).tolist(),
+                                                         cards[:, 13:].tolist())]
+            self.pos = 0
+        self.pos += 1
+        return self.deals[self.pos - 1]
@@ -1,13 +1,34 @@
+import time
+
 import numpy as np
 
+from hanamikoji.env.deals import DealStream
 from hanamikoji.env.game import GameEnv, get_card_play_data
 from hanamikoji.env.move_generator import *
+from hanamikoji.timing import timer
 
 ROUND_MOVES = 12
 MOVE_VECTOR_SIZE = 63
 X_FEATURE_SIZE = 169
 X_NO_MOVE_FEATURE_SIZE = (X_FEATURE_SIZE - MOVE_VECTOR_SIZE)
 
+# Layout of the raw state fields of a decision (x_raw of get_obs), the x_no_move features are derived from them.
+# The entries 14:78 have the same layout as in x_no_move.
+RAW_GEISHA_PREFERENCES = slice(0, 7)
+RAW_GEISHA_PREFERENCES_OPP = slice(7, 14)
+RAW_HAND_CARDS = slice(14, 21)
+RAW_STASHED_CARD = slice(21, 28)
+RAW_TRASHED_CARDS = slice(28, 35)
+RAW_DECISION_CARDS_1_2 = slice(35, 42)
+RAW_DECISION_CARDS_2_2 = slice(42, 56)
+RAW_ACTION_CARDS = slice(56, 60)
+RAW_ACTION_CARDS_OPP = slice(60, 64)
+RAW_GIFT_CARDS = slice(64, 71)
+RAW_GIFT_CARDS_OPP = slice(71, 78)
+RAW_NUM_CARDS = 78
+RAW_NUM_CARDS_OPP = 79
+RAW_STATE_SIZE = 80
+
 def my_move2array(move):
     ret = np.zeros(MOVE_VECTOR_SIZE, dtype=np.int8)
     if move[0] == TYPE_0_STASH:
@@ -32,9 +53,12 @@ class Env:
     Hanamikoji multi-agent wrapper
     """
 
-    def __init__(self, objective):
+    def __init__(self, objective, seed=None, raw_obs=False):
         """
-        Objective is wp/adp/logadp. Here, we use dummy agents.
+        Objective is wp/adp/logadp. The rounds are dealt from a
+        np.random.Generator seeded with seed, by default the seed is drawn
+        from np.random. With raw_obs the observations hold the raw state
+        fields instead of the features (see get_obs). Here, we use dummy agents.
         This is because, in the original game, the players
         are `in` the game. Here, we want to isolate
         players and environments to have a more gym style
@@ -53,6 +77,10 @@ class Env:
 
         # Initialize the internal environment
         self._env = GameEnv(self.players)
+        self._env.obs_encoder = ObsEncoder(self._env, raw_obs)
+        if seed is None:
+            seed = np.random.randint(2 ** 32)
+        self._env.deal_stream = DealStream(np.random.default_rng(seed))
 
         self.infoset = None
 
@@ -67,19 +95,28 @@ class Env:
         self._env.card_play_init(card_play_data)
         # First element is GameState, second element is PrivateInfo.
         self.infoset = self._active_player_info_set()
-        return get_obs(self.infoset)
+        start = time.perf_counter()
+        obs = self._env.obs_encoder.get_obs()
+        timer.add('get_obs', start)
+        return obs
 
     def step(self, move):
         """
         Step function takes as input the move, which
-        is a list of integers, and output the next observation,
+        is a list of integers or a global move id, and output the next observation,
         reward, and a Boolean variable indicating whether the
         current game is finished. It also returns an empty
         dictionary that is reserved to pass useful information.
         """
-        assert move in self.infoset[1].moves
+        if isinstance(move, (int, np.integer)):
+            move = int(move)
+            assert move in self.infoset[1].legal_move_ids
+        else:
+            assert move2id(move) in self.infoset[1].legal_move_ids
         self.players[self._acting_player_id()].set_move(move)
+        start = time.perf_counter()
         self._env.step()
+        timer.add('env_step', start)
         self.infoset = self._active_player_info_set()
         done = False
         reward = 0.0
@@ -88,7 +125,9 @@ class Env:
             reward = self._get_reward()
             obs = None
         else:
-            obs = get_obs(self.infoset)
+            start = time.perf_counter()
+            obs = self._env.obs_encoder.get_obs()
+            timer.add('get_obs', start)
         return obs, reward, done, {}
 
     def _get_reward(self):
@@ -147,9 +186,8 @@ class DummyAgent(object):
 
     def act(self, infoset):
         """
-        Simply return the move that is set previously.
+        Simply return the move (or move id) that is set previously.
         """
-        assert self.move in infoset[1].moves
         return self.move
 
     def set_move(self, move):
@@ -166,6 +204,9 @@ def _get_one_hot_array(num_left_cards):
     return one_hot
 
 
+_ONE_HOT_ARRAYS = [_get_one_hot_array(num_left_cards) for num_left_cards in range(8)]
+
+
 def _cards2array(list_cards):
     return np.array(list_cards, dtype=np.int8)
 
@@ -191,148 +232,106 @@ def _opp_move2array(move):
     return ret
 
 
-def _encode_round_moves(round_moves_curr, round_moves_opp):
+# Encoding of every global move id from the acting player's and from the opponent's point of view.
+# shape = (NUM_MOVES, MOVE_VECTOR_SIZE)
+MY_MOVE_ARRAYS = np.stack([my_move2array(move) for move in ALL_MOVES])
+OPP_MOVE_ARRAYS = np.stack([_opp_move2array(move) for move in ALL_MOVES])
+MY_MOVE_ARRAYS.flags.writeable = False
+OPP_MOVE_ARRAYS.flags.writeable = False
+
+# Fills the empty slots of a round history given by move ids
+PAD_MOVE_ID = NUM_MOVES
+
+
+def _encode_round_moves(round_move_ids_curr, round_move_ids_opp):
     """
-    We encode the historical moves of the given round. If there is
+    We encode the historical moves (given by their global move ids) of the given round. If there is
     not yet 6 moves on either side then we pad the features with zeros. We encode so that the most recent moves are on
     fixed indices (5 and 11), and older decision are on index 4, 3,... and  10, 9, ... respectively.
     (So padding goes to the front). Finally, we obtain a ROUND_MOVES x MOVE_VECTOR_SIZE matrix, which will be fed into
     LSTM for encoding.
     """
-    z = np.zeros((ROUND_MOVES, MOVE_VECTOR_SIZE))
-    l_curr = len(round_moves_curr)
-    for i in range(6 - l_curr, 6):
-        z[i, :] = my_move2array(round_moves_curr[i - (6 - l_curr)])
-    l_opp = len(round_moves_opp)
-    for i in range(ROUND_MOVES - l_opp, ROUND_MOVES):
-        z[i, :] = _opp_move2array(round_moves_opp[i - (ROUND_MOVES - l_opp)])
+    z = np.zeros((ROUND_MOVES, MOVE_VECTOR_SIZE), dtype=np.int8)
+    l_curr = len(round_move_ids_curr)
+    if l_curr:
+        z[6 - l_curr:6, :] = MY_MOVE_ARRAYS[list(round_move_ids_curr)]
+    l_opp = len(round_move_ids_opp)
+    if l_opp:
+        z[ROUND_MOVES - l_opp:, :] = OPP_MOVE_ARRAYS[list(round_move_ids_opp)]
     return z
 
 
-def _create_batch(a_list, num):
-    return np.broadcast_to(a_list, (num, len(a_list)))
-
-
-def get_obs(infoset):
+def _round_move_ids(round_move_ids_curr, round_move_ids_opp):
     """
-    This function obtains observations with imperfect information
-    from the infoset.
-    
-    This function will return dictionary named `obs`. It contains
-    several fields. These fields will be used to train the model.
-    One can play with those features to improve the performance.
-
-    `id` is a string defining the global role of player encoding the infoset ('first' or 'second')
-
-    'round_id' is a string defining the round local role of the player encoding the infoset ('first' or 'second')
-
-    'moves' is the legal moves
-
-    `x_batch` is a batch of features (excluding opponent historical moves). It also encodes the available move features.
-    shape = (num_moves, X_FEATURE_SIZE)
-
-    `x_no_move`: the features (excluding the historical moves and the action features). It is not a batch.
-    shape = (X_NO_MOVE_FEATURE_SIZE)
-
-    `z_batch` is a batch of features encoding the historical moves of the round.
-    shape = (num_moves, ROUND_MOVES, MOVE_VECTOR_SIZE)
+    The round history as move ids laid out like the rows of _encode_round_moves: the moves of the current player on
+    index 0-5 and the moves of the opponent on 6-11, empty slots hold PAD_MOVE_ID.
+    """
+    z_ids = np.full(ROUND_MOVES, PAD_MOVE_ID, dtype=np.int16)
+    l_curr = len(round_move_ids_curr)
+    if l_curr:
+        z_ids[6 - l_curr:6] = round_move_ids_curr
+    l_opp = len(round_move_ids_opp)
+    if l_opp:
+        z_ids[ROUND_MOVES - l_opp:] = round_move_ids_opp
+    return z_ids
 
-    `z`: same as z_batch but not a batch.
-    shape = (ROUND_MOVES, MOVE_VECTOR_SIZE)
 
+def _encode_x_no_move(state, info, curr):
+    """
+    Encodes the features of player `curr` (excluding the historical moves and the action features) from the public
+    state and the private info set of the player.
     """
-    num_moves = len(infoset[1].moves)
-    curr = infoset[0].acting_player_id
     opp = 'second' if curr == 'first' else 'first'
 
     # FEATURE 1 -- Geisha points. SIZE=7
     geisha_points = np.array([2, 2, 2, 3, 3, 4, 5], dtype=np.int8)
-    geisha_points_batch = _create_batch(geisha_points, num_moves)
 
     # FEATURE 2 -- Geisha preferences. SIZE=7
-    geisha_preferences = _cards2array(infoset[0].geisha_preferences[curr]) - _cards2array(infoset[0].geisha_preferences[opp])
-    geisha_preferences_batch = _create_batch(geisha_preferences, num_moves)
+    geisha_preferences = _cards2array(state.geisha_preferences[curr]) - _cards2array(state.geisha_preferences[opp])
 
     # FEATURE 3 -- Hand cards. SIZE=7
-    hand_cards = _cards2array(infoset[1].hand_cards)
-    hand_cards_batch = _create_batch(hand_cards, num_moves)
+    hand_cards = _cards2array(info.hand_cards)
 
     # FEATURE 4 -- Stashed card. SIZE=7
-    stashed_card = _cards2array(infoset[1].stashed_card or [0] * 7)
-    stashed_card_batch = _create_batch(stashed_card, num_moves)
+    stashed_card = _cards2array(info.stashed_card or [0] * 7)
 
     # FEATURE 5 -- Trashed cards. SIZE=7
-    trashed_cards = _cards2array(infoset[1].trashed_cards or [0] * 7)
-    trashed_cards_batch = _create_batch(trashed_cards, num_moves)
+    trashed_cards = _cards2array(info.trashed_cards or [0] * 7)
 
     # FEATURE 6 -- Decision cards 1_2. SIZE=7
-    decision_cards_1_2 = _cards2array(infoset[0].decision_cards_1_2 or [0] * 7)
-    decision_cards_1_2_batch = _create_batch(decision_cards_1_2, num_moves)
+    decision_cards_1_2 = _cards2array(state.decision_cards_1_2 or [0] * 7)
 
     # FEATURE 7 -- Decision cards 2_2 first. SIZE=7
     decision_cards_2_2_1 = _cards2array(
-        (infoset[0].decision_cards_2_2[0] if infoset[0].decision_cards_2_2 else [0] * 7))
-    decision_cards_2_2_1_batch = _create_batch(decision_cards_2_2_1, num_moves)
+        (state.decision_cards_2_2[0] if state.decision_cards_2_2 else [0] * 7))
 
     # FEATURE 8 -- Decision cards 2_2 second. SIZE=7
     decision_cards_2_2_2 = _cards2array(
-        (infoset[0].decision_cards_2_2[1] if infoset[0].decision_cards_2_2 else [0] * 7))
-    decision_cards_2_2_2_batch = _create_batch(decision_cards_2_2_2, num_moves)
+        (state.decision_cards_2_2[1] if state.decision_cards_2_2 else [0] * 7))
 
     # FEATURE 9 -- Action cards. SIZE=4
-    action_cards = np.array(infoset[0].action_cards[curr], dtype=np.int8)
-    action_cards_batch = _create_batch(action_cards, num_moves)
+    action_cards = np.array(state.action_cards[curr], dtype=np.int8)
 
     # FEATURE 10 -- Action cards opp. SIZE=4
-    action_cards_opp = np.array(infoset[0].action_cards[opp], dtype=np.int8)
-    action_cards_opp_batch = _create_batch(action_cards_opp, num_moves)
+    action_cards_opp = np.array(state.action_cards[opp], dtype=np.int8)
 
     # FEATURE 11 -- Gift cards. SIZE=7
-    gift_cards = _cards2array(infoset[0].gift_cards[curr])
-    gift_cards_batch = _create_batch(gift_cards, num_moves)
+    gift_cards = _cards2array(state.gift_cards[curr])
 
     # FEATURE 12 -- Gift cards opp. SIZE=7
-    gift_cards_opp = _cards2array(infoset[0].gift_cards[opp])
-    gift_cards_opp_batch = _create_batch(gift_cards_opp, num_moves)
+    gift_cards_opp = _cards2array(state.gift_cards[opp])
 
     # FEATURE 13 -- All gift cards. SIZE=7
     all_gift_cards = gift_cards + stashed_card
-    all_gift_cards_batch = _create_batch(all_gift_cards, num_moves)
 
     # FEATURE 14 -- Number of cards (one-hot). SIZE=7
-    num_cards = _get_one_hot_array(infoset[0].num_cards[curr])
-    num_cards_batch = _create_batch(num_cards, num_moves)
+    num_cards = _get_one_hot_array(state.num_cards[curr])
 
     # FEATURE 15 -- Number of cards opp (one-hot). SIZE=7
-    num_cards_opp = _get_one_hot_array(infoset[0].num_cards[opp])
-    num_cards_opp_batch = _create_batch(num_cards_opp, num_moves)
+    num_cards_opp = _get_one_hot_array(state.num_cards[opp])
 
     # FEATURE 16 -- Unknown cards. (Calc uses that geisha points == number of geisha cards in the deck.) SIZE=7
     unknown_cards = geisha_points - hand_cards - all_gift_cards - trashed_cards - gift_cards_opp - decision_cards_1_2 - decision_cards_2_2_1 - decision_cards_2_2_2
-    unknown_cards_batch = _create_batch(unknown_cards, num_moves)
-
-    move_batch = np.zeros((num_moves, MOVE_VECTOR_SIZE))
-    for j, move in enumerate(infoset[1].moves):
-        move_batch[j, :] = my_move2array(move)
-
-    x_batch = np.empty((num_moves, X_FEATURE_SIZE), dtype=np.int8)
-    x_batch[:, 0:7] = geisha_points_batch
-    x_batch[:, 7:14] = geisha_preferences_batch
-    x_batch[:, 14:21] = hand_cards_batch
-    x_batch[:, 21:28] = stashed_card_batch
-    x_batch[:, 28:35] = trashed_cards_batch
-    x_batch[:, 35:42] = decision_cards_1_2_batch
-    x_batch[:, 42:49] = decision_cards_2_2_1_batch
-    x_batch[:, 49:56] = decision_cards_2_2_2_batch
-    x_batch[:, 56:60] = action_cards_batch
-    x_batch[:, 60:64] = action_cards_opp_batch
-    x_batch[:, 64:71] = gift_cards_batch
-    x_batch[:, 71:78] = gift_cards_opp_batch
-    x_batch[:, 78:85] = all_gift_cards_batch
-    x_batch[:, 85:92] = num_cards_batch
-    x_batch[:, 92:99] = num_cards_opp_batch
-    x_batch[:, 99:106] = unknown_cards_batch
-    x_batch[:, 106:] = move_batch
 
     x_no_move = np.empty(X_NO_MOVE_FEATURE_SIZE, dtype=np.int8)
     x_no_move[0:7] = geisha_points
@@ -351,16 +350,208 @@ def get_obs(infoset):
     x_no_move[85:92] = num_cards
     x_no_move[92:99] = num_cards_opp
     x_no_move[99:106] = unknown_cards
+    return x_no_move
 
-    z = _encode_round_moves(infoset[0].round_moves[curr], infoset[0].round_moves[opp])
-    z_batch = np.broadcast_to(z, (num_moves, *z.shape))
+
+_NO_CARDS = (0,) * 7
+
+
+def _encode_raw_state(state, info, curr):
+    """
+    The raw state fields of player `curr`, see RAW_STATE_SIZE for the layout. It is a plain copy of the tuples of the
+    state and the private info set, x_no_move can be derived from them (hanamikoji.dmc.features).
+    """
+    opp = 'second' if curr == 'first' else 'first'
+    decision_cards_2_2 = state.decision_cards_2_2 or (_NO_CARDS, _NO_CARDS)
+    return np.array(state.geisha_preferences[curr] + state.geisha_preferences[opp] + info.hand_cards
+                    + (info.stashed_card or _NO_CARDS) + (info.trashed_cards or _NO_CARDS)
+                    + (state.decision_cards_1_2 or _NO_CARDS) + decision_cards_2_2[0] + decision_cards_2_2[1]
+                    + state.action_cards[curr] + state.action_cards[opp] + state.gift_cards[curr]
+                    + state.gift_cards[opp] + (state.num_cards[curr], state.num_cards[opp]), dtype=np.int8)
+
+
+def _update_unknown_cards(x_no_move):
+    # FEATURE 16 from the other features
+    x_no_move[99:106] = (x_no_move[0:7] - x_no_move[14:21] - x_no_move[78:85] - x_no_move[28:35] - x_no_move[71:78]
+                         - x_no_move[35:42] - x_no_move[42:49] - x_no_move[49:56])
+
+
+def _build_obs(acting_player_id, round_id, moves, move_ids, x_no_move, z, z_ids):
+    num_moves = len(moves)
+    x_batch = np.empty((num_moves, X_FEATURE_SIZE), dtype=np.float32)
+    x_batch[:, :X_NO_MOVE_FEATURE_SIZE] = x_no_move
+    x_batch[:, X_NO_MOVE_FEATURE_SIZE:] = MY_MOVE_ARRAYS[move_ids]
+    # A read-only broadcast view, the history is the same for every move
+    z_batch = np.broadcast_to(z.astype(np.float32), (num_moves, *z.shape))
     obs = {
-        'id': infoset[0].acting_player_id,
-        'round_id': infoset[0].id_to_round_id[infoset[0].acting_player_id],
-        'moves': infoset[1].moves,
-        'x_batch': x_batch.astype(np.float32),
-        'x_no_move': x_no_move.astype(np.int8),
-        'z': z.astype(np.int8),
-        'z_batch': z_batch.astype(np.float32)
+        'id': acting_player_id,
+        'round_id': round_id,
+        'moves': moves,
+        'move_ids': move_ids,
+        'x_batch': x_batch,
+        'x_no_move': x_no_move.copy(),
+        'z': z.copy(),
+        'z_ids': z_ids.copy(),
+        'z_batch': z_batch
     }
     return obs
+
+
+def _build_raw_obs(acting_player_id, round_id, moves, move_ids, x_raw, z_ids):
+    return {
+        'id': acting_player_id,
+        'round_id': round_id,
+        'moves': moves,
+        'move_ids': move_ids,
+        'x_raw': x_raw,
+        'z_ids': z_ids.copy()
+    }
+
+
+def get_obs(infoset, raw=False):
+    """
+    This function obtains observations with imperfect information
+    from the infoset.
+    
+    This function will return dictionary named `obs`. It contains
+    several fields. These fields will be used to train the model.
+    One can play with those features to improve the performance.
+
+    `id` is a string defining the global role of player encoding the infoset ('first' or 'second')
+
+    'round_id' is a string defining the round local role of the player encoding the infoset ('first' or 'second')
+
+    'moves' is the legal moves
+
+    'move_ids' is the global move ids of the legal moves
+
+    `x_batch` is a batch of features (excluding opponent historical moves). It also encodes the available move features.
+    shape = (num_moves, X_FEATURE_SIZE)
+
+    `x_no_move`: the features (excluding the historical moves and the action features). It is not a batch.
+    shape = (X_NO_MOVE_FEATURE_SIZE)
+
+    `z_batch` is a batch of features encoding the historical moves of the round. It is a read-only broadcast of z,
+    the models accept z with batch size 1 instead.
+    shape = (num_moves, ROUND_MOVES, MOVE_VECTOR_SIZE)
+
+    `z`: same as z_batch but not a batch.
+    shape = (ROUND_MOVES, MOVE_VECTOR_SIZE)
+
+    `z_ids`: the rows of z as global move ids, PAD_MOVE_ID for the padding. Own moves come first, then the opponent's.
+    shape = (ROUND_MOVES)
+
+    With raw=True only `id`, 'round_id', 'moves', 'move_ids', `z_ids` and `x_raw` are returned, the features are
+    derived from them by the learner (--learner_featurization).
+
+    `x_raw`: the raw state fields x_no_move is derived from.
+    shape = (RAW_STATE_SIZE)
+    """
+    state, info = infoset[0], infoset[1]
+    curr = state.acting_player_id
+    opp = 'second' if curr == 'first' else 'first'
+    z_ids = _round_move_ids(state.round_move_ids[curr], state.round_move_ids[opp])
+    if raw:
+        return _build_raw_obs(curr, state.id_to_round_id[curr], info.moves, info.move_ids,
+                              _encode_raw_state(state, info, curr), z_ids)
+    x_no_move = _encode_x_no_move(state, info, curr)
+    z = _encode_round_moves(state.round_move_ids[curr], state.round_move_ids[opp])
+    return _build_obs(curr, state.id_to_round_id[curr], info.moves, info.move_ids, x_no_move, z, z_ids)
+
+
+class ObsEncoder:
+    """
+    Incremental version of get_obs living alongside a GameEnv (set as its obs_encoder). It keeps the x_no_move
+    features and the round history z of both players and updates only the entries touched by each applied move.
+    The per move batch is materialized when get_obs is called, Env calls it after every reset and step.
+    With raw=True it returns the raw observations of get_obs and only keeps the round history ids.
+    """
+
+    def __init__(self, game_env, raw=False):
+        self.game_env = game_env
+        self.raw = raw
+        self.x_no_move = {}
+        self.z = {}
+        self.z_ids = {}
+
+    def reset(self):
+        """
+        Encodes both players from scratch. Called by the GameEnv at the start of every round.
+        """
+        state = self.game_env.state
+        for curr, opp in [('first', 'second'), ('second', 'first')]:
+            self.z_ids[curr] = _round_move_ids(state.round_move_ids[curr], state.round_move_ids[opp])
+            if not self.raw:
+                self.x_no_move[curr] = _encode_x_no_move(state, self.game_env.private_info_sets[curr], curr)
+                self.z[curr] = _encode_round_moves(state.round_move_ids[curr], state.round_move_ids[opp])
+
+    def update(self, player_id, move_id):
+        """
+        Called by the GameEnv after the move of player_id is applied (and the next player has drawn) within a round.
+        """
+        state = self.game_env.state
+        private_info_sets = self.game_env.private_info_sets
+        opp_id = 'second' if player_id == 'first' else 'first'
+
+        # The round history: the most recent moves are on index 5 and 11
+        history_id = state.round_move_ids[player_id][-1]
+        z_ids, z_ids_opp = self.z_ids[player_id], self.z_ids[opp_id]
+        z_ids[0:5] = z_ids[1:6]
+        z_ids[5] = history_id
+        z_ids_opp[6:11] = z_ids_opp[7:12]
+        z_ids_opp[11] = history_id
+        if self.raw:
+            return
+        z, z_opp = self.z[player_id], self.z[opp_id]
+        z[0:5] = z[1:6]
+        z[5] = MY_MOVE_ARRAYS[history_id]
+        z_opp[6:11] = z_opp[7:12]
+        z_opp[11] = OPP_MOVE_ARRAYS[history_id]
+
+        x, x_opp = self.x_no_move[player_id], self.x_no_move[opp_id]
+
+        move_type = ALL_MOVES[move_id][0]
+        if move_type == TYPE_0_STASH:
+            x[21:28] = private_info_sets[player_id].stashed_card
+            x[78:85] = x[64:71] + x[21:28]
+        elif move_type == TYPE_1_TRASH:
+            x[28:35] = private_info_sets[player_id].trashed_cards
+        elif move_type == TYPE_2_CHOOSE_1_2:
+            x[35:42] = x_opp[35:42] = state.decision_cards_1_2
+        elif move_type == TYPE_3_CHOOSE_2_2:
+            x[42:49] = x_opp[42:49] = state.decision_cards_2_2[0]
+            x[49:56] = x_opp[49:56] = state.decision_cards_2_2[1]
+        else:
+            if move_type == TYPE_4_RESOLVE_1_2:
+                x[35:42] = x_opp[35:42] = 0
+            else:
+                x[42:56] = x_opp[42:56] = 0
+            for curr, opp, x_curr in [(player_id, opp_id, x), (opp_id, player_id, x_opp)]:
+                x_curr[64:71] = state.gift_cards[curr]
+                x_curr[71:78] = state.gift_cards[opp]
+                x_curr[78:85] = x_curr[64:71] + x_curr[21:28]
+        if move_type <= TYPE_3_CHOOSE_2_2:
+            x[56:60] = x_opp[60:64] = state.action_cards[player_id]
+            x[14:21] = private_info_sets[player_id].hand_cards
+            x[85:92] = x_opp[92:99] = _ONE_HOT_ARRAYS[state.num_cards[player_id]]
+
+        # The next acting player may have drawn a card
+        curr = state.acting_player_id
+        x_curr, x_other = (x, x_opp) if curr == player_id else (x_opp, x)
+        x_curr[14:21] = private_info_sets[curr].hand_cards
+        x_curr[85:92] = x_other[92:99] = _ONE_HOT_ARRAYS[state.num_cards[curr]]
+        _update_unknown_cards(x)
+        _update_unknown_cards(x_opp)
+
+    def get_obs(self):
+        """
+        Same as get_obs of the current infoset of the acting player.
+        """
+        state = self.game_env.state
+        curr = state.acting_player_id
+        info = self.game_env.private_info_sets[curr]
+        if self.raw:
+            return _build_raw_obs(curr, state.id_to_round_id[curr], info.moves, info.move_ids,
+                                  _encode_raw_state(state, info, curr), self.z_ids[curr])
+        return _build_obs(curr, state.id_to_round_id[curr], info.moves, info.move_ids, self.x_no_move[curr],
+                          self.z[curr], self.z_ids[curr])
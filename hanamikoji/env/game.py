@@ -1,18 +1,23 @@
-from copy import deepcopy
+import time
+
 from .move_generator import *
+from hanamikoji.timing import timer
 import numpy as np
 
 
 def _add_cards(a, b):
-    return [a + b for a, b in zip(a, b)]
+    return tuple([a + b for a, b in zip(a, b)])
 
 
 def _sub_cards(a, b):
-    return [a - b for a, b in zip(a, b)]
+    return tuple([a - b for a, b in zip(a, b)])
 
 
 deck = [0, 0, 1, 1, 2, 2, 3, 3, 3, 4, 4, 4, 5, 5, 5, 5, 6, 6, 6, 6, 6]
 
+# With fixed deals (GameEnv.card_play_data) game i plays round r with the deal at i * DEALS_PER_GAME + r
+DEALS_PER_GAME = 20
+
 
 def get_card_play_data():
     _deck = deck.copy()
@@ -29,6 +34,8 @@ def get_card_play_data():
 class GameState(object):
     """
     GameState contains the public data of the game.
+    The card vectors and the round moves are stored in tuples, and the engine replaces them instead of modifying
+    them in place (copy-on-write), so a snapshot only needs to copy the per player dicts.
     """
 
     def __init__(self):
@@ -37,21 +44,38 @@ class GameState(object):
         # Here keys mean global 'first' and 'second', values mean round local first and second (indicating eval model)
         self.id_to_round_id = {'first': 'first', 'second': 'second'}
         # Constant rule list storing the geisha card numbers which coincide with their point reward
-        self.points = [2, 2, 2, 3, 3, 4, 5]
+        self.points = (2, 2, 2, 3, 3, 4, 5)
         # The already played and public geisha gift cards
-        self.gift_cards = {'first': [0, 0, 0, 0, 0, 0, 0], 'second': [0, 0, 0, 0, 0, 0, 0]}
+        self.gift_cards = {'first': (0, 0, 0, 0, 0, 0, 0), 'second': (0, 0, 0, 0, 0, 0, 0)}
         # The possible action cards
-        self.action_cards = {'first': [1, 1, 1, 1], 'second': [1, 1, 1, 1]}
+        self.action_cards = {'first': (1, 1, 1, 1), 'second': (1, 1, 1, 1)}
         # decision cards 1 - 2
         self.decision_cards_1_2 = None
         # decision cards 2 - 2
         self.decision_cards_2_2 = None
         # +1 if player is preferred
-        self.geisha_preferences = {'first': [0, 0, 0, 0, 0, 0, 0], 'second': [0, 0, 0, 0, 0, 0, 0]}
+        self.geisha_preferences = {'first': (0, 0, 0, 0, 0, 0, 0), 'second': (0, 0, 0, 0, 0, 0, 0)}
         # The number of cards in hand
         self.num_cards = {'first': 7, 'second': 6}
         # Contains the moves of the first and second players
-        self.round_moves = {'first': [], 'second': []}
+        self.round_moves = {'first': (), 'second': ()}
+        # The global move ids of round_moves
+        self.round_move_ids = {'first': (), 'second': ()}
+
+    def snapshot(self):
+        """
+        Returns a read-only copy of the state. The tuples are shared with the state, only the dicts are copied.
+        """
+        snapshot = GameState.__new__(GameState)
+        snapshot.__dict__.update(self.__dict__)
+        snapshot.id_to_round_id = dict(self.id_to_round_id)
+        snapshot.gift_cards = dict(self.gift_cards)
+        snapshot.action_cards = dict(self.action_cards)
+        snapshot.geisha_preferences = dict(self.geisha_preferences)
+        snapshot.num_cards = dict(self.num_cards)
+        snapshot.round_moves = dict(self.round_moves)
+        snapshot.round_move_ids = dict(self.round_move_ids)
+        return snapshot
 
 
 class GameEnv(object):
@@ -59,6 +83,8 @@ class GameEnv(object):
     def __init__(self, players):
         self.players = players
         self.deck = None
+        # Index of the next card to draw from the deck
+        self.deck_pos = 0
         self.winner = None
         self.num_wins = {'first': 0, 'second': 0}
         self.round = 1
@@ -71,18 +97,26 @@ class GameEnv(object):
         # First element is GameState, second element is PrivateInfo.
         self.active_player_info_set = None
         self.card_play_data = None
+        # Optional source of random deals used without card_play_data (see deals.DealStream)
+        self.deal_stream = None
+        # Optional incremental observation encoder (see env.ObsEncoder)
+        self.obs_encoder = None
 
     def get_opp(self):
         return 'first' if self.state.acting_player_id == 'second' else 'second'
 
     def get_active_player_info_set(self):
-        return deepcopy([self.state, self.private_info_sets[self.state.acting_player_id]])
+        return [self.state.snapshot(), self.private_info_sets[self.state.acting_player_id].snapshot()]
 
     def card_play_init(self, card_play_data):
-        self.private_info_sets[self.state.acting_player_id].hand_cards = card_play_data['first']
-        self.private_info_sets[self.get_opp()].hand_cards = card_play_data['second']
+        # card_play_data is only read, so the deals can be shared without copying
+        self.private_info_sets[self.state.acting_player_id].hand_cards = tuple(card_play_data['first'])
+        self.private_info_sets[self.get_opp()].hand_cards = tuple(card_play_data['second'])
         self.deck = card_play_data['deck']
-        self.private_info_sets[self.state.acting_player_id].moves = self.get_moves()
+        self.deck_pos = 0
+        self.set_moves(self.private_info_sets[self.state.acting_player_id])
+        if self.obs_encoder is not None:
+            self.obs_encoder.reset()
         self.active_player_info_set = self.get_active_player_info_set()
 
     def get_winner(self):
@@ -91,17 +125,20 @@ class GameEnv(object):
     def update_geisha_preferences(self):
         first_gifts = _add_cards(self.state.gift_cards['first'], self.private_info_sets['first'].stashed_card)
         second_gifts = _add_cards(self.state.gift_cards['second'], self.private_info_sets['second'].stashed_card)
+        first_preferences = list(self.state.geisha_preferences['first'])
+        second_preferences = list(self.state.geisha_preferences['second'])
         for i in range(7):
             if first_gifts[i] > second_gifts[i] or (
-                    first_gifts[i] == second_gifts[i] and self.state.geisha_preferences['first'][i] == 1):
-                self.state.geisha_preferences['first'][i] = 1
+                    first_gifts[i] == second_gifts[i] and first_preferences[i] == 1):
+                first_preferences[i] = 1
             else:
-                self.state.geisha_preferences['first'][i] = 0
+                first_preferences[i] = 0
             if first_gifts[i] < second_gifts[i] or (
-                    first_gifts[i] == second_gifts[i] and self.state.geisha_preferences['second'][i] == 1):
-                self.state.geisha_preferences['second'][i] = 1
+                    first_gifts[i] == second_gifts[i] and second_preferences[i] == 1):
+                second_preferences[i] = 1
             else:
-                self.state.geisha_preferences['second'][i] = 0
+                second_preferences[i] = 0
+        self.state.geisha_preferences = {'first': tuple(first_preferences), 'second': tuple(second_preferences)}
 
     def is_game_ended(self):
         first_geisha_win = 0
@@ -132,18 +169,35 @@ class GameEnv(object):
             self.num_wins[self.winner] += 1
 
     def get_moves(self):
-        mg = MovesGener(self.private_info_sets[self.state.acting_player_id].hand_cards,
-                        self.state.action_cards[self.state.acting_player_id],
-                        self.state.decision_cards_1_2,
-                        self.state.decision_cards_2_2)
-        moves = mg.gen_moves()
-        return moves
+        return self.get_moves_and_ids()[0]
+
+    def get_moves_and_ids(self):
+        return get_legal_moves_and_ids(self.private_info_sets[self.state.acting_player_id].hand_cards,
+                                       self.state.action_cards[self.state.acting_player_id],
+                                       self.state.decision_cards_1_2,
+                                       self.state.decision_cards_2_2)
+
+    def set_moves(self, info):
+        start = time.perf_counter()
+        info.moves, info.move_ids, info.legal_move_ids = self.get_moves_and_ids()
+        timer.add('legal_moves', start)
+
+    def add_round_move(self, player_id, move_id):
+        self.state.round_moves[player_id] += (ALL_MOVES[move_id],)
+        self.state.round_move_ids[player_id] += (move_id,)
+
+    def use_action_card(self, player_id, action):
+        action_cards = list(self.state.action_cards[player_id])
+        action_cards[action] = 0
+        self.state.action_cards[player_id] = tuple(action_cards)
 
     def get_new_round_play_data(self):
-        assert (self.round < 20)
+        assert (self.round < DEALS_PER_GAME)
         if self.card_play_data is not None:
             game_idx = self.num_wins['first'] + self.num_wins['second']
-            return deepcopy(self.card_play_data[game_idx * 20 + self.round])
+            return self.card_play_data[game_idx * DEALS_PER_GAME + self.round]
+        elif self.deal_stream is not None:
+            return self.deal_stream()
         else:
             return get_card_play_data()
 
@@ -151,49 +205,54 @@ class GameEnv(object):
         curr = self.state.acting_player_id
         opp = self.get_opp()
         info = self.private_info_sets[curr]
-        self.active_player_info_set = self.get_active_player_info_set()
+        # Players can answer with a move or with a global move id
         move = self.players[curr].act(self.active_player_info_set)
-        assert move in self.active_player_info_set[1].moves
+        if isinstance(move, (int, np.integer)):
+            move_id = int(move)
+            move = ALL_MOVES[move_id]
+        else:
+            move_id = move2id(move)
+        assert move_id in info.legal_move_ids
 
         draw_card = True
         if move[0] == TYPE_0_STASH:
-            self.state.round_moves[curr].append([move[0], [0] * 7]) # TODO FIX?
-            self.state.action_cards[curr][0] = 0
+            self.add_round_move(curr, HIDDEN_STASH_ID) # TODO FIX?
+            self.use_action_card(curr, 0)
             info.hand_cards = _sub_cards(info.hand_cards, move[1])
-            info.stashed_card = move[1]
+            info.stashed_card = tuple(move[1])
             self.state.num_cards[curr] -= 1
             self.state.acting_player_id = opp
         if move[0] == TYPE_1_TRASH:
-            self.state.round_moves[curr].append([move[0], [0] * 7]) # TODO FIX?
-            self.state.action_cards[curr][1] = 0
+            self.add_round_move(curr, HIDDEN_TRASH_ID) # TODO FIX?
+            self.use_action_card(curr, 1)
             info.hand_cards = _sub_cards(info.hand_cards, move[1])
-            info.trashed_cards = move[1]
+            info.trashed_cards = tuple(move[1])
             self.state.num_cards[curr] -= 2
             self.state.acting_player_id = opp
         if move[0] == TYPE_2_CHOOSE_1_2:
-            self.state.round_moves[curr].append(move)
-            self.state.action_cards[curr][2] = 0
+            self.add_round_move(curr, move_id)
+            self.use_action_card(curr, 2)
             info.hand_cards = _sub_cards(info.hand_cards, move[1])
-            self.state.decision_cards_1_2 = move[1]
+            self.state.decision_cards_1_2 = tuple(move[1])
             self.state.num_cards[curr] -= 3
             self.state.acting_player_id = opp
             draw_card = False
         if move[0] == TYPE_3_CHOOSE_2_2:
-            self.state.round_moves[curr].append(move)
-            self.state.action_cards[curr][3] = 0
+            self.add_round_move(curr, move_id)
+            self.use_action_card(curr, 3)
             info.hand_cards = _sub_cards(info.hand_cards, move[1][0])
             info.hand_cards = _sub_cards(info.hand_cards, move[1][1])
-            self.state.decision_cards_2_2 = move[1]
+            self.state.decision_cards_2_2 = (tuple(move[1][0]), tuple(move[1][1]))
             self.state.num_cards[curr] -= 4
             self.state.acting_player_id = opp
             draw_card = False
         if move[0] == TYPE_4_RESOLVE_1_2:
-            self.state.round_moves[curr].append(move)
+            self.add_round_move(curr, move_id)
             self.state.decision_cards_1_2 = None
             self.state.gift_cards[curr] = _add_cards(self.state.gift_cards[curr], move[1][0])
             self.state.gift_cards[opp] = _add_cards(self.state.gift_cards[opp], move[1][1])
         if move[0] == TYPE_5_RESOLVE_2_2:
-            self.state.round_moves[curr].append(move)
+            self.add_round_move(curr, move_id)
             self.state.decision_cards_2_2 = None
             self.state.gift_cards[curr] = _add_cards(self.state.gift_cards[curr], move[1][0])
             self.state.gift_cards[opp] = _add_cards(self.state.gift_cards[opp], move[1][1])
@@ -203,7 +262,7 @@ class GameEnv(object):
             self.update_geisha_preferences()
             self.set_winner()
             if self.winner is None:
-                next_geisha_preferences = deepcopy(self.state.geisha_preferences)
+                next_geisha_preferences = self.state.geisha_preferences
                 self.round += 1
                 self.state = GameState()
                 self.state.geisha_preferences = next_geisha_preferences
@@ -217,14 +276,19 @@ class GameEnv(object):
         else:
             info = self.private_info_sets[self.state.acting_player_id]
             if draw_card:
-                info.hand_cards[self.deck[0]] += 1
+                hand_cards = list(info.hand_cards)
+                hand_cards[self.deck[self.deck_pos]] += 1
+                info.hand_cards = tuple(hand_cards)
                 self.state.num_cards[self.state.acting_player_id] += 1
-                self.deck.pop(0)
-            info.moves = self.get_moves()
+                self.deck_pos += 1
+            self.set_moves(info)
+            if self.obs_encoder is not None:
+                self.obs_encoder.update(curr, move_id)
             self.active_player_info_set = self.get_active_player_info_set()
 
     def reset(self):
         self.deck = None
+        self.deck_pos = 0
         self.winner = None
         self.round = 1
         self.state = GameState()
@@ -235,14 +299,27 @@ class GameEnv(object):
 class PrivateInfoSet(object):
     """
     PrivateInfoSet contains the private data of the players.
+    The card vectors are tuples and the legal moves are shared with the move table, none of them is modified in place.
     """
 
     def __init__(self):
-        # The hand cards of the current player. A list.
+        # The hand cards of the current player. A tuple.
         self.hand_cards = None
         # The stashed card of the current player
         self.stashed_card = None
         # The two trashed cards of the current player
         self.trashed_cards = None
-        # The legal moves. It is a list of list
+        # The legal moves. It is a list of list, shared with the move table, so it is read-only
         self.moves = None
+        # The global move ids of the legal moves. It is a read-only int64 array
+        self.move_ids = None
+        # The global move ids of the legal moves as a frozenset
+        self.legal_move_ids = None
+
+    def snapshot(self):
+        """
+        Returns a read-only copy of the private info set. Every field is immutable, so they are all shared.
+        """
+        snapshot = PrivateInfoSet.__new__(PrivateInfoSet)
+        snapshot.__dict__.update(self.__dict__)
+        return snapshot
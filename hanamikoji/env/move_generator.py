@@ -1,3 +1,5 @@
+import numpy as np
+
 TYPE_0_STASH = 0
 TYPE_1_TRASH = 1
 TYPE_2_CHOOSE_1_2 = 2
@@ -5,6 +7,11 @@ TYPE_3_CHOOSE_2_2 = 3
 TYPE_4_RESOLVE_1_2 = 4
 TYPE_5_RESOLVE_2_2 = 5
 
+# Number of copies of each geisha card in the deck (it coincides with the geisha points)
+CARD_LIMITS = [2, 2, 2, 3, 3, 4, 5]
+# Number of hand cards an action card consumes
+ACTION_CARD_COSTS = [1, 2, 3, 4]
+
 class MovesGener(object):
     """
     This is for generating the possible combinations
@@ -126,3 +133,124 @@ class MovesGener(object):
         if self.resolve_2_2:
             moves.extend(self.resolve_2_2)
         return moves
+
+
+
+def _cards_key(cards):
+    # Every card count fits into 3 bits, so a 7 length card vector packs into 21 bits
+    return (cards[0] | cards[1] << 3 | cards[2] << 6 | cards[3] << 9 | cards[4] << 12 | cards[5] << 15 |
+            cards[6] << 18)
+
+
+def _move_key(move):
+    if move[0] < TYPE_3_CHOOSE_2_2:
+        return move[0] << 42 | _cards_key(move[1])
+    return move[0] << 42 | _cards_key(move[1][0]) << 21 | _cards_key(move[1][1])
+
+
+def _gen_all_moves():
+    """
+    Canonical enumeration of every Hanamikoji move. The hidden stash and trash moves, which are the ones stored in the
+    round history, close the list.
+    """
+    mg = MovesGener(CARD_LIMITS, [1, 1, 1, 1], None, None)
+    moves = mg.gen_moves()
+    for move in mg.choose_1_2:
+        moves.extend(MovesGener(None, None, move[1], None).gen_moves())
+    for move in mg.choose_2_2:
+        moves.extend(MovesGener(None, None, None, [move[1][0][:], move[1][1][:]]).gen_moves())
+    moves.append([TYPE_0_STASH, [0] * 7])
+    moves.append([TYPE_1_TRASH, [0] * 7])
+    return moves
+
+
+# Every possible move, the index of a move is its global move id
+ALL_MOVES = _gen_all_moves()
+NUM_MOVES = len(ALL_MOVES)
+HIDDEN_STASH_ID = NUM_MOVES - 2
+HIDDEN_TRASH_ID = NUM_MOVES - 1
+_move_ids = {_move_key(move): move_id for move_id, move in enumerate(ALL_MOVES)}
+assert len(_move_ids) == NUM_MOVES
+
+
+def move2id(move):
+    return _move_ids[_move_key(move)]
+
+
+def moves_key(cards_list, action_cards, choose_1_2, choose_2_2):
+    """
+    Integer key of a move generation input. The legal moves are determined by the decision cards if any of them is
+    present, otherwise by the hand cards and the still available action cards.
+    """
+    if choose_1_2:
+        return 1 << 42 | _cards_key(choose_1_2)
+    if choose_2_2:
+        return 1 << 43 | _cards_key(choose_2_2[0]) << 21 | _cards_key(choose_2_2[1])
+    return (action_cards[0] | action_cards[1] << 1 | action_cards[2] << 2 | action_cards[3] << 3) << 21 | _cards_key(
+        cards_list)
+
+
+# Maps moves_key to the triple (legal moves, legal move ids, set of legal move ids). The entries are shared between
+# all the callers, so they must not be modified.
+_move_table = {}
+
+
+def get_legal_moves_and_ids(cards_list, action_cards, choose_1_2, choose_2_2):
+    """
+    Same as MovesGener(cards_list, action_cards, choose_1_2, choose_2_2).gen_moves(), but the moves are looked up in
+    a table. Missing entries are generated once and then cached. Besides the moves the entry holds their global move
+    ids as an array and as a frozenset (for O(1) legality checks). The returned objects are shared, they are read-only.
+    """
+    key = moves_key(cards_list, action_cards, choose_1_2, choose_2_2)
+    entry = _move_table.get(key)
+    if entry is None:
+        moves = MovesGener(list(cards_list) if cards_list else cards_list, action_cards,
+                           list(choose_1_2) if choose_1_2 else None,
+                           [list(choose_2_2[0]), list(choose_2_2[1])] if choose_2_2 else None).gen_moves()
+        move_ids = np.array([move2id(move) for move in moves], dtype=np.int64)
+        move_ids.flags.writeable = False
+        entry = (moves, move_ids, frozenset(move_ids.tolist()))
+        _move_table[key] = entry
+    return entry
+
+
+def get_legal_moves(cards_list, action_cards, choose_1_2, choose_2_2):
+    return get_legal_moves_and_ids(cards_list, action_cards, choose_1_2, choose_2_2)[0]
+
+
+def _gen_hands(num_cards, start=0):
+    if start == 7:
+        if num_cards == 0:
+            yield [0] * 7
+        return
+    for val in range(min(num_cards, CARD_LIMITS[start]) + 1):
+        for hand in _gen_hands(num_cards - val, start + 1):
+            hand[start] = val
+            yield hand
+
+
+def build_move_table():
+    """
+    Fills the move table with every reachable move generation input. At a regular turn the player has drawn one card
+    for each action card used so far plus one, hence the hand size is determined by the available action cards.
+    The resolve inputs are the choose moves of the table.
+    """
+    for mask in range(1, 16):
+        action_cards = [(mask >> i) & 1 for i in range(4)]
+        num_used = 4 - sum(action_cards)
+        num_cards = 7 + num_used - sum(c for c, a in zip(ACTION_CARD_COSTS, action_cards) if a == 0)
+        for hand in _gen_hands(num_cards):
+            get_legal_moves(hand, action_cards, None, None)
+    for action_cards, choice in [([0, 0, 1, 0], 3), ([0, 0, 0, 1], 4)]:
+        for hand in _gen_hands(choice):
+            for move in get_legal_moves(hand, action_cards, None, None):
+                if move[0] == TYPE_2_CHOOSE_1_2:
+                    get_legal_moves(None, None, move[1], None)
+                else:
+                    get_legal_moves(None, None, None, move[1])
+
+
+build_move_table()
+
+# Largest number of legal moves of a decision, bounds the size of fixed width move buffers
+MAX_LEGAL_MOVES = max(len(entry[0]) for entry in _move_table.values())
@@ -0,0 +1,305 @@
+"""
+Vectorized game engine. VecGameEnv holds N games in numpy arrays using the CompactGameState and
+CompactPrivateInfoSet layouts (one row per game) and advances all of them with a single step call.
+"""
+import numpy as np
+
+from .compact import *
+from .deals import deal_cards, hand_counts
+from .env import MY_MOVE_ARRAYS, OPP_MOVE_ARRAYS, ROUND_MOVES, MOVE_VECTOR_SIZE, X_NO_MOVE_FEATURE_SIZE
+
+# Mixed radix index of a card count vector, it is unique for every vector within the card limits
+_CARDS_RADIX = np.cumprod([1] + [limit + 1 for limit in CARD_LIMITS[:-1]])
+_NUM_CARD_VECTORS = int(np.prod([limit + 1 for limit in CARD_LIMITS]))
+
+
+def _cards_index(cards):
+    return cards.astype(np.int64) @ _CARDS_RADIX
+
+
+# Number of cards involved in every move
+_MOVE_HAND_CARDS = MOVE_CARDS.sum(axis=1)
+
+# Regular (action card) moves, their ids are contiguous: _REGULAR_TABLE[hand index, j] tells whether the hand contains the cards of the move
+# _REGULAR_MOVE_IDS[j]
+_REGULAR_MOVE_IDS = np.flatnonzero(MOVE_TYPES[:HIDDEN_STASH_ID] <= TYPE_3_CHOOSE_2_2)
+_REGULAR_MOVES = slice(_REGULAR_MOVE_IDS[0], _REGULAR_MOVE_IDS[-1] + 1)
+_REGULAR_MOVE_TYPES = MOVE_TYPES[_REGULAR_MOVE_IDS]
+_ALL_CARD_VECTORS = (np.arange(_NUM_CARD_VECTORS)[:, None] // _CARDS_RADIX) % (np.array(CARD_LIMITS) + 1)
+_REGULAR_TABLE = np.ones((_NUM_CARD_VECTORS, len(_REGULAR_MOVE_IDS)), dtype=bool)
+for _card in range(7):
+    _REGULAR_TABLE &= _ALL_CARD_VECTORS[:, _card, None] >= _MOVE_HAND_CARDS[None, _REGULAR_MOVE_IDS, _card]
+
+# Resolve moves are legal if their two piles are the decision cards. The move ids of a kind are contiguous.
+_RESOLVE_1_2_IDS = np.flatnonzero(MOVE_TYPES == TYPE_4_RESOLVE_1_2)
+_RESOLVE_1_2_MOVES = slice(_RESOLVE_1_2_IDS[0], _RESOLVE_1_2_IDS[-1] + 1)
+_RESOLVE_1_2_KEYS = _cards_index(_MOVE_HAND_CARDS[_RESOLVE_1_2_IDS])
+_RESOLVE_2_2_IDS = np.flatnonzero(MOVE_TYPES == TYPE_5_RESOLVE_2_2)
+_RESOLVE_2_2_MOVES = slice(_RESOLVE_2_2_IDS[0], _RESOLVE_2_2_IDS[-1] + 1)
+_RESOLVE_2_2_KEYS = (_cards_index(MOVE_CARDS[_RESOLVE_2_2_IDS, 0]) * _NUM_CARD_VECTORS +
+                     _cards_index(MOVE_CARDS[_RESOLVE_2_2_IDS, 1]))
+for _ids in [_REGULAR_MOVE_IDS, _RESOLVE_1_2_IDS, _RESOLVE_2_2_IDS]:
+    assert len(_ids) == _ids[-1] - _ids[0] + 1
+
+# Move encodings extended with a zero row, which is used for padding the round history
+_MY_MOVE_ARRAYS = np.concatenate([MY_MOVE_ARRAYS, np.zeros((1, MOVE_VECTOR_SIZE), dtype=np.int8)])
+_OPP_MOVE_ARRAYS = np.concatenate([OPP_MOVE_ARRAYS, np.zeros((1, MOVE_VECTOR_SIZE), dtype=np.int8)])
+_PAD_ID = NUM_MOVES
+
+_ONE_HOT = np.concatenate([np.zeros((1, 7), dtype=np.int8), np.eye(7, dtype=np.int8)])
+
+
+def deal_batch(num_deals, rng):
+    """
+    Deals num_deals rounds at once. Returns the hand of the round first player (7 cards), the hand of the
+    round second player (6 cards) as count vectors and the remaining deck (8 cards).
+    """
+    cards = deal_cards(num_deals, rng).astype(np.int8)
+    return hand_counts(cards[:, :7]).astype(np.int8), hand_counts(cards[:, 7:13]).astype(np.int8), cards[:, 13:]
+
+
+class VecGameEnv(object):
+    """
+    N independent games stepped together. Players are indexed by 0/1 as in the compact classes.
+
+    `state` is (N, STATE_SIZE) int16, `private` is (N, 2, PRIVATE_SIZE) int8, `deck` is (N, 8) int8 and
+    `deck_pos` is the index of the next card to draw. `winner` is -1 while a game is running.
+    """
+
+    def __init__(self, num_envs, seed=None):
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.state = np.zeros((num_envs, STATE_SIZE), dtype=np.int16)
+        self.private = np.zeros((num_envs, 2, PRIVATE_SIZE), dtype=np.int8)
+        self.deck = np.zeros((num_envs, 8), dtype=np.int8)
+        self.deck_pos = np.zeros(num_envs, dtype=np.int64)
+        self.round = np.ones(num_envs, dtype=np.int64)
+        self.winner = np.full(num_envs, -1, dtype=np.int8)
+        self.num_wins = np.zeros((num_envs, 2), dtype=np.int64)
+        self.reset()
+
+    def reset(self, mask=None):
+        """
+        Starts new games in the selected envs (every env if mask is None).
+        """
+        envs = np.arange(self.num_envs) if mask is None else np.flatnonzero(mask)
+        self.state[envs] = 0
+        self.round[envs] = 1
+        self.winner[envs] = -1
+        self._new_round(envs)
+
+    def _new_round(self, envs):
+        if len(envs) == 0:
+            return
+        state = self.state
+        round_first = (self.round[envs] + 1) % 2
+        state[envs, ACTING_PLAYER] = state[envs, ROUND_FIRST] = round_first
+        state[envs, NUM_CARDS.start + round_first] = 7
+        state[envs, NUM_CARDS.start + 1 - round_first] = 6
+        for s in [GIFT_CARDS, DECISION_CARDS_1_2, DECISION_CARDS_2_2, NUM_ROUND_MOVES, ROUND_MOVE_IDS]:
+            state[envs, s] = 0
+        state[envs, ACTION_CARDS] = 1
+        first, second, deck = deal_batch(len(envs), self.rng)
+        self.private[envs] = 0
+        self.private[envs, round_first, HAND_CARDS] = first
+        self.private[envs, 1 - round_first, HAND_CARDS] = second
+        self.deck[envs] = deck
+        self.deck_pos[envs] = 0
+
+    def acting_player(self):
+        return self.state[:, ACTING_PLAYER].astype(np.int64)
+
+    def round_id(self):
+        """
+        0 if the acting player is the round first player, else 1 (the index of the model to evaluate).
+        """
+        return (self.state[:, ACTING_PLAYER] != self.state[:, ROUND_FIRST]).astype(np.int64)
+
+    def legal_move_mask(self):
+        """
+        Returns a (N, NUM_MOVES) boolean array of the legal global move ids of the acting players. The legal ids of a
+        game in increasing order coincide with GameEnv's legal moves.
+        """
+        n = self.num_envs
+        curr = self.acting_player()
+        state = self.state
+        mask = np.zeros((n, NUM_MOVES), dtype=bool)
+        decision_cards_1_2 = state[:, DECISION_CARDS_1_2]
+        decision_cards_2_2 = state[:, DECISION_CARDS_2_2].reshape(n, 2, 7)
+        has_1_2 = decision_cards_1_2.any(axis=1)
+        has_2_2 = decision_cards_2_2.any(axis=(1, 2))
+        regular = ~has_1_2 & ~has_2_2
+
+        if has_1_2.any():
+            rows = np.flatnonzero(has_1_2)
+            keys = _cards_index(decision_cards_1_2[rows])
+            mask[rows, _RESOLVE_1_2_MOVES] = keys[:, None] == _RESOLVE_1_2_KEYS
+        if has_2_2.any():
+            rows = np.flatnonzero(has_2_2)
+            pile_1 = _cards_index(decision_cards_2_2[rows, 0])
+            pile_2 = _cards_index(decision_cards_2_2[rows, 1])
+            keys = pile_1 * _NUM_CARD_VECTORS + pile_2
+            keys_swapped = pile_2 * _NUM_CARD_VECTORS + pile_1
+            mask[rows, _RESOLVE_2_2_MOVES] = ((keys[:, None] == _RESOLVE_2_2_KEYS) |
+                                              (keys_swapped[:, None] == _RESOLVE_2_2_KEYS))
+        if regular.any():
+            rows = np.flatnonzero(regular)
+            hand = self.private[rows, curr[rows], HAND_CARDS]
+            action_cards = state[rows[:, None], ACTION_CARDS.start + 4 * curr[rows, None] + np.arange(4)]
+            mask[rows, _REGULAR_MOVES] = (_REGULAR_TABLE[_cards_index(hand)] &
+                                          (action_cards[:, _REGULAR_MOVE_TYPES] == 1))
+        return mask
+
+    def step(self, move_ids):
+        """
+        Applies one move (global move id) of the acting player in every running game. Finished rounds are scored,
+        the geisha preferences are updated and a new round is dealt unless the game is won. Returns the boolean mask
+        of the games finished by this step; they stay finished until reset is called.
+        """
+        n = self.num_envs
+        state, private = self.state, self.private
+        running = np.flatnonzero(self.winner < 0)
+        move_ids = np.asarray(move_ids, dtype=np.int64)[running]
+        curr = state[running, ACTING_PLAYER].astype(np.int64)
+        opp = 1 - curr
+        types = MOVE_TYPES[move_ids]
+        cards = MOVE_CARDS[move_ids]
+
+        # Round history (stash and trash are hidden)
+        history_ids = np.where(types == TYPE_0_STASH, HIDDEN_STASH_ID,
+                               np.where(types == TYPE_1_TRASH, HIDDEN_TRASH_ID, move_ids))
+        num_round_moves = state[running, NUM_ROUND_MOVES.start + curr]
+        state[running, ROUND_MOVE_IDS.start + 6 * curr + num_round_moves] = history_ids
+        state[running, NUM_ROUND_MOVES.start + curr] += 1
+
+        # Action card moves
+        played = types <= TYPE_3_CHOOSE_2_2
+        rows, p, t = running[played], curr[played], types[played]
+        state[rows, ACTION_CARDS.start + 4 * p + t] = 0
+        state[rows, NUM_CARDS.start + p] -= MOVE_TYPE_NUM_CARDS[t]
+        state[rows, ACTING_PLAYER] = 1 - p
+        private[rows, p, HAND_CARDS] -= cards[played, 0] + cards[played, 1]
+        for move_type, target in [(TYPE_0_STASH, STASHED_CARD), (TYPE_1_TRASH, TRASHED_CARDS)]:
+            sel = types == move_type
+            private[running[sel], curr[sel], target] = cards[sel, 0]
+        sel = types == TYPE_2_CHOOSE_1_2
+        state[running[sel], DECISION_CARDS_1_2] = cards[sel, 0]
+        sel = types == TYPE_3_CHOOSE_2_2
+        state[running[sel], DECISION_CARDS_2_2] = cards[sel].reshape(-1, 14)
+
+        # Resolve moves
+        sel = types == TYPE_4_RESOLVE_1_2
+        state[running[sel], DECISION_CARDS_1_2] = 0
+        sel = types == TYPE_5_RESOLVE_2_2
+        state[running[sel], DECISION_CARDS_2_2] = 0
+        sel = ~played
+        rows = running[sel]
+        cols = GIFT_CARDS.start + np.arange(7)
+        state[rows[:, None], cols + 7 * curr[sel, None]] += cards[sel, 0]
+        state[rows[:, None], cols + 7 * opp[sel, None]] += cards[sel, 1]
+
+        # End of rounds
+        round_end = state[running][:, NUM_ROUND_MOVES].sum(axis=1) == ROUND_MOVES
+        ended = running[round_end]
+        done = np.zeros(n, dtype=bool)
+        if len(ended):
+            self.update_geisha_preferences(ended)
+            winner = self.is_game_ended(ended)
+            won = winner >= 0
+            self.winner[ended[won]] = winner[won]
+            self.num_wins[ended[won], winner[won]] += 1
+            done[ended[won]] = True
+            next_round = ended[~won]
+            self.round[next_round] += 1
+            self._new_round(next_round)
+
+        # Draw a card for the next player unless a decision is pending
+        draw = running[~round_end & (types != TYPE_2_CHOOSE_1_2) & (types != TYPE_3_CHOOSE_2_2)]
+        nxt = state[draw, ACTING_PLAYER].astype(np.int64)
+        card = self.deck[draw, self.deck_pos[draw]]
+        private[draw, nxt, HAND_CARDS.start + card] += 1
+        state[draw, NUM_CARDS.start + nxt] += 1
+        self.deck_pos[draw] += 1
+        return done
+
+    def update_geisha_preferences(self, envs):
+        gifts = self.state[envs, GIFT_CARDS].reshape(-1, 2, 7) + self.private[envs, :, STASHED_CARD]
+        preferences = self.state[envs, GEISHA_PREFERENCES].reshape(-1, 2, 7)
+        tie = gifts[:, 0] == gifts[:, 1]
+        first = (gifts[:, 0] > gifts[:, 1]) | (tie & (preferences[:, 0] == 1))
+        second = (gifts[:, 0] < gifts[:, 1]) | (tie & (preferences[:, 1] == 1))
+        self.state[envs, GEISHA_PREFERENCES] = np.concatenate([first, second], axis=1)
+
+    def is_game_ended(self, envs):
+        """
+        Returns the winner index of the given envs, -1 where the game goes on.
+        """
+        preferences = self.state[envs, GEISHA_PREFERENCES].reshape(-1, 2, 7)
+        geisha_points = preferences @ POINTS
+        geisha_wins = preferences.sum(axis=2)
+        winner = np.full(len(envs), -1, dtype=np.int8)
+        # Same precedence as GameEnv.is_game_ended
+        for rule in [geisha_points >= 11, geisha_wins >= 4]:
+            for player in (FIRST, SECOND):
+                winner = np.where((winner < 0) & rule[:, player], player, winner).astype(np.int8)
+        return winner
+
+    def get_obs(self):
+        """
+        Batched get_obs features of the acting players. Returns `x_no_move` (N, X_NO_MOVE_FEATURE_SIZE) int8 and
+        `z` (N, ROUND_MOVES, MOVE_VECTOR_SIZE) int8, with the same layout as env.get_obs.
+        """
+        n = self.num_envs
+        envs = np.arange(n)
+        state = self.state
+        curr = self.acting_player()
+        opp = 1 - curr
+        private = self.private[envs, curr]
+
+        def per_player(s, size, player):
+            return state[envs[:, None], s.start + size * player[:, None] + np.arange(size)]
+
+        hand_cards = private[:, HAND_CARDS]
+        stashed_card = private[:, STASHED_CARD]
+        trashed_cards = private[:, TRASHED_CARDS]
+        decision_cards_1_2 = state[:, DECISION_CARDS_1_2]
+        decision_cards_2_2 = state[:, DECISION_CARDS_2_2]
+        gift_cards = per_player(GIFT_CARDS, 7, curr)
+        gift_cards_opp = per_player(GIFT_CARDS, 7, opp)
+        all_gift_cards = gift_cards + stashed_card
+        unknown_cards = (POINTS - hand_cards - all_gift_cards - trashed_cards - gift_cards_opp - decision_cards_1_2
+                         - decision_cards_2_2[:, :7] - decision_cards_2_2[:, 7:])
+        num_cards = state[envs, NUM_CARDS.start + curr]
+        num_cards_opp = state[envs, NUM_CARDS.start + opp]
+        x_no_move = np.concatenate([
+            np.broadcast_to(POINTS, (n, 7)),
+            per_player(GEISHA_PREFERENCES, 7, curr) - per_player(GEISHA_PREFERENCES, 7, opp),
+            hand_cards,
+            stashed_card,
+            trashed_cards,
+            decision_cards_1_2,
+            decision_cards_2_2,
+            per_player(ACTION_CARDS, 4, curr),
+            per_player(ACTION_CARDS, 4, opp),
+            gift_cards,
+            gift_cards_opp,
+            all_gift_cards,
+            _ONE_HOT[num_cards],
+            _ONE_HOT[num_cards_opp],
+            unknown_cards,
+        ], axis=1).astype(np.int8)
+        assert x_no_move.shape[1] == X_NO_MOVE_FEATURE_SIZE
+
+        # The most recent moves are on index 5 (own) and 11 (opponent), padding goes to the front
+        slots = np.arange(6)
+        history = state[:, ROUND_MOVE_IDS].reshape(n, 2, 6).astype(np.int64)
+        num_round_moves = state[:, NUM_ROUND_MOVES].astype(np.int64)
+
+        def history_ids(player):
+            length = num_round_moves[envs, player][:, None]
+            pos = slots - (6 - length)
+            ids = history[envs[:, None], player[:, None], np.maximum(pos, 0)]
+            return np.where(pos >= 0, ids, _PAD_ID)
+
+        z = np.concatenate([_MY_MOVE_ARRAYS[history_ids(curr)], _OPP_MOVE_ARRAYS[history_ids(opp)]], axis=1)
+        return x_no_move, z
@@ -1,45 +1,105 @@
+import hashlib
+import logging
+import os
+
 import torch
 import numpy as np
 
 from hanamikoji.env.env import get_obs
 
-def _load_model(round_id, ckpt_dir_path):
-    from hanamikoji.dmc.models import model_dict
+log = logging.getLogger('hanamikojizero')
+
+
+def checkpoint_digest(path):
+    """
+    The sha256 of a checkpoint file, a factorized export records the digest of the checkpoint it was made from.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _load_factorized(factorized_ckpt_path, ckpt_path, map_location):
+    """
+    Returns the state dict of the factorized export if it was made from the current checkpoint, else None.
+    """
+    if not os.path.exists(factorized_ckpt_path):
+        return None
+    export = torch.load(factorized_ckpt_path, map_location=map_location)
+    if not isinstance(export, dict) or export.get('source_digest') != checkpoint_digest(ckpt_path):
+        log.warning('%s was not exported from the current %s, factorizing the checkpoint instead',
+                    factorized_ckpt_path, ckpt_path)
+        return None
+    return export['state_dict']
+
+
+def load_model(round_id, ckpt_dir_path, factorized=False):
+    """
+    Loads the model of round_id from <ckpt_dir_path>/<round_id>.ckpt for inference. With factorized=True it
+    returns a FactorizedLstmModel: the <round_id>_factorized.ckpt export of factorize.py if it was made from the
+    current checkpoint, else the checkpoint is factorized when loaded.
+    """
+    from hanamikoji.dmc.models import model_dict, FactorizedLstmModel
+    map_location = 'cuda:0' if torch.cuda.is_available() else 'cpu'
     ckpt_path = ckpt_dir_path + '/' + round_id + '.ckpt'
+    factorized_ckpt_path = ckpt_dir_path + '/' + round_id + '_factorized.ckpt'
+    state_dict = _load_factorized(factorized_ckpt_path, ckpt_path, map_location) if factorized else None
+    if state_dict is not None:
+        model = FactorizedLstmModel()
+        model.load_state_dict(state_dict)
+        if torch.cuda.is_available():
+            model.cuda()
+        model.eval()
+        return model
     model = model_dict[round_id]()
     model_state_dict = model.state_dict()
-    if torch.cuda.is_available():
-        pretrained = torch.load(ckpt_path, map_location='cuda:0')
-    else:
-        pretrained = torch.load(ckpt_path, map_location='cpu')
+    pretrained = torch.load(ckpt_path, map_location=map_location)
     pretrained = {k: v for k, v in pretrained.items() if k in model_state_dict}
     model_state_dict.update(pretrained)
     model.load_state_dict(model_state_dict)
     if torch.cuda.is_available():
         model.cuda()
     model.eval()
+    if factorized:
+        model = FactorizedLstmModel.from_model(model)
     return model
 
 class DeepAgent:
 
-    def __init__(self, ckpt_dir_path):
-        self.model_first = _load_model('first', ckpt_dir_path)
-        self.model_second = _load_model('second', ckpt_dir_path)
+    def __init__(self, ckpt_dir_path, factorized=False):
+        """
+        With factorized=True the FactorizedLstmModel export of the checkpoints is used (see factorize.py).
+        """
+        self.factorized = factorized
+        self.model_first = load_model('first', ckpt_dir_path, factorized)
+        self.model_second = load_model('second', ckpt_dir_path, factorized)
+        # Optional ObsEncoder of the GameEnv the agent currently plays in, set by the caller (see simulation.py).
+        # Without it the observations are encoded from the infoset.
+        self.obs_encoder = None
 
     def act(self, infoset):
         if len(infoset[1].moves) == 1:
             return infoset[1].moves[0]
 
-        obs = get_obs(infoset) 
+        if self.obs_encoder is not None:
+            obs = self.obs_encoder.get_obs()
+        else:
+            obs = get_obs(infoset)
 
-        z_batch = torch.from_numpy(obs['z_batch']).float()
-        x_batch = torch.from_numpy(obs['x_batch']).float()
-        if torch.cuda.is_available():
-            z_batch, x_batch = z_batch.cuda(), x_batch.cuda()
         if infoset[0].id_to_round_id[infoset[0].acting_player_id] == 'first':
-            y_pred = self.model_first.forward(z_batch, x_batch, return_value=True)['values']
+            model = self.model_first
         else:
-            y_pred = self.model_second.forward(z_batch, x_batch, return_value=True)['values']
+            model = self.model_second
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # The history is the same for every move, so the model encodes it once
+        z = torch.from_numpy(obs['z']).float().unsqueeze(0).to(device)
+        with torch.no_grad():
+            if self.factorized:
+                x_no_move = torch.from_numpy(obs['x_no_move']).float().unsqueeze(0).to(device)
+                move_ids = torch.tensor(obs['move_ids']).to(device)
+                y_pred = model.forward(z, x_no_move, move_ids)
+            else:
+                x_batch = torch.from_numpy(obs['x_batch']).float().to(device)
+                y_pred = model.forward(z, x_batch, return_value=True)['values']
         y_pred = y_pred.detach().cpu().numpy()
 
         best_move_index = np.argmax(y_pred, axis=0)[0]
@@ -0,0 +1,125 @@
+"""
+Sequential stopping rules of a head-to-head evaluation. Every deal is
+played with both seatings, the sample of a deal is the score of first on
+the pair (0, 0.5 or 1), so the luck of the deal mostly cancels out. The
+rules are updated with the pairs as the evaluation chunks finish and tell
+when the result is decided.
+"""
+import math
+from statistics import NormalDist
+
+
+class _SequentialTest:
+
+    def __init__(self, confidence=0.95, min_games=1000):
+        self.confidence = confidence
+        self.min_games = min_games
+        self.num_pairs = 0
+        self.score_sum = 0.0
+        self.score_sq_sum = 0.0
+
+    def update(self, pair_wins):
+        """
+        Adds the pairs of a chunk, pair_wins holds the wins of first (0, 1 or 2) on each deal.
+        """
+        for wins in pair_wins:
+            score = wins / 2
+            self.num_pairs += 1
+            self.score_sum += score
+            self.score_sq_sum += score * score
+
+    @property
+    def num_games(self):
+        return 2 * self.num_pairs
+
+    @property
+    def win_rate(self):
+        return self.score_sum / self.num_pairs if self.num_pairs else 0.5
+
+    @property
+    def variance(self):
+        """
+        Variance of the pair scores.
+        """
+        if not self.num_pairs:
+            return 0.0
+        return max(self.score_sq_sum / self.num_pairs - self.win_rate ** 2, 0.0)
+
+    def interval(self):
+        """
+        Normal approximation of the confidence interval of the win rate of first.
+        """
+        if not self.num_pairs:
+            return 0.0, 1.0
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        half_width = z * math.sqrt(self.variance / self.num_pairs)
+        return self.win_rate - half_width, self.win_rate + half_width
+
+    def done(self):
+        return False
+
+    def summary(self):
+        low, high = self.interval()
+        return 'games={}, win rate of first={:.4f}, {:.0%} interval=[{:.4f}, {:.4f}]'.format(
+            self.num_games, self.win_rate, self.confidence, low, high)
+
+
+class SPRT(_SequentialTest):
+    """
+    Sequential probability ratio test of H0: the win rate of first is p0
+    against H1: it is p1, with error rates alpha and beta. The log
+    likelihood ratio uses the normal approximation of the pair scores
+    (as the GSPRT of chess engine testing).
+    """
+
+    def __init__(self, p0=0.5, p1=0.55, alpha=0.05, beta=0.05, confidence=0.95, min_games=1000):
+        super().__init__(confidence, min_games)
+        self.p0 = p0
+        self.p1 = p1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def llr(self):
+        if self.variance == 0:
+            return 0.0
+        return self.num_pairs * (self.p1 - self.p0) * (2 * self.win_rate - self.p0 - self.p1) / (2 * self.variance)
+
+    def decision(self):
+        """
+        'H1' (first reaches p1), 'H0' (first stays at p0) or None while undecided.
+        """
+        if self.num_games < self.min_games:
+            return None
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+    def done(self):
+        return self.decision() is not None
+
+    def summary(self):
+        return '{}, LLR={:.3f} [{:.3f}, {:.3f}], decision={}'.format(
+            super().summary(), self.llr(), self.lower, self.upper, self.decision())
+
+
+class ConfidenceStop(_SequentialTest):
+    """
+    Stops once the confidence interval of the win rate is narrower than
+    width, i.e. the win rate is measured with the wanted precision. It does
+    not stop when the interval merely excludes 0.5: the interval is checked
+    after every chunk, so such a rule would decide far more often than the
+    nominal confidence suggests, use SPRT for that.
+    """
+
+    def __init__(self, width=0.02, confidence=0.95, min_games=1000):
+        super().__init__(confidence, min_games)
+        self.width = width
+
+    def done(self):
+        if self.num_games < self.min_games:
+            return False
+        low, high = self.interval()
+        return high - low <= self.width
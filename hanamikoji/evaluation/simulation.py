@@ -1,11 +1,16 @@
 import multiprocessing as mp
-import pickle
-from copy import deepcopy
+import os
+import queue
+import tempfile
+import time
 
-from hanamikoji.env.game import GameEnv
+from hanamikoji.env.deals import LEGACY_DEALS_PER_GAME, load_deals, save_deals
+from hanamikoji.env.env import ObsEncoder
+from hanamikoji.env.game import GameEnv, DEALS_PER_GAME
+from hanamikoji.profiling import create_profiler
 
 
-def load_card_play_models(card_play_model_path_dict):
+def load_card_play_models(card_play_model_path_dict, factorized=False):
     players = {}
 
     for player_id in ['first', 'second']:
@@ -14,72 +19,162 @@ def load_card_play_models(card_play_model_path_dict):
             players[player_id] = RandomAgent()
         else:
             from .deep_agent import DeepAgent
-            players[player_id] = DeepAgent(card_play_model_path_dict[player_id])
+            players[player_id] = DeepAgent(card_play_model_path_dict[player_id], factorized)
     return players
 
 
-def mp_simulate(card_play_data_list, card_play_model_path_dict, q):
-    players = load_card_play_models(card_play_model_path_dict)
+def mp_simulate(deal_file, task_queue, result_queue, card_play_model_path_dict, factorized=False, profiler=None,
+                stop_event=None):
+    """
+    Evaluation worker. It takes chunks of games from task_queue until it
+    gets None, plays every game of a chunk with both seatings and puts
+    (chunk_id, pair_wins) into result_queue, pair_wins holding the wins of
+    first (0, 1 or 2) on each game. A chunk is (chunk_id, start, stop),
+    the range of its deals in the .npy deal_file, the deals of a game are
+    DEALS_PER_GAME consecutive entries. The deep agents take their
+    observations from the ObsEncoder of the GameEnv they play in. Once
+    stop_event is set the worker drops its remaining games and exits, its
+    profiler is closed either way.
+    """
+    deals = load_deals(deal_file)
+    players = load_card_play_models(card_play_model_path_dict, factorized)
     players_2 = {'first': players['second'], 'second': players['first']}
     envs = [GameEnv(players), GameEnv(players_2)]
-    envs[0].card_play_data = envs[1].card_play_data = card_play_data_list
-    for idx in range(10000):
+    encoding_players = [player for player in players.values() if hasattr(player, 'obs_encoder')]
+    if encoding_players:
         for env in envs:
-            card_play_data = deepcopy(env.get_new_round_play_data())
-            env.card_play_init(card_play_data)
-            while not env.winner:
-                env.step()
-            env.reset()
-        if idx % 1000 == 0:
-            print(f'game={idx}, {envs[0].num_wins['first'] + envs[1].num_wins['second']} - {envs[0].num_wins['second'] + envs[1].num_wins['first']}')
-    print(f'Final: {envs[0].num_wins['first'] + envs[1].num_wins['second']} - {envs[0].num_wins['second'] + envs[1].num_wins['first']}')
-    q.put((envs[0].num_wins['first'] + envs[1].num_wins['second'],
-           envs[0].num_wins['second'] + envs[1].num_wins['first']
-           ))
-
-
-def data_allocation_per_worker(card_play_data_list, num_workers):
-    card_play_data_list_each_worker = [[] for k in range(num_workers)]
-    for idx, data in enumerate(card_play_data_list):
-        card_play_data_list_each_worker[idx % num_workers].append(data)
-
-    return card_play_data_list_each_worker
-
-
-def evaluate(first, second, eval_data, num_workers):
-    with open(eval_data, 'rb') as f:
-        card_play_data_list = pickle.load(f)
-
-    card_play_data_list_each_worker = data_allocation_per_worker(
-        card_play_data_list, num_workers)
-    del card_play_data_list
-
+            env.obs_encoder = ObsEncoder(env)
+    while True:
+        task = task_queue.get()
+        if task is None or (stop_event is not None and stop_event.is_set()):
+            break
+        chunk_id, start, stop = task
+        card_play_data_list = deals[start:stop]
+        num_games = len(card_play_data_list) // DEALS_PER_GAME
+        for env in envs:
+            env.card_play_data = card_play_data_list
+            env.num_wins = {'first': 0, 'second': 0}
+        pair_wins = []
+        for _ in range(num_games):
+            if stop_event is not None and stop_event.is_set():
+                break
+            if profiler is not None:
+                profiler.step()
+            winners = []
+            for env in envs:
+                for player in encoding_players:
+                    player.obs_encoder = env.obs_encoder
+                card_play_data = env.get_new_round_play_data()
+                env.card_play_init(card_play_data)
+                while not env.winner:
+                    env.step()
+                winners.append(env.winner)
+                env.reset()
+            # first plays the first seat of envs[0] and the second seat of envs[1]
+            pair_wins.append((winners[0] == 'first') + (winners[1] == 'second'))
+        result_queue.put((chunk_id, pair_wins))
+    if profiler is not None:
+        profiler.close()
+
+
+def evaluate(first, second, eval_data, num_workers, factorized=False, profile_flags=None, chunk_size=50,
+             stopping=None, pickle_deals_per_game=LEGACY_DEALS_PER_GAME):
+    """
+    Plays every game of eval_data with both seatings. The games are split
+    into chunks of chunk_size games, which the workers take from a shared
+    queue, so a fast worker plays more chunks. The results are reported as
+    the chunks finish. profile_flags holds the --profile options of
+    evaluate.py, the profiled workers are worker_<index>. stopping is an
+    optional sequential test (see hanamikoji.evaluation.sequential), the
+    evaluation stops early once it is done.
+    eval_data is a deal file (see hanamikoji.env.deals) which the workers
+    map into memory, a legacy pickle with pickle_deals_per_game deals per
+    game is converted to a temporary one.
+    Returns the number of wins of first and second.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if not eval_data.endswith('.npy'):
+            deal_file = os.path.join(tmpdir, 'eval_data.npy')
+            save_deals(deal_file, load_deals(eval_data, pickle_deals_per_game).cards)
+            eval_data = deal_file
+        return _evaluate(first, second, eval_data, num_workers, factorized, profile_flags, chunk_size, stopping)
+
+
+def _evaluate(first, second, eval_data, num_workers, factorized, profile_flags, chunk_size, stopping):
     card_play_model_path_dict = {
         'first': first,
         'second': second
     }
 
-    num_first_wins = 0
-    num_second_wins = 0
-
+    num_games = len(load_deals(eval_data)) // DEALS_PER_GAME
+    chunk_deals = chunk_size * DEALS_PER_GAME
     ctx = mp.get_context('spawn')
-    q = ctx.SimpleQueue()
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    stop_event = ctx.Event()
+    num_chunks = 0
+    for start in range(0, num_games * DEALS_PER_GAME, chunk_deals):
+        task_queue.put((num_chunks, start, min(start + chunk_deals, num_games * DEALS_PER_GAME)))
+        num_chunks += 1
+    for _ in range(num_workers):
+        task_queue.put(None)
+
     processes = []
-    for card_play_data in card_play_data_list_each_worker:
+    for i in range(num_workers):
+        profiler = None
+        if profile_flags is not None:
+            profiler = create_profiler(profile_flags, profile_flags.profile_dir, 'worker_%i' % i)
         p = ctx.Process(
             target=mp_simulate,
-            args=(card_play_data, card_play_model_path_dict, q))
+            args=(eval_data, task_queue, result_queue, card_play_model_path_dict, factorized, profiler, stop_event))
         p.start()
         processes.append(p)
 
+    num_first_wins = 0
+    num_second_wins = 0
+    num_played = 0
+    stop = False
+    start_time = last_print_time = time.time()
+    for num_done in range(1, num_chunks + 1):
+        while True:
+            try:
+                _, pair_wins = result_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not any(p.is_alive() for p in processes):
+                    raise RuntimeError('The evaluation workers exited before finishing the games')
+        num_played += 2 * len(pair_wins)
+        num_first_wins += sum(pair_wins)
+        num_second_wins += 2 * len(pair_wins) - sum(pair_wins)
+        if stopping is not None:
+            stopping.update(pair_wins)
+            stop = stopping.done()
+        if time.time() - last_print_time >= 1 or num_done == num_chunks or stop:
+            last_print_time = time.time()
+            print('games={}/{} ({:.1f} games/s), first : second - {} : {}'.format(
+                num_played, 2 * num_games, num_played / (last_print_time - start_time), num_first_wins,
+                num_second_wins), flush=True)
+        if stop:
+            print('Stopped early after {} games'.format(num_played))
+            break
+
+    if stop:
+        # The remaining chunks are dropped, the workers exit after their current game so the profilers write
+        # their traces. Their last results are read and ignored, a worker can not exit with unsent results.
+        stop_event.set()
+        task_queue.cancel_join_thread()
+        for p in processes:
+            while p.is_alive():
+                try:
+                    result_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
     for p in processes:
         p.join()
 
-    for i in range(num_workers):
-        result = q.get()
-        num_first_wins += result[0]
-        num_second_wins += result[1]
-
     num_total_wins = num_first_wins + num_second_wins
     print('Results:')
     print('first : second - {} : {}'.format(num_first_wins / num_total_wins, num_second_wins / num_total_wins))
+    if stopping is not None:
+        print(stopping.summary())
+    return num_first_wins, num_second_wins
@@ -0,0 +1,88 @@
+"""
+On-demand profiling of a bounded window of a process (see --profile of
+train.py and evaluate.py). The window skips the first `skip` steps, then
+profiles `steps` steps and writes the traces into a folder: <name>.pstats
+for cProfile and <name>.trace.json (Chrome trace) for torch.profiler.
+"""
+import cProfile
+import logging
+import os
+import threading
+
+import torch
+
+PROFILE_MODES = ['cprofile', 'torch', 'both']
+
+log = logging.getLogger('hanamikojizero')
+
+# torch.profiler records the whole process and only one can run at a time,
+# so with several profiled threads (e.g. the learners) the first one wins
+_torch_profile_lock = threading.Lock()
+
+
+class Profiler:
+
+    def __init__(self, mode, outdir, name, steps, skip=0):
+        assert mode in PROFILE_MODES
+        self.mode = mode
+        self.outdir = outdir
+        self.name = name
+        self.start_step = skip
+        self.stop_step = skip + steps
+        self.num_steps = 0
+        self.cprofile = None
+        self.torch_profile = None
+
+    def step(self):
+        """
+        Called once per iteration of the profiled loop.
+        """
+        if self.num_steps == self.start_step:
+            self._start()
+        self.num_steps += 1
+        if self.num_steps == self.stop_step:
+            self._stop()
+
+    def close(self):
+        """
+        Writes the traces if the window is still open (e.g. the loop ended early).
+        """
+        if self.start_step < self.num_steps < self.stop_step:
+            self._stop()
+
+    def _start(self):
+        if self.mode in ['cprofile', 'both']:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if self.mode in ['torch', 'both']:
+            if not _torch_profile_lock.acquire(blocking=False):
+                log.warning('torch.profiler is already running in this process, skipping the torch trace of %s', self.name)
+                return
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.torch_profile = torch.profiler.profile(activities=activities)
+            self.torch_profile.start()
+
+    def _stop(self):
+        os.makedirs(self.outdir, exist_ok=True)
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(os.path.join(self.outdir, self.name + '.pstats'))
+            self.cprofile = None
+        if self.torch_profile is not None:
+            self.torch_profile.stop()
+            self.torch_profile.export_chrome_trace(os.path.join(self.outdir, self.name + '.trace.json'))
+            self.torch_profile = None
+            _torch_profile_lock.release()
+
+
+def create_profiler(flags, outdir, target, name=None):
+    """
+    Returns a Profiler if flags.profile is set and `target` is one of
+    flags.profile_targets (comma separated), otherwise None. The traces are
+    named after name, the target by default.
+    """
+    if not flags.profile or target not in flags.profile_targets.split(','):
+        return None
+    return Profiler(flags.profile, outdir, name or target, flags.profile_steps, flags.profile_skip)
@@ -0,0 +1,60 @@
+"""
+Lightweight timing counters of the hot path stages. Every process has its
+own `timer`, the stages add their call count and elapsed time to it and
+the training reports the aggregates (see hanamikoji.dmc.utils).
+"""
+import threading
+import time
+
+# The stages timed in the actor processes and in the learner threads
+ACTOR_STAGES = ['legal_moves', 'env_step', 'get_obs', 'format_obs', 'forward', 'buffer_flush', 'free_queue_wait',
+                'full_queue_put']
+LEARNER_STAGES = ['batch_gather', 'forward', 'backward', 'weight_snapshot', 'weight_publish']
+
+
+class StageTimer:
+    """
+    Accumulates the number of calls and the total time of each stage.
+    Usage: `start = time.perf_counter(); ...; timer.add('stage', start)`
+    or `with timer.stage('stage'): ...`.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+            self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+
+    def stage(self, stage):
+        return _Stage(self, stage)
+
+    def write_to(self, stages, out):
+        """
+        Writes the (count, total seconds) of the stages into out, shape = (len(stages), 2).
+        """
+        with self._lock:
+            for i, stage in enumerate(stages):
+                out[i, 0] = self.counts.get(stage, 0)
+                out[i, 1] = self.totals.get(stage, 0.0)
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, self.start)
+
+
+timer = StageTimer()
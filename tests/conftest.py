@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from hanamikoji.env.game import GameEnv
+
+
+class RecordingAgent:
+    """
+    Random agent keeping the infosets it is asked to act on.
+    """
+
+    def __init__(self, rng, infosets):
+        self.rng = rng
+        self.infosets = infosets
+
+    def act(self, infoset):
+        self.infosets.append(infoset)
+        moves = infoset[1].moves
+        return moves[self.rng.randrange(len(moves))]
+
+
+def record_infosets(num_games, seed):
+    """
+    The infosets of every decision of num_games random games.
+    """
+    infosets = []
+    agent = RecordingAgent(random.Random(seed), infosets)
+    env = GameEnv({'first': agent, 'second': agent})
+    for _ in range(num_games):
+        env.card_play_init(env.get_new_round_play_data())
+        while not env.winner:
+            env.step()
+        env.reset()
+    return infosets
+
+
+@pytest.fixture(scope='session')
+def infosets():
+    return record_infosets(100, 0)
@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+
+from hanamikoji.env.compact import CompactGameState, CompactPrivateInfoSet, PLAYER_IDS, STASHED_CARD
+from hanamikoji.env.game import GameEnv
+from hanamikoji.env.move_generator import move2id
+
+STATE_FIELDS = ['acting_player_id', 'id_to_round_id', 'gift_cards', 'action_cards', 'decision_cards_1_2',
+                'decision_cards_2_2', 'geisha_preferences', 'num_cards', 'round_moves', 'round_move_ids']
+
+
+class _ScriptedAgent:
+    def __init__(self):
+        self.move = None
+
+    def act(self, infoset):
+        return self.move
+
+
+def _assert_same_state(compact, state):
+    converted = compact.to_game_state()
+    for field in STATE_FIELDS:
+        assert getattr(converted, field) == getattr(state, field), field
+    assert np.array_equal(CompactGameState.from_game_state(state).data, compact.data)
+
+
+def _assert_same_info(compact, info):
+    converted = compact.to_private_info_set()
+    for field in ['hand_cards', 'stashed_card', 'trashed_cards']:
+        assert getattr(converted, field) == getattr(info, field), field
+    assert np.array_equal(CompactPrivateInfoSet.from_private_info_set(info).data, compact.data)
+
+
+def test_compact_state_follows_game_env():
+    rng = random.Random(3)
+    agent = _ScriptedAgent()
+    env = GameEnv({'first': agent, 'second': agent})
+    for _ in range(100):
+        env.card_play_init(env.get_new_round_play_data())
+        state = CompactGameState()
+        infos = [CompactPrivateInfoSet.from_private_info_set(env.private_info_sets[p]) for p in PLAYER_IDS]
+        while not env.winner:
+            curr = state.acting_player
+            info = env.private_info_sets[PLAYER_IDS[curr]]
+            assert infos[curr].get_moves_and_ids(state)[1].tolist() == info.move_ids.tolist()
+            deck, deck_pos = env.deck, env.deck_pos
+            agent.move = rng.choice(info.moves)
+            env.step()
+            move_id = move2id(agent.move)
+            draw = state.apply_move(move_id)
+            infos[curr].apply_move(move_id)
+            if state.num_round_moves() == 12:
+                state.update_geisha_preferences(np.stack([infos[0].data[STASHED_CARD], infos[1].data[STASHED_CARD]]))
+                winner = state.is_game_ended()
+                assert (PLAYER_IDS[winner] if winner is not None else None) == env.winner
+                if winner is not None:
+                    break
+                state.new_round()
+                infos = [CompactPrivateInfoSet.from_private_info_set(env.private_info_sets[p]) for p in PLAYER_IDS]
+            elif draw:
+                infos[state.acting_player].draw(deck[deck_pos])
+                state.draw(state.acting_player)
+            _assert_same_state(state, env.state)
+            for player, player_id in enumerate(PLAYER_IDS):
+                _assert_same_info(infos[player], env.private_info_sets[player_id])
+        env.reset()
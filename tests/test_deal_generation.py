@@ -0,0 +1,49 @@
+import numpy as np
+
+from hanamikoji.env import deals
+from hanamikoji.env.deals import generate_deals, hand_counts
+from hanamikoji.env.env import Env
+from hanamikoji.env.game import deck
+from hanamikoji.env.vec_game import deal_batch
+
+
+def test_generate_deals_depends_only_on_the_seed(tmp_path, monkeypatch):
+    # Small blocks, so the workers fill several of them
+    monkeypatch.setattr(deals, '_BLOCK_SIZE', 1000)
+    paths = [str(tmp_path / name) for name in ['a.npy', 'b.npy', 'c.npy', 'd.npy']]
+    generate_deals(paths[0], 3500, seed=7)
+    generate_deals(paths[1], 3500, seed=7, num_workers=2)
+    generate_deals(paths[2], 3500, seed=7)
+    generate_deals(paths[3], 3500, seed=8)
+    cards = [np.load(path) for path in paths]
+    assert np.array_equal(cards[0], cards[1])
+    assert np.array_equal(cards[0], cards[2])
+    assert not np.array_equal(cards[0], cards[3])
+    assert np.array_equal(np.sort(cards[0], axis=1), np.tile(np.sort(deck), (3500, 1)))
+
+
+def test_hand_counts():
+    cards = np.array([[0, 0, 6, 3], [5, 4, 3, 2]])
+    assert hand_counts(cards).tolist() == [[2, 0, 0, 1, 0, 0, 1], [0, 0, 1, 1, 1, 1, 0]]
+
+
+def test_seeded_dealing_is_deterministic():
+    first, second, remaining = deal_batch(64, np.random.default_rng(3))
+    first_2, second_2, remaining_2 = deal_batch(64, np.random.default_rng(3))
+    assert np.array_equal(first, first_2) and np.array_equal(second, second_2)
+    assert np.array_equal(remaining, remaining_2)
+
+    # Env deals its rounds from its seed
+    runs = []
+    for _ in range(2):
+        env = Env('wp', seed=5)
+        rng = np.random.default_rng(6)
+        obs = env.reset()
+        features = []
+        for _ in range(500):
+            features.append(obs['x_no_move'].tobytes())
+            obs, _, done, _ = env.step(rng.choice(obs['move_ids']))
+            if done:
+                obs = env.reset()
+        runs.append(features)
+    assert runs[0] == runs[1]
@@ -0,0 +1,56 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from hanamikoji.env.deals import DECK_SIZE, DealArray, DealStream, LEGACY_DEALS_PER_GAME, deal_cards, \
+    deals_to_array, load_deals, save_deals
+from hanamikoji.env.game import DEALS_PER_GAME, deck, get_card_play_data
+
+
+def _assert_valid_deal(card_play_data):
+    assert sum(card_play_data['first']) == 7
+    assert sum(card_play_data['second']) == 6
+    assert len(card_play_data['deck']) == 8
+    counts = np.array(card_play_data['first']) + np.array(card_play_data['second']) + np.bincount(
+        card_play_data['deck'], minlength=7)
+    assert counts.tolist() == np.bincount(deck).tolist()
+
+
+def test_deal_file_round_trip(tmp_path):
+    np.random.seed(0)
+    card_play_data_list = [get_card_play_data() for _ in range(3 * DEALS_PER_GAME)]
+    path = str(tmp_path / 'deals.npy')
+    save_deals(path, deals_to_array(card_play_data_list))
+    deals = load_deals(path)
+    assert len(deals) == len(card_play_data_list)
+    assert [deals[i] for i in range(len(deals))] == card_play_data_list
+    view = deals[DEALS_PER_GAME:2 * DEALS_PER_GAME]
+    assert isinstance(view, DealArray)
+    assert [view[i] for i in range(len(view))] == card_play_data_list[DEALS_PER_GAME:2 * DEALS_PER_GAME]
+
+
+def test_legacy_pickle_keeps_the_first_deals_of_every_game(tmp_path):
+    np.random.seed(1)
+    num_games = 3
+    card_play_data_list = [get_card_play_data() for _ in range(num_games * LEGACY_DEALS_PER_GAME)]
+    path = str(tmp_path / 'deals.pkl')
+    with open(path, 'wb') as f:
+        pickle.dump(card_play_data_list, f)
+    deals = load_deals(path)
+    assert len(deals) == num_games * DEALS_PER_GAME
+    for game in range(num_games):
+        for r in range(DEALS_PER_GAME):
+            assert deals[game * DEALS_PER_GAME + r] == card_play_data_list[game * LEGACY_DEALS_PER_GAME + r]
+    with pytest.raises(ValueError):
+        load_deals(path, pickle_deals_per_game=LEGACY_DEALS_PER_GAME + 1)
+
+
+def test_deal_stream_matches_deal_array():
+    stream = DealStream(np.random.default_rng(4), batch_size=16)
+    deals = DealArray(deal_cards(16, np.random.default_rng(4)))
+    stream_deals = [stream() for _ in range(16)]
+    assert stream_deals == [deals[i] for i in range(16)]
+    for card_play_data in stream_deals + [stream() for _ in range(16)]:
+        _assert_valid_deal(card_play_data)
+    assert deals.cards.shape == (16, DECK_SIZE)
@@ -0,0 +1,34 @@
+import numpy as np
+import torch
+
+from hanamikoji.dmc.features import featurize
+from hanamikoji.dmc.utils import expand_round_move_ids
+from hanamikoji.env.env import Env, get_obs
+
+
+def test_featurize_matches_get_obs(infosets):
+    obs_list = [get_obs(infoset) for infoset in infosets]
+    raw_obs_list = [get_obs(infoset, raw=True) for infoset in infosets]
+    x_raw = torch.stack([torch.from_numpy(obs['x_raw']) for obs in raw_obs_list])
+    x_no_move = torch.stack([torch.from_numpy(obs['x_no_move']) for obs in obs_list])
+    assert torch.equal(featurize(x_raw), x_no_move)
+    for obs, raw_obs in zip(obs_list, raw_obs_list):
+        assert np.array_equal(obs['z_ids'], raw_obs['z_ids'])
+        assert np.array_equal(obs['move_ids'], raw_obs['move_ids'])
+
+
+def test_raw_obs_env():
+    env, raw_env = Env('wp', seed=1), Env('wp', seed=1, raw_obs=True)
+    rng = np.random.default_rng(2)
+    obs, raw_obs = env.reset(), raw_env.reset()
+    for _ in range(2000):
+        assert 'x_raw' not in obs
+        assert 'x_no_move' not in raw_obs and 'x_batch' not in raw_obs
+        assert torch.equal(featurize(torch.from_numpy(raw_obs['x_raw'])), torch.from_numpy(obs['x_no_move']))
+        assert torch.equal(expand_round_move_ids(torch.from_numpy(raw_obs['z_ids'])), torch.from_numpy(obs['z']))
+        move_id = rng.choice(obs['move_ids'])
+        obs, _, done, _ = env.step(move_id)
+        raw_obs, _, raw_done, _ = raw_env.step(move_id)
+        assert done == raw_done
+        if done:
+            obs, raw_obs = env.reset(), raw_env.reset()
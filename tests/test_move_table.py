@@ -0,0 +1,25 @@
+from hanamikoji.env.move_generator import ALL_MOVES, MovesGener, _move_table, get_legal_moves_and_ids, move2id
+
+
+def _gen_moves(state, info):
+    decision_cards_2_2 = state.decision_cards_2_2
+    return MovesGener(list(info.hand_cards),
+                      list(state.action_cards[state.acting_player_id]),
+                      list(state.decision_cards_1_2) if state.decision_cards_1_2 else None,
+                      [list(decision_cards_2_2[0]), list(decision_cards_2_2[1])] if decision_cards_2_2 else None
+                      ).gen_moves()
+
+
+def test_move_table_matches_generated_moves(infosets):
+    num_entries = len(_move_table)
+    for state, info in infosets:
+        moves, move_ids, legal_move_ids = get_legal_moves_and_ids(info.hand_cards,
+                                                                   state.action_cards[state.acting_player_id],
+                                                                   state.decision_cards_1_2,
+                                                                   state.decision_cards_2_2)
+        assert moves == _gen_moves(state, info)
+        assert move_ids.tolist() == [move2id(move) for move in moves]
+        assert legal_move_ids == frozenset(move_ids.tolist())
+        assert [ALL_MOVES[move_id] for move_id in move_ids] == moves
+    # Every reachable input is in the prebuilt table
+    assert len(_move_table) == num_entries
@@ -0,0 +1,25 @@
+import numpy as np
+
+from hanamikoji.env.env import Env, get_obs
+
+
+def _assert_same_obs(obs, expected):
+    assert obs.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, np.ndarray):
+            assert obs[key].dtype == value.dtype, key
+            assert np.array_equal(obs[key], value), key
+        else:
+            assert obs[key] == value, key
+
+
+def test_obs_encoder_matches_get_obs():
+    for raw in [False, True]:
+        env = Env('wp', seed=3, raw_obs=raw)
+        rng = np.random.default_rng(0)
+        obs = env.reset()
+        for _ in range(5000):
+            _assert_same_obs(obs, get_obs(env.infoset, raw))
+            obs, _, done, _ = env.step(rng.choice(obs['move_ids']))
+            if done:
+                obs = env.reset()
@@ -0,0 +1,60 @@
+import queue
+import random
+
+import numpy as np
+import torch
+
+from hanamikoji.dmc.models import model_dict
+from hanamikoji.env.deals import deal_cards, save_deals
+from hanamikoji.env.env import get_obs
+from hanamikoji.env.game import DEALS_PER_GAME
+from hanamikoji.evaluation import simulation
+from hanamikoji.evaluation.deep_agent import DeepAgent
+
+NUM_GAMES = 5
+
+
+def _simulate(deal_file, ckpt_dir):
+    task_queue, result_queue = queue.Queue(), queue.Queue()
+    task_queue.put((0, 0, NUM_GAMES * DEALS_PER_GAME))
+    task_queue.put(None)
+    simulation.mp_simulate(deal_file, task_queue, result_queue, {'first': ckpt_dir, 'second': 'random'})
+    return result_queue.get()[1]
+
+
+def test_deep_agent_obs_encoder_matches_get_obs(tmp_path, monkeypatch):
+    torch.manual_seed(0)
+    for round_id, model_class in model_dict.items():
+        torch.save(model_class().state_dict(), str(tmp_path / (round_id + '.ckpt')))
+    deal_file = str(tmp_path / 'deals.npy')
+    save_deals(deal_file, deal_cards(NUM_GAMES * DEALS_PER_GAME, np.random.default_rng(0)))
+
+    moves = []
+    num_encoded = [0]
+    act = DeepAgent.act
+
+    def checked_act(self, infoset):
+        if self.obs_encoder is not None:
+            num_encoded[0] += 1
+            obs, expected = self.obs_encoder.get_obs(), get_obs(infoset)
+            for key, value in expected.items():
+                if isinstance(value, np.ndarray):
+                    assert np.array_equal(obs[key], value), key
+                else:
+                    assert obs[key] == value, key
+        move = act(self, infoset)
+        moves.append(move)
+        return move
+
+    monkeypatch.setattr(DeepAgent, 'act', checked_act)
+    # The random agent draws from the global random state
+    random.seed(0)
+    pair_wins = _simulate(deal_file, str(tmp_path))
+    assert num_encoded[0] == len(moves) > 0
+    encoded_moves, moves[:] = list(moves), []
+
+    # Without the encoders the agents fall back to get_obs
+    monkeypatch.setattr(simulation, 'ObsEncoder', lambda env: None)
+    random.seed(0)
+    assert _simulate(deal_file, str(tmp_path)) == pair_wins
+    assert moves == encoded_moves
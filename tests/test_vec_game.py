@@ -0,0 +1,67 @@
+import numpy as np
+
+from hanamikoji.env.compact import CompactGameState, CompactPrivateInfoSet, HAND_CARDS, PLAYER_IDS, ROUND_FIRST
+from hanamikoji.env.env import get_obs
+from hanamikoji.env.game import GameEnv
+from hanamikoji.env.vec_game import VecGameEnv
+
+NUM_ENVS = 16
+
+
+class _ScriptedAgent:
+    def __init__(self):
+        self.move = None
+
+    def act(self, infoset):
+        return self.move
+
+
+def _current_deal(vec, i):
+    round_first = vec.state[i, ROUND_FIRST]
+    return {'first': vec.private[i, round_first, HAND_CARDS].tolist(),
+            'second': vec.private[i, 1 - round_first, HAND_CARDS].tolist(),
+            'deck': vec.deck[i].tolist()}
+
+
+def test_vec_game_env_matches_game_env():
+    rng = np.random.default_rng(5)
+    vec = VecGameEnv(NUM_ENVS, seed=1)
+    # The GameEnvs are dealt the rounds the VecGameEnv dealt
+    pending_deals = [None] * NUM_ENVS
+    agents = [_ScriptedAgent() for _ in range(NUM_ENVS)]
+
+    def new_env(i):
+        env = GameEnv({'first': agents[i], 'second': agents[i]})
+        env.deal_stream = lambda: pending_deals[i]
+        env.card_play_init(_current_deal(vec, i))
+        return env
+
+    envs = [new_env(i) for i in range(NUM_ENVS)]
+    num_games = 0
+    while num_games < 200:
+        mask = vec.legal_move_mask()
+        x_no_move, z = vec.get_obs()
+        move_ids = np.zeros(NUM_ENVS, dtype=np.int64)
+        for i, env in enumerate(envs):
+            info = env.private_info_sets[env.state.acting_player_id]
+            assert np.flatnonzero(mask[i]).tolist() == info.move_ids.tolist()
+            assert np.array_equal(CompactGameState.from_game_state(env.state).data, vec.state[i])
+            for player, player_id in enumerate(PLAYER_IDS):
+                assert np.array_equal(CompactPrivateInfoSet.from_private_info_set(env.private_info_sets[player_id]).data,
+                                      vec.private[i, player])
+            obs = get_obs(env.active_player_info_set)
+            assert np.array_equal(obs['x_no_move'], x_no_move[i])
+            assert np.array_equal(obs['z'], z[i])
+            move_ids[i] = rng.choice(info.move_ids)
+        done = vec.step(move_ids)
+        for i, env in enumerate(envs):
+            pending_deals[i] = _current_deal(vec, i)
+            agents[i].move = int(move_ids[i])
+            env.step()
+            assert (env.winner is not None) == bool(done[i])
+            if done[i]:
+                assert PLAYER_IDS[vec.winner[i]] == env.winner
+                num_games += 1
+        vec.reset(done)
+        for i in np.flatnonzero(done):
+            envs[i] = new_env(i)